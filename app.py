@@ -1,28 +1,103 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, send_file
+from flask import Flask, Request, render_template, request, jsonify, redirect, url_for, send_file, g, has_request_context, after_this_request
+from flask.cli import AppGroup
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timedelta
-from sqlalchemy import func
+from sqlalchemy import func, event, tuple_
+from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session, joinedload, selectinload, object_session
 import os
 import socket
-import qrcode
 import io
 import base64
-import pandas as pd
+import gzip
+import zlib
 from werkzeug.utils import secure_filename
 import webbrowser
 import threading
+import atexit
+import queue
+import csv
+import hashlib
+import hmac
+import secrets
+import sqlite3
+import tempfile
+import json
+import pickle
+import time
+import unicodedata
+import click
+import urllib.request
+import urllib.parse
+from pathlib import Path
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, as_completed
+from concurrent.futures import TimeoutError as FuturoEsgotado  # Antes do 3.11 não é o TimeoutError embutido
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+# pandas, numpy e qrcode são importados dentro das funções que os usam: carregá-los aqui
+# atrasaria em segundos toda inicialização do servidor (ver medir_inicializacao.py)
 
 # Configuração do Flask
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///energia.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('ENERGIA_BANCO_URI', 'sqlite:///energia.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'sua-chave-secreta-aqui-2026'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Limite de 16MB para upload
 app.config['UPLOAD_FOLDER'] = 'uploads'
+app.config['UPLOAD_MEMORIA_BYTES'] = 4 * 1024 * 1024  # Uploads até este tamanho ficam só na memória; acima, em arquivo temporário
+app.config['RELATORIOS_HORARIO'] = '02:00'  # Horário diário de atualização dos relatórios mensais
+app.config['FEDERACAO_MAX_WORKERS'] = 8  # Consultas simultâneas aos sites federados
+app.config['FEDERACAO_TIMEOUT'] = 15  # Tempo máximo (segundos) de espera por site
+app.config['CACHE_FRAGMENTOS_MAX_ITENS'] = 256  # Fragmentos renderizados mantidos em memória (LRU)
+app.config['CACHE_COMPARTILHADO_CAMINHO'] = os.environ.get('ENERGIA_CACHE_CAMINHO')  # Padrão: ao lado do banco (arquivo confiável: lido com pickle)
+app.config['CACHE_COMPARTILHADO_MAX_ITENS'] = 1024  # Fragmentos no arquivo compartilhado entre processos
+app.config['SINCRONIZACAO_MAX_VERSOES'] = 64  # Estados da lista mobile guardados (cursor mais antigo recebe a lista inteira)
+app.config['COMPRESSAO_ATIVA'] = True
+app.config['COMPRESSAO_MIN_BYTES'] = 1024  # Respostas menores que isso vão sem compressão
+app.config['COMPRESSAO_NIVEL'] = 6  # Nível do gzip (1 = rápido, 9 = menor)
+app.config['COMPRESSAO_TIPOS'] = [
+    'text/html', 'text/css', 'text/plain', 'text/csv',
+    'application/json', 'application/javascript', 'image/svg+xml'
+]
+app.config['ORCAMENTO_CONSULTAS_ESTRITO'] = False  # True: rota acima do orçamento de consultas responde 500
+app.config['INGESTAO_INTERVALO_MS'] = 200  # Janela do group commit da API de ingestão
+app.config['INGESTAO_LOTE_MAX'] = 5000  # Máximo de leituras gravadas por transação
+app.config['INGESTAO_MAX_POR_REQUISICAO'] = 10000
+app.config['INGESTAO_FILA_MAX'] = 50000  # Acima disso a API responde 503 até o gravador alcançar
+app.config['INGESTAO_POS_PROCESSAMENTO_S'] = 30  # Intervalo mínimo para atualizar linhas base/previsões
+app.config['PERFIL_CHAVE'] = os.environ.get('ENERGIA_PERFIL_CHAVE')  # Sem chave, só o próprio servidor (localhost) ativa o perfil
+app.config['PERFIS_PASTA'] = None  # Padrão: instance/perfis
+app.config['PERFIS_MAX_ARQUIVOS'] = 50  # Perfis mais antigos são apagados
+app.config['BACKUP_HORARIO'] = '03:00'  # Backup online diário + compactação e ANALYZE
+app.config['BACKUP_PASTA'] = os.environ.get('ENERGIA_BACKUP_PASTA')  # Padrão: instance/backups
+app.config['BACKUP_MANTER'] = 7  # Cópias mantidas (as mais antigas são apagadas)
+app.config['BACKUP_PAGINAS_POR_PASSO'] = 256  # Páginas copiadas/liberadas por passo, sem segurar o banco
+app.config['BACKUP_PAUSA_MS'] = 20  # Pausa entre passos para as gravações dos celulares passarem
+app.config['BACKUP_MAX_REINICIOS'] = 3  # Gravações reiniciam a cópia; depois disso copia tudo de uma vez
+app.config['DISTRIBUICAO_LACUNAS'] = 'proporcional'  # Consumo dos dias sem leitura: 'linear' ou 'proporcional' ao perfil semanal da planta
+app.config['RECALCULO_PROCESSOS'] = None  # Processos do recálculo da frota (padrão: núcleos da CPU)
+app.config['ETIQUETAS_PASTA'] = None  # PNGs das etiquetas QR por quadro (padrão: instance/etiquetas_qr)
+app.config['ETIQUETAS_QR'] = {'box_size': 8, 'border': 2, 'correcao': 'M'}  # Mudar o desenho gera todas de novo
+app.config['ETIQUETAS_PROCESSOS'] = None  # Processos que desenham as etiquetas (padrão: núcleos da CPU)
+app.config['ETIQUETAS_MIN_PARALELO'] = 16  # Menos que isso faltando: desenha no próprio processo
+app.config['ETIQUETAS_MAX_ARQUIVOS'] = 5000  # Acima disso apaga as mais antigas (ex.: de um IP antigo)
 
 # Cria pasta de uploads se não existir
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+
+class RequisicaoEnergia(Request):
+    """Arquivos enviados ficam num buffer em memória que só vai para o disco acima de UPLOAD_MEMORIA_BYTES"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=app.config['UPLOAD_MEMORIA_BYTES'])
+
+
+app.request_class = RequisicaoEnergia
+
 # Inicialização do SQLAlchemy
 db = SQLAlchemy(app)
 
@@ -39,10 +114,15 @@ class Quadro(db.Model):
     nome = db.Column(db.String(100), nullable=False)
     localizacao = db.Column(db.String(200), nullable=False)
     ativo = db.Column(db.Boolean, default=True, nullable=False)
+    area_id = db.Column(db.Integer, db.ForeignKey('areas.id'), nullable=True, index=True)
+    quadro_pai_id = db.Column(db.Integer, db.ForeignKey('quadros.id'), nullable=True, index=True)  # Submedidor de outro quadro
     
     # Relacionamento com leituras
     leituras = db.relationship('Leitura', backref='quadro', lazy=True, cascade='all, delete-orphan')
     
+    # Submedidores (o consumo deles já está contido no quadro pai)
+    submedidores = db.relationship('Quadro', backref=db.backref('quadro_pai', remote_side=[id]), lazy=True)
+    
     def __repr__(self):
         return f'<Quadro {self.nome}>'
     
@@ -52,7 +132,33 @@ class Quadro(db.Model):
             'id': self.id,
             'nome': self.nome,
             'localizacao': self.localizacao,
-            'ativo': self.ativo
+            'ativo': self.ativo,
+            'area_id': self.area_id,
+            'quadro_pai_id': self.quadro_pai_id
+        }
+
+
+class Area(db.Model):
+    """Modelo para representar uma área/prédio que agrupa quadros (pode estar dentro de outra área)"""
+    __tablename__ = 'areas'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(200), nullable=False, unique=True)
+    area_pai_id = db.Column(db.Integer, db.ForeignKey('areas.id'), nullable=True, index=True)
+    
+    # Relacionamentos
+    subareas = db.relationship('Area', backref=db.backref('area_pai', remote_side=[id]), lazy=True)
+    quadros = db.relationship('Quadro', backref='area', lazy=True)
+    
+    def __repr__(self):
+        return f'<Area {self.nome}>'
+    
+    def to_dict(self):
+        """Converte o objeto para dicionário"""
+        return {
+            'id': self.id,
+            'nome': self.nome,
+            'area_pai_id': self.area_pai_id
         }
 
 
@@ -67,6 +173,13 @@ class Leitura(db.Model):
     consumo_dia = db.Column(db.Float, nullable=True)
     alerta_reset = db.Column(db.Boolean, default=False, nullable=False)
     
+    # Índices de cobertura da paginação por (data_registro, id): a ordem do índice já é a
+    # ordem da página e as colunas lidas saem dele, sem consultar a tabela
+    __table_args__ = (
+        db.Index('ix_leituras_quadro_data', 'quadro_id', 'data_registro', 'id', 'valor_leitura', 'consumo_dia', 'alerta_reset'),
+        db.Index('ix_leituras_data', 'data_registro', 'id', 'quadro_id', 'valor_leitura', 'consumo_dia', 'alerta_reset'),
+    )
+    
     def __repr__(self):
         return f'<Leitura {self.id} - Quadro {self.quadro_id}>'
     
@@ -93,10 +206,16 @@ class LeituraRascunho(db.Model):
     valor_leitura = db.Column(db.Float, nullable=False)
     consumo_provisorio = db.Column(db.Float, nullable=True)
     alerta_reset = db.Column(db.Boolean, default=False, nullable=False)
+    sessao_id = db.Column(db.Integer, db.ForeignKey('sessoes_leitura.id'), nullable=True)  # Sessão (equipe) que registrou
     
     # Relacionamento
     quadro = db.relationship('Quadro', backref='leituras_rascunho', lazy=True)
     
+    # Revisão, conflitos e consolidação leem apenas os rascunhos da própria sessão
+    __table_args__ = (
+        db.Index('ix_rascunhos_sessao_quadro', 'sessao_id', 'quadro_id'),
+    )
+    
     def __repr__(self):
         return f'<LeituraRascunho {self.id} - Quadro {self.quadro_id}>'
     
@@ -110,12 +229,13 @@ class LeituraRascunho(db.Model):
             'data_registro': self.data_registro.strftime('%d/%m/%Y %H:%M:%S'),
             'valor_leitura': self.valor_leitura,
             'consumo_provisorio': self.consumo_provisorio,
-            'alerta_reset': self.alerta_reset
+            'alerta_reset': self.alerta_reset,
+            'sessao_id': self.sessao_id
         }
 
 
 class SessaoLeitura(db.Model):
-    """Modelo para controlar sessões de leitura ativas"""
+    """Modelo para controlar sessões de leitura ativas (várias ao mesmo tempo, cada uma com seus quadros)"""
     __tablename__ = 'sessoes_leitura'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -124,6 +244,11 @@ class SessaoLeitura(db.Model):
     data_fim = db.Column(db.DateTime, nullable=True)
     data_referencia = db.Column(db.Date, default=datetime.now().date, nullable=False)  # Data que está sendo registrada
     iniciada_por = db.Column(db.String(100), default='Supervisor', nullable=False)
+    nome = db.Column(db.String(100), nullable=True)  # Ex.: "Equipe Prédio 2"
+    area_id = db.Column(db.Integer, db.ForeignKey('areas.id'), nullable=True)  # Área usada para montar o escopo
+    
+    # Quadros cobertos pela sessão (gravados ao iniciar)
+    quadros = db.relationship('SessaoQuadro', backref='sessao', lazy=True, cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<SessaoLeitura {self.id} - Ativa: {self.ativa}>'
@@ -132,6 +257,8 @@ class SessaoLeitura(db.Model):
         """Converte o objeto para dicionário"""
         return {
             'id': self.id,
+            'nome': self.nome or f'Sessão {self.id}',
+            'area_id': self.area_id,
             'ativa': self.ativa,
             'data_inicio': self.data_inicio.strftime('%d/%m/%Y %H:%M:%S'),
             'data_fim': self.data_fim.strftime('%d/%m/%Y %H:%M:%S') if self.data_fim else None,
@@ -140,1543 +267,6986 @@ class SessaoLeitura(db.Model):
         }
 
 
-# ========================================
-# FUNÇÕES DE INICIALIZAÇÃO
-# ========================================
-
-def migrar_banco_se_necessario():
-    """Verifica e aplica migrações necessárias no banco de dados"""
-    import sqlite3
+class SessaoQuadro(db.Model):
+    """Modelo para o escopo de uma sessão de leitura: um quadro só pode estar em uma sessão ativa"""
+    __tablename__ = 'sessoes_leitura_quadros'
     
-    db_path = 'instance/energia.db'
-    
-    # Verifica se o banco existe
-    if not os.path.exists(db_path):
-        return  # Banco novo, será criado com a estrutura correta
+    sessao_id = db.Column(db.Integer, db.ForeignKey('sessoes_leitura.id'), primary_key=True)
+    quadro_id = db.Column(db.Integer, db.ForeignKey('quadros.id'), primary_key=True, index=True)
     
-    try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Verifica se a coluna 'data_referencia' existe na tabela 'sessoes_leitura'
-        cursor.execute("PRAGMA table_info(sessoes_leitura)")
-        colunas = [coluna[1] for coluna in cursor.fetchall()]
-        
-        if 'data_referencia' not in colunas:
-            print("🔄 Aplicando migração: adicionando coluna 'data_referencia'...")
-            
-            # Adiciona a coluna com valor padrão
-            cursor.execute("""
-                ALTER TABLE sessoes_leitura 
-                ADD COLUMN data_referencia DATE DEFAULT (DATE('now'))
-            """)
-            
-            # Atualiza registros existentes para usar a data de início como referência
-            cursor.execute("""
-                UPDATE sessoes_leitura 
-                SET data_referencia = DATE(data_inicio)
-                WHERE data_referencia IS NULL
-            """)
-            
-            conn.commit()
-            print("✅ Migração aplicada com sucesso!")
-        
-        conn.close()
-        
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" not in str(e):
-            print(f"⚠️ Aviso na migração: {e}")
-    except Exception as e:
-        print(f"⚠️ Erro inesperado na migração: {e}")
+    def __repr__(self):
+        return f'<SessaoQuadro {self.sessao_id} - Quadro {self.quadro_id}>'
 
 
-def inicializar_banco():
-    """Cria as tabelas no banco de dados e aplica migrações"""
-    with app.app_context():
-        # Aplica migrações antes de criar/atualizar tabelas
-        migrar_banco_se_necessario()
-        
-        # Cria/atualiza tabelas
-        db.create_all()
-        print("✅ Banco de dados inicializado!")
-        
-        # Popula dados de exemplo se necessário
-        popular_dados_exemplo()
+class ConsumoDiario(db.Model):
+    """Agregado diário de consumo por quadro, área ou planta, mantido incrementalmente"""
+    __tablename__ = 'consumo_diario'
 
+    escopo = db.Column(db.String(10), primary_key=True)  # 'quadro', 'area' ou 'planta'
+    referencia_id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # ID do quadro/área (0 para a planta)
+    data = db.Column(db.Date, primary_key=True)
+    consumo = db.Column(db.Float, default=0, nullable=False)
+    total_leituras = db.Column(db.Integer, default=0, nullable=False)
 
-def popular_dados_exemplo():
-    """Popula o banco com quadros de exemplo se estiver vazio"""
-    """if Quadro.query.count() == 0:
-        quadros_exemplo = [
-            Quadro(nome='Galpão A', localizacao='Área de Produção', ativo=True),
-            Quadro(nome='Escritório', localizacao='Prédio Administrativo', ativo=True),
-            Quadro(nome='Recepção', localizacao='Entrada Principal', ativo=True)
-        ]
-        
-        for quadro in quadros_exemplo:
-            db.session.add(quadro)
-        
-        db.session.commit()
-        print("✅ Dados de exemplo criados:")
-        for quadro in quadros_exemplo:
-            print(f"   - {quadro.nome} ({quadro.localizacao})")"""
+    def __repr__(self):
+        return f'<ConsumoDiario {self.escopo}:{self.referencia_id} {self.data}>'
 
 
-# ========================================
-# FUNÇÕES AUXILIARES
-# ========================================
+class ConsumoDistribuido(db.Model):
+    """Consumo diário por quadro com o consumo de cada lacuna de leitura espalhado pelos dias sem leitura"""
+    __tablename__ = 'consumo_distribuido'
 
-def obter_ip_local():
-    """Descobre o IP local da máquina na rede"""
-    try:
-        # Cria um socket temporário para descobrir o IP
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))  # Conecta a um servidor externo (não envia dados)
-        ip_local = s.getsockname()[0]
-        s.close()
-        return ip_local
-    except Exception:
-        return "127.0.0.1"  # Fallback para localhost
+    quadro_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    data = db.Column(db.Date, primary_key=True)
+    consumo = db.Column(db.Float, default=0, nullable=False)
+    estimado = db.Column(db.Boolean, default=False, nullable=False)  # Dia dentro de uma lacuna (valor distribuído)
+    reset = db.Column(db.Boolean, default=False, nullable=False)  # Lacuna fechada por leitura com reset do medidor
 
+    def __repr__(self):
+        return f'<ConsumoDistribuido {self.quadro_id} {self.data}>'
 
-def gerar_qrcode(url):
-    """Gera um QR Code em base64 para uma URL"""
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(url)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Converte para base64
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    buffer.seek(0)
-    img_base64 = base64.b64encode(buffer.getvalue()).decode()
-    
-    return f"data:image/png;base64,{img_base64}"
 
+class ImportacaoArquivo(db.Model):
+    """Arquivo já importado, identificado pelo sha256 do conteúdo, com o resultado da importação"""
+    __tablename__ = 'importacoes_arquivos'
 
-def calcular_consumo_total_hoje():
-    """Calcula o consumo total de todos os quadros hoje"""
-    hoje = datetime.now().date()
-    inicio_dia = datetime.combine(hoje, datetime.min.time())
-    fim_dia = datetime.combine(hoje, datetime.max.time())
-    
-    consumo_total = db.session.query(func.sum(Leitura.consumo_dia))\
-        .filter(Leitura.data_registro >= inicio_dia)\
-        .filter(Leitura.data_registro <= fim_dia)\
-        .filter(Leitura.consumo_dia.isnot(None))\
-        .scalar()
-    
-    return consumo_total if consumo_total else 0
+    hash_conteudo = db.Column(db.String(64), primary_key=True)
+    nome_arquivo = db.Column(db.String(255), nullable=False)
+    bytes = db.Column(db.Integer, nullable=False)
+    origem = db.Column(db.String(10), default='web', nullable=False)  # 'web' ou 'cli'
+    importado_em = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    detalhes = db.Column(db.Text, nullable=False)  # JSON: inseridos, duplicados, quadros criados, erros
+    reenvios = db.Column(db.Integer, default=0, nullable=False)  # Vezes que o mesmo arquivo voltou e foi pulado
+    reimportacoes = db.Column(db.Integer, default=0, nullable=False)  # Vezes que foi importado de novo (forçado)
+    ultimo_reenvio_em = db.Column(db.DateTime, nullable=True)  # Último reenvio ou reimportação
 
+    def to_dict(self):
+        return {
+            'hash_conteudo': self.hash_conteudo,
+            'nome_arquivo': self.nome_arquivo,
+            'bytes': self.bytes,
+            'origem': self.origem,
+            'importado_em': self.importado_em.strftime('%d/%m/%Y %H:%M:%S'),
+            'reenvios': self.reenvios,
+            'reimportacoes': self.reimportacoes,
+            'ultimo_reenvio_em': self.ultimo_reenvio_em.strftime('%d/%m/%Y %H:%M:%S') if self.ultimo_reenvio_em else None
+        }
 
-def calcular_media_ultimos_3_meses():
-    """Calcula a média de consumo dos últimos 3 meses"""
-    tres_meses_atras = datetime.now() - timedelta(days=90)
-    
-    consumo_total = db.session.query(func.sum(Leitura.consumo_dia))\
-        .filter(Leitura.data_registro >= tres_meses_atras)\
-        .filter(Leitura.consumo_dia.isnot(None))\
-        .scalar()
-    
-    if consumo_total:
-        return consumo_total / 90  # Média diária
-    return 0
+    def __repr__(self):
+        return f'<ImportacaoArquivo {self.hash_conteudo[:12]} {self.nome_arquivo}>'
 
 
-def obter_status_quadros():
-    """Retorna informações de status de todos os quadros"""
-    quadros = Quadro.query.filter_by(ativo=True).all()
-    status_list = []
-    
-    hoje = datetime.now().date()
-    inicio_dia = datetime.combine(hoje, datetime.min.time())
-    
-    for quadro in quadros:
-        # Busca última leitura
-        ultima_leitura = Leitura.query.filter_by(quadro_id=quadro.id)\
-            .order_by(Leitura.data_registro.desc()).first()
-        
-        # Busca leitura de hoje
-        leitura_hoje = Leitura.query.filter_by(quadro_id=quadro.id)\
-            .filter(Leitura.data_registro >= inicio_dia)\
-            .order_by(Leitura.data_registro.desc()).first()
-        
-        status = {
-            'id': quadro.id,
-            'nome': quadro.nome,
-            'localizacao': quadro.localizacao,
-            'valor_atual': ultima_leitura.valor_leitura if ultima_leitura else 0,
-            'consumo_hoje': leitura_hoje.consumo_dia if leitura_hoje and leitura_hoje.consumo_dia else 0,
-            'status': 'OK' if leitura_hoje else 'Pendente',
-            'ultima_data': ultima_leitura.data_registro.strftime('%d/%m/%Y %H:%M') if ultima_leitura else 'Nunca',
-            'alerta_reset': ultima_leitura.alerta_reset if ultima_leitura else False
+class RecalculoFrota(db.Model):
+    """Execução do recálculo de consumo de todos os quadros (retomada enquanto não concluída)"""
+    __tablename__ = 'recalculos_frota'
+
+    id = db.Column(db.Integer, primary_key=True)
+    iniciado_em = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    concluido_em = db.Column(db.DateTime, nullable=True)  # None = interrompido ou em andamento
+    total_quadros = db.Column(db.Integer, default=0, nullable=False)
+    leituras_alteradas = db.Column(db.Integer, default=0, nullable=False)
+    duracao_s = db.Column(db.Float, default=0, nullable=False)  # Soma das execuções (com retomadas)
+
+    def __repr__(self):
+        return f'<RecalculoFrota {self.id}>'
+
+
+class RecalculoQuadro(db.Model):
+    """Checkpoint de um quadro já recalculado, gravado na mesma transação das leituras"""
+    __tablename__ = 'recalculos_quadros'
+
+    recalculo_id = db.Column(db.Integer, db.ForeignKey('recalculos_frota.id'), primary_key=True)
+    quadro_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    leituras_alteradas = db.Column(db.Integer, default=0, nullable=False)
+    dias_alterados = db.Column(db.Text, nullable=False, default='[]')  # JSON com as datas (AAAA-MM-DD)
+    concluido_em = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    def __repr__(self):
+        return f'<RecalculoQuadro {self.recalculo_id}:{self.quadro_id}>'
+
+
+class SiteFederado(db.Model):
+    """Modelo para um site remoto (outro energia.db ou outra instância) consultado na federação"""
+    __tablename__ = 'sites_federados'
+
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(100), nullable=False, unique=True)
+    caminho_banco = db.Column(db.String(500), nullable=True)  # Arquivo SQLite local
+    url = db.Column(db.String(500), nullable=True)  # Ou instância acessível por HTTP (ex: http://10.0.0.5:5000)
+    ativo = db.Column(db.Boolean, default=True, nullable=False)
+
+    def __repr__(self):
+        return f'<SiteFederado {self.nome}>'
+
+    def to_dict(self):
+        """Converte o objeto para dicionário"""
+        return {
+            'id': self.id,
+            'nome': self.nome,
+            'caminho_banco': self.caminho_banco,
+            'url': self.url,
+            'ativo': self.ativo
         }
-        
-        status_list.append(status)
-    
-    return status_list
 
 
-# ========================================
-# ROTAS
-# ========================================
+class TokenIngestao(db.Model):
+    """Token de acesso de um medidor/gateway à API de ingestão (guardado apenas o hash)"""
+    __tablename__ = 'tokens_ingestao'
 
-@app.route('/')
-def index():
-    """Dashboard principal com QR Code para acesso mobile"""
-    # Obtém IP local e gera QR Code
-    ip_local = obter_ip_local()
-    url_mobile = f"http://{ip_local}:5000/registrar"
-    qrcode_img = gerar_qrcode(url_mobile)
-    
-    # Calcula métricas
-    consumo_hoje = calcular_consumo_total_hoje()
-    media_3_meses = calcular_media_ultimos_3_meses()
-    status_quadros = obter_status_quadros()
-    
-    # Conta rascunhos pendentes
-    total_rascunhos = LeituraRascunho.query.count()
-    
-    return render_template('dashboard.html',
-                         qrcode_img=qrcode_img,
-                         url_mobile=url_mobile,
-                         ip_local=ip_local,
-                         consumo_hoje=consumo_hoje,
-                         media_3_meses=media_3_meses,
-                         status_quadros=status_quadros,
-                         total_rascunhos=total_rascunhos)
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(100), nullable=False, unique=True)
+    token_hash = db.Column(db.String(64), nullable=False, unique=True)  # SHA-256 do token
+    ativo = db.Column(db.Boolean, default=True, nullable=False)
+    criado_em = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    ultimo_uso = db.Column(db.DateTime, nullable=True)
 
+    def __repr__(self):
+        return f'<TokenIngestao {self.nome}>'
 
-@app.route('/registrar', methods=['GET', 'POST'])
-def registrar():
-    """Rota principal para registro de leituras em RASCUNHO"""
-    
-    # Verifica se há sessão ativa
-    sessao_ativa = SessaoLeitura.query.filter_by(ativa=True).first()
-    
-    if request.method == 'GET':
-        # Renderiza template independente do status da sessão
-        # O JavaScript no template fará o bloqueio visual se necessário
-        return render_template('mobile_form.html', sessao_ativa=(sessao_ativa is not None))
-    
-    elif request.method == 'POST':
-        # Bloqueia registro se não houver sessão ativa
-        if not sessao_ativa:
-            return jsonify({
-                'sucesso': False,
-                'erro': 'Não há sessão ativa. Aguarde o supervisor iniciar uma sessão de leitura.'
-            }), 403
-        
-        # Recebe dados do formulário
-        try:
-            quadro_id = request.form.get('quadro_id', type=int)
-            novo_valor = request.form.get('novo_valor', type=float)
-            
-            if not quadro_id or novo_valor is None:
-                return jsonify({
-                    'sucesso': False,
-                    'erro': 'Dados incompletos. Informe o quadro e o valor da leitura.'
-                }), 400
-            
-            # Verifica se o quadro existe
-            quadro = Quadro.query.get(quadro_id)
-            if not quadro:
-                return jsonify({
-                    'sucesso': False,
-                    'erro': 'Quadro não encontrado.'
-                }), 404
-            
-            # Busca a última leitura OFICIAL (da tabela Leitura)
-            ultima_leitura_oficial = Leitura.query.filter_by(quadro_id=quadro_id)\
-                .order_by(Leitura.data_registro.desc()).first()
+    def to_dict(self):
+        """Converte o objeto para dicionário"""
+        return {
+            'id': self.id,
+            'nome': self.nome,
+            'ativo': self.ativo,
+            'criado_em': self.criado_em.strftime('%d/%m/%Y %H:%M:%S'),
+            'ultimo_uso': self.ultimo_uso.strftime('%d/%m/%Y %H:%M:%S') if self.ultimo_uso else None
+        }
+
+
+class ModeloPrevisao(db.Model):
+    """Modelo para guardar o estado ajustado do Holt-Winters de cada quadro"""
+    __tablename__ = 'modelos_previsao'
+
+    quadro_id = db.Column(db.Integer, db.ForeignKey('quadros.id'), primary_key=True, autoincrement=False)
+    nivel = db.Column(db.Float, nullable=False)
+    tendencia = db.Column(db.Float, nullable=False)
+    sazonalidade = db.Column(db.Text, nullable=False)  # JSON com 7 valores (segunda a domingo)
+    alfa = db.Column(db.Float, nullable=False)
+    beta = db.Column(db.Float, nullable=False)
+    gama = db.Column(db.Float, nullable=False)
+    desvio_residual = db.Column(db.Float, default=0, nullable=False)
+    ultima_data = db.Column(db.Date, nullable=False)  # Último dia incorporado ao estado
+    ajustado_em = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    # Relacionamento
+    quadro = db.relationship('Quadro', lazy=True)
+
+    def __repr__(self):
+        return f'<ModeloPrevisao Quadro {self.quadro_id} até {self.ultima_data}>'
+
+
+class PrevisaoPendente(db.Model):
+    """Quadros cujo consumo mudou desde o último ajuste do modelo de previsão"""
+    __tablename__ = 'previsoes_pendentes'
+
+    quadro_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    desde = db.Column(db.Date, nullable=False)  # Primeiro dia alterado
+    marcado_em = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    def __repr__(self):
+        return f'<PrevisaoPendente Quadro {self.quadro_id} desde {self.desde}>'
+
+
+class RelatorioMensal(db.Model):
+    """Modelo para o resumo mensal pré-calculado de um quadro (ou da planta inteira quando quadro_id é nulo)"""
+    __tablename__ = 'relatorios_mensais'
+
+    id = db.Column(db.Integer, primary_key=True)
+    ano_mes = db.Column(db.String(7), nullable=False, index=True)  # Formato YYYY-MM
+    quadro_id = db.Column(db.Integer, db.ForeignKey('quadros.id'), nullable=True, index=True)
+    consumo_total = db.Column(db.Float, default=0, nullable=False)
+    media_diaria = db.Column(db.Float, default=0, nullable=False)
+    maior_consumo_dia = db.Column(db.Float, default=0, nullable=False)
+    data_maior_consumo = db.Column(db.Date, nullable=True)
+    total_resets = db.Column(db.Integer, default=0, nullable=False)
+    dias_com_leitura = db.Column(db.Integer, default=0, nullable=False)
+    dias_faltantes = db.Column(db.Integer, default=0, nullable=False)
+    atualizado_em = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    # Relacionamento
+    quadro = db.relationship('Quadro', lazy=True)
+
+    def __repr__(self):
+        return f'<RelatorioMensal {self.ano_mes} - Quadro {self.quadro_id}>'
+
+    def to_dict(self):
+        """Converte o objeto para dicionário"""
+        return {
+            'ano_mes': self.ano_mes,
+            'quadro_id': self.quadro_id,
+            'quadro_nome': self.quadro.nome if self.quadro else 'Planta (Total)',
+            'consumo_total': round(self.consumo_total, 2),
+            'media_diaria': round(self.media_diaria, 2),
+            'maior_consumo_dia': round(self.maior_consumo_dia, 2),
+            'data_maior_consumo': self.data_maior_consumo.strftime('%d/%m/%Y') if self.data_maior_consumo else None,
+            'total_resets': self.total_resets,
+            'dias_com_leitura': self.dias_com_leitura,
+            'dias_faltantes': self.dias_faltantes,
+            'atualizado_em': self.atualizado_em.strftime('%d/%m/%Y %H:%M:%S')
+        }
+
+
+class RelatorioPendente(db.Model):
+    """Modelo para marcar meses cujas leituras mudaram desde o último cálculo dos relatórios"""
+    __tablename__ = 'relatorios_pendentes'
+
+    ano_mes = db.Column(db.String(7), primary_key=True)  # Formato YYYY-MM
+    marcado_em = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    def __repr__(self):
+        return f'<RelatorioPendente {self.ano_mes}>'
+
+
+class Tarifa(db.Model):
+    """Modelo de tarifa de energia com vigência; sem quadro_id vale para todos os quadros"""
+    __tablename__ = 'tarifas'
+
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(100), nullable=False)
+    quadro_id = db.Column(db.Integer, db.ForeignKey('quadros.id'), nullable=True, index=True)
+    vigencia_inicio = db.Column(db.Date, nullable=False)
+    vigencia_fim = db.Column(db.Date, nullable=True)  # Aberta enquanto vazia
+    criada_em = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    # Relacionamentos
+    quadro = db.relationship('Quadro', lazy=True)
+    periodos = db.relationship('TarifaPeriodo', backref='tarifa', lazy=True, cascade='all, delete-orphan')
+    faixas = db.relationship('TarifaFaixa', backref='tarifa', lazy=True, cascade='all, delete-orphan',
+                             order_by='TarifaFaixa.acima_de_kwh')
+
+    def __repr__(self):
+        return f'<Tarifa {self.nome}>'
+
+    def to_dict(self):
+        """Converte o objeto para dicionário"""
+        return {
+            'id': self.id,
+            'nome': self.nome,
+            'quadro_id': self.quadro_id,
+            'vigencia_inicio': self.vigencia_inicio.isoformat(),
+            'vigencia_fim': self.vigencia_fim.isoformat() if self.vigencia_fim else None,
+            'periodos': [p.to_dict() for p in self.periodos],
+            'faixas': [f.to_dict() for f in self.faixas]
+        }
+
+
+class TarifaPeriodo(db.Model):
+    """Posto tarifário (ex.: ponta, fora de ponta) com a fração do consumo diário que cai nele"""
+    __tablename__ = 'tarifas_periodos'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tarifa_id = db.Column(db.Integer, db.ForeignKey('tarifas.id'), nullable=False, index=True)
+    nome = db.Column(db.String(50), nullable=False)
+    dias_semana = db.Column(db.String(20), nullable=False, default='0,1,2,3,4,5,6')  # 0 = segunda
+    fracao = db.Column(db.Float, nullable=False)  # Parte do kWh do dia cobrada neste posto
+    preco_kwh = db.Column(db.Float, nullable=False)
+
+    def lista_dias(self):
+        return [int(d) for d in self.dias_semana.split(',') if d.strip()]
+
+    def to_dict(self):
+        """Converte o objeto para dicionário"""
+        return {
+            'nome': self.nome,
+            'dias_semana': self.lista_dias(),
+            'fracao': self.fracao,
+            'preco_kwh': self.preco_kwh
+        }
+
+
+class TarifaFaixa(db.Model):
+    """Faixa de consumo mensal: acima de acima_de_kwh no mês, cada kWh paga o adicional"""
+    __tablename__ = 'tarifas_faixas'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tarifa_id = db.Column(db.Integer, db.ForeignKey('tarifas.id'), nullable=False, index=True)
+    acima_de_kwh = db.Column(db.Float, nullable=False)
+    adicional_kwh = db.Column(db.Float, nullable=False)
+
+    def to_dict(self):
+        """Converte o objeto para dicionário"""
+        return {
+            'acima_de_kwh': self.acima_de_kwh,
+            'adicional_kwh': self.adicional_kwh
+        }
+
+
+class CustoMensal(db.Model):
+    """Custo calculado por quadro e mês (quadro_id 0 = planta, sem os submedidores)"""
+    __tablename__ = 'custos_mensais'
+
+    quadro_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    ano_mes = db.Column(db.String(7), primary_key=True)  # Formato YYYY-MM
+    consumo_kwh = db.Column(db.Float, default=0, nullable=False)
+    custo_energia = db.Column(db.Float, default=0, nullable=False)
+    custo_faixas = db.Column(db.Float, default=0, nullable=False)
+    custo_total = db.Column(db.Float, default=0, nullable=False)
+    consumo_sem_tarifa = db.Column(db.Float, default=0, nullable=False)  # kWh de dias sem tarifa vigente
+    atualizado_em = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    def __repr__(self):
+        return f'<CustoMensal {self.ano_mes} - Quadro {self.quadro_id}>'
+
+    def to_dict(self):
+        """Converte o objeto para dicionário"""
+        return {
+            'quadro_id': self.quadro_id or None,
+            'ano_mes': self.ano_mes,
+            'consumo_kwh': round(self.consumo_kwh, 2),
+            'custo_energia': round(self.custo_energia, 2),
+            'custo_faixas': round(self.custo_faixas, 2),
+            'custo_total': round(self.custo_total, 2),
+            'custo_medio_kwh': round(self.custo_total / (self.consumo_kwh - self.consumo_sem_tarifa), 4)
+                               if self.consumo_kwh > self.consumo_sem_tarifa else None,
+            'consumo_sem_tarifa': round(self.consumo_sem_tarifa, 2)
+        }
+
+
+class CustoPendente(db.Model):
+    """Meses cujo consumo ou tarifa mudou desde o último cálculo de custos"""
+    __tablename__ = 'custos_pendentes'
+
+    ano_mes = db.Column(db.String(7), primary_key=True)  # Formato YYYY-MM
+    marcado_em = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    def __repr__(self):
+        return f'<CustoPendente {self.ano_mes}>'
+
+
+# ========================================
+# ACESSO A DADOS
+# ========================================
+# Consultas compartilhadas pelas rotas. Relacionamentos lidos na resposta são
+# carregados junto (joinedload) e buscas "por quadro" são feitas em lote, para
+# que o número de consultas não cresça com a quantidade de linhas.
+
+def listar_rascunhos(sessao_id=None):
+    """Rascunhos (de uma sessão ou de todas) com o quadro já carregado"""
+    query = LeituraRascunho.query.options(joinedload(LeituraRascunho.quadro))
+    if sessao_id:
+        query = query.filter(LeituraRascunho.sessao_id == sessao_id)
+    return query.order_by(LeituraRascunho.id).all()
+
+
+def sessao_do_quadro(quadro_id):
+    """Sessão ativa que cobre o quadro (no máximo uma), ou None"""
+    return SessaoLeitura.query.join(SessaoQuadro)\
+        .filter(SessaoLeitura.ativa == True, SessaoQuadro.quadro_id == quadro_id).first()
+
+
+def listar_leituras_recentes(limite):
+    """Últimas leituras oficiais com o quadro já carregado"""
+    return Leitura.query.options(joinedload(Leitura.quadro))\
+        .order_by(Leitura.data_registro.desc()).limit(limite).all()
+
+
+def filtrar_leituras(data_inicio=None, data_fim=None, quadro_id=None):
+    """Query de leituras no período (datas inclusivas) e, opcionalmente, de um quadro"""
+    query = Leitura.query
+    if data_inicio:
+        query = query.filter(Leitura.data_registro >= datetime.combine(data_inicio, datetime.min.time()))
+    if data_fim:
+        query = query.filter(Leitura.data_registro <= datetime.combine(data_fim, datetime.max.time()))
+    if quadro_id:
+        query = query.filter(Leitura.quadro_id == quadro_id)
+    return query
+
+
+def ultimas_leituras_por_quadro(quadro_ids=None):
+    """Última leitura oficial de cada quadro em uma única consulta: {quadro_id: Leitura}"""
+    maximas = db.session.query(
+        Leitura.quadro_id,
+        func.max(Leitura.data_registro).label('data_maxima')
+    ).group_by(Leitura.quadro_id)
+    if quadro_ids is not None:
+        maximas = maximas.filter(Leitura.quadro_id.in_(quadro_ids))
+    maximas = maximas.subquery()
+
+    leituras = Leitura.query.join(
+        maximas,
+        (Leitura.quadro_id == maximas.c.quadro_id) & (Leitura.data_registro == maximas.c.data_maxima)
+    ).order_by(Leitura.id).all()
+
+    # Em empate de horário fica a de maior id
+    return {leitura.quadro_id: leitura for leitura in leituras}
+
+
+def leituras_no_mesmo_dia(rascunhos):
+    """Leitura oficial já existente no dia de cada rascunho: {(quadro_id, data): Leitura}"""
+    if not rascunhos:
+        return {}
+
+    chaves = {(r.quadro_id, r.data_registro.date()) for r in rascunhos}
+    dias = {data for _, data in chaves}
+    inicio = datetime.combine(min(dias), datetime.min.time())
+    fim = datetime.combine(max(dias), datetime.min.time()) + timedelta(days=1)
+
+    # Intervalo semiaberto em data_registro usa ix_leituras_quadro_data; o agrupamento
+    # deixa só a primeira leitura (menor id) de cada (quadro, dia) pedido
+    dia_leitura = db.func.date(Leitura.data_registro)
+    primeiras = db.session.query(
+        db.func.min(Leitura.id).label('id_primeira')
+    ).filter(
+        Leitura.quadro_id.in_({quadro_id for quadro_id, _ in chaves}),
+        Leitura.data_registro >= inicio,
+        Leitura.data_registro < fim
+    ).group_by(Leitura.quadro_id, dia_leitura).having(
+        dia_leitura.in_({data.isoformat() for data in dias})
+    ).subquery()
+
+    leituras = Leitura.query.join(primeiras, Leitura.id == primeiras.c.id_primeira).all()
+
+    # Quadros e dias se cruzam: descarta os pares que nenhum rascunho pediu
+    existentes = {}
+    for leitura in leituras:
+        chave = (leitura.quadro_id, leitura.data_registro.date())
+        if chave in chaves:
+            existentes[chave] = leitura
+    return existentes
+
+
+# ========================================
+# ORÇAMENTO DE CONSULTAS POR ROTA
+# ========================================
+
+# endpoint -> número máximo de consultas de leitura (SELECT) por requisição.
+# Escritas não entram na conta: crescem naturalmente com o que a rota grava.
+ORCAMENTOS_CONSULTAS = {}
+_estatisticas_consultas = {}
+_estatisticas_consultas_lock = threading.Lock()
+
+
+def orcamento_consultas(maximo):
+    """Declara quantos SELECTs a rota pode fazer (usar abaixo de @app.route)"""
+    def decorador(funcao):
+        ORCAMENTOS_CONSULTAS[funcao.__name__] = maximo
+        return funcao
+    return decorador
+
+
+@contextmanager
+def consultas_fora_do_orcamento():
+    """Pendências que o agendador faria, processadas na requisição, não contam no orçamento da rota"""
+    antes = g.get('total_consultas', 0) if has_request_context() else None
+    try:
+        yield
+    finally:
+        if antes is not None:
+            g.total_consultas = antes
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _contar_consulta(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and statement.lstrip()[:6].upper() in ('SELECT', 'WITH R'):
+        g.total_consultas = g.get('total_consultas', 0) + 1
+
+
+@app.after_request
+def verificar_orcamento_consultas(response):
+    """Registra as consultas da requisição e acusa rotas que estouraram o orçamento"""
+    total = g.get('total_consultas', 0)
+    response.headers['X-Consultas-SQL'] = str(total)
+
+    endpoint = request.endpoint
+    maximo = ORCAMENTOS_CONSULTAS.get(endpoint)
+    if maximo is None:
+        return response
+
+    with _estatisticas_consultas_lock:
+        item = _estatisticas_consultas.setdefault(endpoint, {'requisicoes': 0, 'maximo_observado': 0, 'estouros': 0})
+        item['requisicoes'] += 1
+        item['maximo_observado'] = max(item['maximo_observado'], total)
+        if total > maximo:
+            item['estouros'] += 1
+
+    if total > maximo:
+        app.logger.warning(f'Rota {endpoint} fez {total} consultas SQL (orçamento: {maximo})')
+        if app.config['ORCAMENTO_CONSULTAS_ESTRITO']:
+            # after_request precisa devolver um Response (não a tupla usada nas rotas)
+            resposta = jsonify({
+                'sucesso': False,
+                'erro': f'Orçamento de consultas excedido em {endpoint}: {total} > {maximo}'
+            })
+            resposta.status_code = 500
+            resposta.headers['X-Consultas-SQL'] = str(total)
+            return resposta
+
+    return response
+
+
+@app.route('/api/consultas/orcamentos', methods=['GET'])
+def api_orcamentos_consultas():
+    """Orçamento declarado e consultas observadas por rota"""
+    with _estatisticas_consultas_lock:
+        estatisticas = {endpoint: dict(item) for endpoint, item in _estatisticas_consultas.items()}
+
+    return jsonify({
+        'sucesso': True,
+        'estrito': app.config['ORCAMENTO_CONSULTAS_ESTRITO'],
+        'rotas': [
+            dict({'endpoint': endpoint, 'orcamento': maximo},
+                 **estatisticas.get(endpoint, {'requisicoes': 0, 'maximo_observado': 0, 'estouros': 0}))
+            for endpoint, maximo in sorted(ORCAMENTOS_CONSULTAS.items())
+        ]
+    }), 200
+
+
+# ========================================
+# PERFIS DE REQUISIÇÃO SOB DEMANDA (cProfile)
+# ========================================
+
+# Uma requisição é executada sob o cProfile quando traz ?perfil=<chave> ou o cabeçalho
+# X-Perfil: <chave>. Sem o pedido, o único custo é olhar o cabeçalho e o parâmetro.
+# Um perfil por vez: no Python 3.12+ só um cProfile pode estar ligado no processo, e antes
+# disso perfis simultâneos em threads diferentes ficariam misturados na mesma linha do tempo.
+# Pedidos que chegam com outro perfil em andamento rodam normalmente, sem perfil.
+_perfil_em_andamento = threading.Lock()
+
+def pasta_perfis():
+    return app.config['PERFIS_PASTA'] or os.path.join(app.instance_path, 'perfis')
+
+
+def perfil_autorizado():
+    """True se a requisição pediu perfil e quem pede é administrador (chave ou o próprio servidor)"""
+    valor = request.headers.get('X-Perfil') or request.args.get('perfil')
+    if not valor:
+        return False
+    chave = app.config['PERFIL_CHAVE']
+    if chave:
+        return hmac.compare_digest(valor.encode(), chave.encode())
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+
+@app.before_request
+def iniciar_perfil():
+    """Liga o cProfile para esta requisição quando pedido por um administrador"""
+    if not perfil_autorizado():
+        return
+
+    import cProfile
+
+    if not _perfil_em_andamento.acquire(blocking=False):
+        @after_this_request
+        def avisar_ocupado(response):
+            response.headers['X-Perfil'] = 'ocupado'
+            return response
+        return
+
+    perfilador = cProfile.Profile()
+    try:
+        perfilador.enable()
+    except ValueError:
+        # Outro perfilador já ligado no processo (ex.: depurador ou profiler externo)
+        _perfil_em_andamento.release()
+        return
+
+    nome = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}_{request.endpoint or 'sem_rota'}"
+    g.perfil = {'perfilador': perfilador, 'nome': nome, 'inicio': time.perf_counter(), 'status': 500}
+
+    @after_this_request
+    def anotar_perfil(response):
+        g.perfil['status'] = response.status_code
+        response.headers['X-Perfil'] = nome
+        return response
+
+
+@app.teardown_request
+def finalizar_perfil(erro=None):
+    """Desliga o cProfile e grava o perfil (.prof) com um resumo (.json) ao lado"""
+    perfil = g.pop('perfil', None)
+    if perfil is None:
+        return
+    perfil['perfilador'].disable()
+    _perfil_em_andamento.release()
+
+    try:
+        pasta = pasta_perfis()
+        os.makedirs(pasta, exist_ok=True)
+        perfil['perfilador'].dump_stats(os.path.join(pasta, perfil['nome'] + '.prof'))
+        with open(os.path.join(pasta, perfil['nome'] + '.json'), 'w', encoding='utf-8') as arquivo:
+            json.dump({
+                'nome': perfil['nome'],
+                'data': datetime.now().isoformat(timespec='seconds'),
+                'metodo': request.method,
+                'caminho': request.full_path.rstrip('?'),
+                'endpoint': request.endpoint,
+                'status': perfil['status'],
+                'duracao_ms': round((time.perf_counter() - perfil['inicio']) * 1000, 1),
+                'consultas_sql': g.get('total_consultas', 0),
+                'erro': str(erro) if erro else None
+            }, arquivo, ensure_ascii=False)
+        remover_perfis_antigos(pasta)
+    except OSError as e:
+        app.logger.warning(f'Não foi possível gravar o perfil {perfil["nome"]}: {e}')
+
+
+def remover_perfis_antigos(pasta):
+    """Mantém apenas os PERFIS_MAX_ARQUIVOS perfis mais recentes"""
+    nomes = sorted(n[:-5] for n in os.listdir(pasta) if n.endswith('.prof'))
+    for nome in nomes[:-app.config['PERFIS_MAX_ARQUIVOS']]:
+        for extensao in ('.prof', '.json'):
+            try:
+                os.remove(os.path.join(pasta, nome + extensao))
+            except FileNotFoundError:
+                pass
+
+
+def listar_perfis():
+    """Resumos dos perfis gravados, do mais recente para o mais antigo"""
+    pasta = pasta_perfis()
+    if not os.path.isdir(pasta):
+        return []
+
+    perfis = []
+    for nome in sorted((n for n in os.listdir(pasta) if n.endswith('.json')), reverse=True):
+        try:
+            with open(os.path.join(pasta, nome), encoding='utf-8') as arquivo:
+                perfis.append(json.load(arquivo))
+        except (OSError, ValueError):
+            continue
+    return perfis
+
+
+def resumir_perfil(nome, limite=40):
+    """Funções com maior tempo acumulado no perfil (como o 'sort cumulative' do pstats)"""
+    import pstats
+
+    estatisticas = pstats.Stats(os.path.join(pasta_perfis(), nome + '.prof'))
+    estatisticas.sort_stats('cumulative')
+    pasta_app = os.path.dirname(os.path.abspath(__file__))
+
+    funcoes = []
+    for funcao in estatisticas.fcn_list[:limite]:
+        chamadas_primitivas, chamadas, tempo_proprio, tempo_acumulado, _ = estatisticas.stats[funcao]
+        arquivo, linha, nome_funcao = funcao
+        if arquivo.startswith(pasta_app):
+            arquivo = os.path.relpath(arquivo, pasta_app)
+        elif 'site-packages' in arquivo:
+            arquivo = arquivo.split('site-packages' + os.sep, 1)[1]
+        funcoes.append({
+            'funcao': nome_funcao if arquivo == '~' else f'{arquivo}:{linha}({nome_funcao})',
+            'chamadas': chamadas if chamadas == chamadas_primitivas else f'{chamadas}/{chamadas_primitivas}',
+            'tempo_proprio_ms': round(tempo_proprio * 1000, 2),
+            'tempo_acumulado_ms': round(tempo_acumulado * 1000, 2),
+            'percentual': round(tempo_acumulado / estatisticas.total_tt * 100, 1) if estatisticas.total_tt else 0
+        })
+    return {'total_ms': round(estatisticas.total_tt * 1000, 2), 'total_chamadas': estatisticas.total_calls, 'funcoes': funcoes}
+
+
+def perfil_existe(nome):
+    """Evita caminhos arbitrários: só aceita nomes de perfis gravados na pasta"""
+    return bool(nome) and secure_filename(nome) == nome and os.path.isfile(os.path.join(pasta_perfis(), nome + '.prof'))
+
+
+@app.route('/admin/perfis')
+def admin_perfis():
+    """Perfis gravados e as funções mais caras do perfil escolhido (?nome=, padrão: o mais recente)"""
+    perfis = listar_perfis()
+    nome = request.args.get('nome') or (perfis[0]['nome'] if perfis else None)
+
+    resumo = None
+    if nome and perfil_existe(nome):
+        try:
+            resumo = resumir_perfil(nome)
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            app.logger.warning(f'Perfil {nome} ilegível: {e}')
+
+    if request.args.get('formato') == 'json':
+        return jsonify({'sucesso': True, 'perfis': perfis, 'selecionado': nome, 'resumo': resumo})
+
+    # Variáveis para a sidebar
+    ip_local, url_mobile, qrcode_img = obter_qrcode_mobile()
+    total_rascunhos = LeituraRascunho.query.count()
+
+    return render_template('admin_perfis.html',
+                           perfis=perfis,
+                           selecionado=nome,
+                           resumo=resumo,
+                           chave_configurada=bool(app.config['PERFIL_CHAVE']),
+                           qrcode_img=qrcode_img,
+                           ip_local=ip_local,
+                           total_rascunhos=total_rascunhos)
+
+
+@app.route('/admin/perfis/<nome>/baixar')
+def baixar_perfil(nome):
+    """Arquivo .prof para abrir no snakeviz/flameprof (python -m pstats também lê)"""
+    if not perfil_existe(nome):
+        return jsonify({'sucesso': False, 'erro': 'Perfil não encontrado.'}), 404
+    return send_file(os.path.join(pasta_perfis(), nome + '.prof'), as_attachment=True, download_name=nome + '.prof')
+
+
+@app.route('/admin/perfis/excluir/<nome>', methods=['POST'])
+def excluir_perfil(nome):
+    """Apaga um perfil gravado"""
+    if not perfil_existe(nome):
+        return jsonify({'sucesso': False, 'erro': 'Perfil não encontrado.'}), 404
+    for extensao in ('.prof', '.json'):
+        try:
+            os.remove(os.path.join(pasta_perfis(), nome + extensao))
+        except FileNotFoundError:
+            pass
+    return jsonify({'sucesso': True, 'mensagem': f'Perfil {nome} excluído.'}), 200
+
+
+# ========================================
+# FUNÇÕES DE INICIALIZAÇÃO
+# ========================================
+
+def migrar_banco_se_necessario():
+    """Verifica e aplica migrações necessárias no banco de dados"""
+    import sqlite3
+    
+    # Migra o banco configurado (ENERGIA_BANCO_URI), não um caminho fixo
+    db_path = caminho_banco_sqlite()
+    if db_path is None:
+        return  # Não é um arquivo SQLite: as migrações abaixo usam sqlite3
+    
+    # Verifica se o banco existe
+    if not os.path.exists(db_path):
+        return  # Banco novo, será criado com a estrutura correta
+    
+    try:
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        
+        # Verifica se a coluna 'data_referencia' existe na tabela 'sessoes_leitura'
+        cursor.execute("PRAGMA table_info(sessoes_leitura)")
+        colunas = [coluna[1] for coluna in cursor.fetchall()]
+        
+        if 'data_referencia' not in colunas:
+            print("🔄 Aplicando migração: adicionando coluna 'data_referencia'...")
             
-            # Calcula o consumo provisório
-            consumo_provisorio = 0
-            alerta_reset = False
+            # Adiciona a coluna com valor padrão
+            cursor.execute("""
+                ALTER TABLE sessoes_leitura 
+                ADD COLUMN data_referencia DATE DEFAULT (DATE('now'))
+            """)
             
-            if ultima_leitura_oficial:
-                valor_anterior = ultima_leitura_oficial.valor_leitura
-                
-                if novo_valor >= valor_anterior:
-                    # Consumo normal
-                    consumo_provisorio = novo_valor - valor_anterior
-                else:
-                    # INCONSISTÊNCIA DETECTADA: valor menor que o anterior
-                    return jsonify({
-                        'sucesso': False,
-                        'inconsistencia': True,
-                        'valor_anterior': valor_anterior,
-                        'novo_valor': novo_valor,
-                        'quadro_nome': quadro.nome,
-                        'mensagem': 'O valor informado é MENOR que a leitura anterior. O relógio do medidor virou?'
-                    }), 409  # 409 = Conflict
+            # Atualiza registros existentes para usar a data de início como referência
+            cursor.execute("""
+                UPDATE sessoes_leitura 
+                SET data_referencia = DATE(data_inicio)
+                WHERE data_referencia IS NULL
+            """)
             
-            # Verifica se já existe um rascunho para este quadro
-            rascunho_existente = LeituraRascunho.query.filter_by(quadro_id=quadro_id).first()
+            conn.commit()
+            print("✅ Migração aplicada com sucesso!")
+        
+        # Verifica as colunas de hierarquia na tabela 'quadros'
+        cursor.execute("PRAGMA table_info(quadros)")
+        colunas = [coluna[1] for coluna in cursor.fetchall()]
+        
+        if 'area_id' not in colunas:
+            print("🔄 Aplicando migração: adicionando colunas de área e quadro pai...")
+            cursor.execute("ALTER TABLE quadros ADD COLUMN area_id INTEGER REFERENCES areas(id)")
+            cursor.execute("ALTER TABLE quadros ADD COLUMN quadro_pai_id INTEGER REFERENCES quadros(id)")
+            conn.commit()
+            print("✅ Migração aplicada com sucesso!")
+        
+        # Sessões simultâneas: nome/área da sessão e rascunhos ligados à sessão
+        cursor.execute("PRAGMA table_info(sessoes_leitura)")
+        colunas = [coluna[1] for coluna in cursor.fetchall()]
+        
+        if 'nome' not in colunas:
+            print("🔄 Aplicando migração: adicionando escopo às sessões de leitura...")
+            cursor.execute("ALTER TABLE sessoes_leitura ADD COLUMN nome VARCHAR(100)")
+            cursor.execute("ALTER TABLE sessoes_leitura ADD COLUMN area_id INTEGER REFERENCES areas(id)")
+            conn.commit()
+            print("✅ Migração aplicada com sucesso!")
+        
+        cursor.execute("PRAGMA table_info(leituras_rascunho)")
+        colunas = [coluna[1] for coluna in cursor.fetchall()]
+        
+        if 'sessao_id' not in colunas:
+            print("🔄 Aplicando migração: ligando rascunhos à sessão de leitura...")
+            cursor.execute("ALTER TABLE leituras_rascunho ADD COLUMN sessao_id INTEGER REFERENCES sessoes_leitura(id)")
+            conn.commit()
+            print("✅ Migração aplicada com sucesso!")
+        
+        cursor.execute("PRAGMA table_info(importacoes_arquivos)")
+        colunas = [coluna[1] for coluna in cursor.fetchall()]
+        
+        if colunas and 'reimportacoes' not in colunas:
+            print("🔄 Aplicando migração: contando reimportações no histórico de arquivos...")
+            cursor.execute("ALTER TABLE importacoes_arquivos ADD COLUMN reimportacoes INTEGER NOT NULL DEFAULT 0")
+            conn.commit()
+            print("✅ Migração aplicada com sucesso!")
+        
+        conn.close()
+        
+    except sqlite3.OperationalError as e:
+        if "duplicate column name" not in str(e):
+            print(f"⚠️ Aviso na migração: {e}")
+    except Exception as e:
+        print(f"⚠️ Erro inesperado na migração: {e}")
+
+
+def inicializar_banco(reiniciar_cache=True):
+    """Cria as tabelas no banco de dados e aplica migrações
+
+    reiniciar_cache=False mantém o cache compartilhado (comandos só de leitura,
+    para não invalidar o cache dos workers do servidor em execução).
+    """
+    with app.app_context():
+        # Aplica migrações antes de criar/atualizar tabelas
+        migrar_banco_se_necessario()
+        
+        # Cria/atualiza tabelas
+        db.create_all()
+        
+        # create_all não cria índices novos em tabelas que já existem
+        for indice in list(Leitura.__table__.indexes) + list(LeituraRascunho.__table__.indexes):
+            indice.create(db.engine, checkfirst=True)
+        
+        # O cache compartilhado sobrevive ao reinício mas não sabe de qual energia.db veio
+        # (ex.: banco restaurado de um backup): nada do que está nele vale mais
+        if reiniciar_cache:
+            cache_compartilhado.reiniciar()
+        print("✅ Banco de dados inicializado!")
+        
+        # Popula dados de exemplo se necessário
+        popular_dados_exemplo()
+        
+        # Vincula quadros sem área e monta os agregados diários na primeira execução
+        sincronizar_areas_localizacao()
+        vincular_sessoes_sem_escopo()
+        if ConsumoDiario.query.first() is None and Leitura.query.first() is not None:
+            print("🔄 Montando agregados diários de consumo...")
+            reconstruir_consumo_diario()
+        elif ConsumoDistribuido.query.first() is None and Leitura.query.first() is not None:
+            print("🔄 Distribuindo o consumo dos dias sem leitura...")
+            reconstruir_consumo_distribuido()
+            db.session.commit()
+        if CustoMensal.query.first() is None and CustoPendente.query.first() is None:
+            marcar_custos_periodo(None, None)
+            db.session.commit()
+
+
+def popular_dados_exemplo():
+    """Popula o banco com quadros de exemplo se estiver vazio"""
+    """if Quadro.query.count() == 0:
+        quadros_exemplo = [
+            Quadro(nome='Galpão A', localizacao='Área de Produção', ativo=True),
+            Quadro(nome='Escritório', localizacao='Prédio Administrativo', ativo=True),
+            Quadro(nome='Recepção', localizacao='Entrada Principal', ativo=True)
+        ]
+        
+        for quadro in quadros_exemplo:
+            db.session.add(quadro)
+        
+        db.session.commit()
+        print("✅ Dados de exemplo criados:")
+        for quadro in quadros_exemplo:
+            print(f"   - {quadro.nome} ({quadro.localizacao})")"""
+
+
+# ========================================
+# FUNÇÕES AUXILIARES
+# ========================================
+
+def obter_ip_local():
+    """Descobre o IP local da máquina na rede"""
+    try:
+        # Cria um socket temporário para descobrir o IP
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.connect(("8.8.8.8", 80))  # Conecta a um servidor externo (não envia dados)
+        ip_local = s.getsockname()[0]
+        s.close()
+        return ip_local
+    except Exception:
+        return "127.0.0.1"  # Fallback para localhost
+
+
+def gerar_qrcode_png(url, box_size=10, border=4, correcao='L'):
+    """Gera o PNG (bytes) do QR Code de uma URL. Fica no nível do módulo para rodar também no pool de processos das etiquetas"""
+    import qrcode
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=getattr(qrcode.constants, f'ERROR_CORRECT_{correcao}'),
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(url)
+    qr.make(fit=True)
+    
+    img = qr.make_image(fill_color="black", back_color="white")
+    
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def gerar_qrcode(url):
+    """Gera um QR Code em base64 para uma URL"""
+    img_base64 = base64.b64encode(gerar_qrcode_png(url)).decode()
+    return f"data:image/png;base64,{img_base64}"
+
+
+def url_base_mobile(ip_local=None):
+    """Endereço do servidor na rede local, como os celulares o acessam"""
+    return f"http://{ip_local or obter_ip_local()}:{os.environ.get('ENERGIA_PORTA', 5000)}"
+
+
+def calcular_consumo_total_hoje():
+    """Calcula o consumo total de todos os quadros hoje"""
+    hoje = datetime.now().date()
+    inicio_dia = datetime.combine(hoje, datetime.min.time())
+    fim_dia = datetime.combine(hoje, datetime.max.time())
+    
+    consumo_total = db.session.query(func.sum(Leitura.consumo_dia))\
+        .filter(Leitura.data_registro >= inicio_dia)\
+        .filter(Leitura.data_registro <= fim_dia)\
+        .filter(Leitura.consumo_dia.isnot(None))\
+        .scalar()
+    
+    return consumo_total if consumo_total else 0
+
+
+def calcular_media_ultimos_3_meses():
+    """Calcula a média de consumo dos últimos 3 meses"""
+    tres_meses_atras = datetime.now() - timedelta(days=90)
+    
+    consumo_total = db.session.query(func.sum(Leitura.consumo_dia))\
+        .filter(Leitura.data_registro >= tres_meses_atras)\
+        .filter(Leitura.consumo_dia.isnot(None))\
+        .scalar()
+    
+    if consumo_total:
+        return consumo_total / 90  # Média diária
+    return 0
+
+
+def obter_status_quadros():
+    """Retorna informações de status de todos os quadros"""
+    quadros = Quadro.query.filter_by(ativo=True).all()
+    status_list = []
+    
+    hoje = datetime.now().date()
+    inicio_dia = datetime.combine(hoje, datetime.min.time())
+    
+    # Última leitura de todos os quadros em uma consulta só
+    ultimas_leituras = ultimas_leituras_por_quadro([q.id for q in quadros])
+    
+    for quadro in quadros:
+        # Busca última leitura
+        ultima_leitura = ultimas_leituras.get(quadro.id)
+        
+        # A leitura de hoje, se existir, é a mais recente
+        leitura_hoje = ultima_leitura if ultima_leitura and ultima_leitura.data_registro >= inicio_dia else None
+        
+        status = {
+            'id': quadro.id,
+            'nome': quadro.nome,
+            'localizacao': quadro.localizacao,
+            'valor_atual': ultima_leitura.valor_leitura if ultima_leitura else 0,
+            'consumo_hoje': leitura_hoje.consumo_dia if leitura_hoje and leitura_hoje.consumo_dia else 0,
+            'status': 'OK' if leitura_hoje else 'Pendente',
+            'ultima_data': ultima_leitura.data_registro.strftime('%d/%m/%Y %H:%M') if ultima_leitura else 'Nunca',
+            'alerta_reset': ultima_leitura.alerta_reset if ultima_leitura else False
+        }
+        
+        status_list.append(status)
+
+    return status_list
+
+
+ORDINAL_EPOCA = datetime(1970, 1, 1).toordinal()
+
+
+def pedido_compacto():
+    """Indica se o cliente pediu o formato colunar (?compact=1)"""
+    return request.args.get('compact', '').lower() in ('1', 'true', 'sim')
+
+
+def serializar_leituras_colunar(linhas):
+    """Converte linhas (id, quadro_id, data_registro, valor, consumo, reset) em colunas
+
+    Datas viram dias desde 1970-01-01 e segundos do dia; nome e localização
+    dos quadros vão uma única vez no dicionário 'quadros', referenciado por id.
+    """
+    colunas = {
+        'id': [], 'quadro_id': [], 'dia': [], 'segundo': [],
+        'valor_leitura': [], 'consumo_dia': [], 'alerta_reset': []
+    }
+
+    for leitura_id, quadro_id, data_registro, valor, consumo, reset in linhas:
+        colunas['id'].append(leitura_id)
+        colunas['quadro_id'].append(quadro_id)
+        colunas['dia'].append(data_registro.toordinal() - ORDINAL_EPOCA)
+        colunas['segundo'].append(data_registro.hour * 3600 + data_registro.minute * 60 + data_registro.second)
+        colunas['valor_leitura'].append(round(valor, 2))
+        colunas['consumo_dia'].append(round(consumo, 2) if consumo else 0)
+        colunas['alerta_reset'].append(1 if reset else 0)
+
+    ids = set(colunas['quadro_id'])
+    quadros = {
+        quadro_id: {'nome': nome, 'localizacao': localizacao}
+        for quadro_id, nome, localizacao in db.session.query(Quadro.id, Quadro.nome, Quadro.localizacao)
+            .filter(Quadro.id.in_(ids)).all()
+    } if ids else {}
+
+    return quadros, colunas
+
+
+def registrar_alteracao_leituras(alteracoes):
+    """Propaga alterações em leituras (pares quadro_id, data) para os dados derivados (não faz commit)"""
+    alteracoes = {
+        (quadro_id, data.date() if isinstance(data, datetime) else data)
+        for quadro_id, data in alteracoes
+    }
+    if not alteracoes:
+        return
+
+    marcar_meses_alterados([data for _, data in alteracoes])
+    marcar_previsoes_pendentes(alteracoes)
+    atualizar_consumo_diario(alteracoes)
+    atualizar_consumo_distribuido(alteracoes)
+
+
+def processar_apos_alteracao(alteracoes):
+    """Atualiza caches e modelos em memória depois do commit de alterações em leituras"""
+    alteracoes = {
+        (quadro_id, data.date() if isinstance(data, datetime) else data)
+        for quadro_id, data in alteracoes
+    }
+    if not alteracoes:
+        return
+
+    # Relatórios, custos e previsões (marcados no commit) são refeitos pelo agendador
+    agendador_relatorios.notificar()
+
+    # Registra os quadros alterados: cada processo atualiza suas linhas base no próximo uso
+    # e a revisão em cache (que depende delas) é refeita
+    incrementar_versao_dados({quadro_id for quadro_id, _ in alteracoes})
+
+
+# ========================================
+# CACHE DE FRAGMENTOS RENDERIZADOS
+# ========================================
+
+class CacheFragmentos:
+    """Cache LRU em memória de fragmentos já renderizados, com contadores de acerto/falha
+
+    Na falta em memória consulta o cache compartilhado (se houver) antes de gerar,
+    para que um fragmento gerado por um worker sirva a todos os outros.
+    """
+
+    def __init__(self, max_itens=256, compartilhado=None):
+        self.max_itens = max_itens
+        self.compartilhado = compartilhado
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def consultar(self, chave):
+        """(encontrado, valor) da chave sem gerar nada: memória e depois o cache compartilhado"""
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+                return True, self._itens[chave]
+            self.falhas += 1
+
+        encontrado, valor = self.compartilhado.obter(chave) if self.compartilhado else (False, None)
+        if encontrado:
+            self._guardar(chave, valor)
+        return encontrado, valor
+
+    def obter(self, chave, gerar, versao=None):
+        """Devolve o valor da chave, gerando e guardando com gerar() quando ausente"""
+        encontrado, valor = self.consultar(chave)
+        if not encontrado:
+            valor = gerar()
+            if self.compartilhado:
+                self.compartilhado.gravar(chave, valor, versao)
+            self._guardar(chave, valor)
+        return valor
+
+    def _guardar(self, chave, valor):
+        with self._lock:
+            self._itens[chave] = valor
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+        if self.compartilhado:
+            self.compartilhado.limpar()
+
+    def estatisticas(self):
+        with self._lock:
+            total = self.acertos + self.falhas
+            return {
+                'itens': len(self._itens),
+                'max_itens': self.max_itens,
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'taxa_acerto': round(self.acertos / total * 100, 1) if total else 0
+            }
+
+
+class CacheCompartilhado:
+    """Cache em arquivo SQLite compartilhado por todos os processos (workers) do servidor
+
+    Guarda os fragmentos serializados (pickle) e o contador persistente de
+    versão dos dados. Cada commit com escrita incrementa o contador no arquivo,
+    então um worker enxerga na hora as gravações feitas por outro. O registro
+    de quadros alterados por versão permite que caches derivados (linhas base)
+    sejam atualizados só nos quadros que mudaram.
+
+    Os fragmentos voltam com pickle.loads: o arquivo precisa ser confiável
+    (só o próprio sistema grava nele), como o energia.db.
+    """
+
+    MAX_REGISTRO_ALTERACOES = 10000  # Versões mantidas no registro de quadros alterados
+
+    def __init__(self, caminho, max_itens=1024):
+        self.caminho = caminho
+        self.max_itens = max_itens
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._gravacoes = 0
+        self.acertos = 0
+        self.falhas = 0
+
+    def _conexao(self):
+        """Conexão SQLite da thread atual (criada e preparada no primeiro uso)"""
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            os.makedirs(os.path.dirname(self.caminho) or '.', exist_ok=True)
+            conexao = sqlite3.connect(self.caminho, timeout=10, isolation_level=None, check_same_thread=False)
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute('PRAGMA synchronous=NORMAL')
+            conexao.executescript('''
+                CREATE TABLE IF NOT EXISTS contador (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    versao INTEGER NOT NULL,
+                    registro_desde INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO contador (id, versao, registro_desde) VALUES (1, 0, 0);
+                CREATE TABLE IF NOT EXISTS fragmentos (
+                    chave TEXT PRIMARY KEY,
+                    valor BLOB NOT NULL,
+                    versao INTEGER,
+                    gravado_em REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_fragmentos_versao ON fragmentos (versao);
+                CREATE INDEX IF NOT EXISTS ix_fragmentos_gravado_em ON fragmentos (gravado_em);
+                CREATE TABLE IF NOT EXISTS quadros_alterados (
+                    versao INTEGER NOT NULL,
+                    quadro_id INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_quadros_alterados_versao ON quadros_alterados (versao);
+                CREATE TABLE IF NOT EXISTS contadores (
+                    nome TEXT PRIMARY KEY,
+                    valor INTEGER NOT NULL
+                );
+            ''')
+            self._local.conexao = conexao
+        return conexao
+
+    def versao(self):
+        return self._conexao().execute('SELECT versao FROM contador WHERE id = 1').fetchone()[0]
+
+    def incrementar_versao(self, quadro_ids=()):
+        """Incrementa o contador persistente, registra os quadros alterados e descarta fragmentos antigos"""
+        conexao = self._conexao()
+        conexao.execute('BEGIN IMMEDIATE')
+        try:
+            conexao.execute('UPDATE contador SET versao = versao + 1 WHERE id = 1')
+            versao, registro_desde = conexao.execute(
+                'SELECT versao, registro_desde FROM contador WHERE id = 1'
+            ).fetchone()
+
+            if quadro_ids:
+                conexao.executemany('INSERT INTO quadros_alterados (versao, quadro_id) VALUES (?, ?)',
+                                    [(versao, quadro_id) for quadro_id in quadro_ids])
+
+            # Fragmentos de versões anteriores nunca mais serão lidos
+            conexao.execute('DELETE FROM fragmentos WHERE versao < ?', (versao,))
+
+            if versao - registro_desde > 2 * self.MAX_REGISTRO_ALTERACOES:
+                registro_desde = versao - self.MAX_REGISTRO_ALTERACOES
+                conexao.execute('DELETE FROM quadros_alterados WHERE versao <= ?', (registro_desde,))
+                conexao.execute('UPDATE contador SET registro_desde = ? WHERE id = 1', (registro_desde,))
+
+            conexao.execute('COMMIT')
+        except Exception:
+            conexao.execute('ROLLBACK')
+            raise
+        return versao
+
+    def contador(self, nome):
+        """Valor de um contador nomeado (0 se nunca foi incrementado)"""
+        linha = self._conexao().execute('SELECT valor FROM contadores WHERE nome = ?', (nome,)).fetchone()
+        return linha[0] if linha else 0
+
+    def incrementar_contador(self, nome):
+        """Contadores para caches que só dependem de parte dos dados (ex.: cadastro de quadros)"""
+        self._conexao().execute(
+            'INSERT INTO contadores (nome, valor) VALUES (?, 1) '
+            'ON CONFLICT (nome) DO UPDATE SET valor = valor + 1', (nome,)
+        )
+
+    def quadros_alterados_desde(self, versao):
+        """Quadros alterados depois da versão informada (None = registro já descartado, recalcular tudo)"""
+        conexao = self._conexao()
+        if versao < conexao.execute('SELECT registro_desde FROM contador WHERE id = 1').fetchone()[0]:
+            return None
+        return {quadro_id for (quadro_id,) in conexao.execute(
+            'SELECT DISTINCT quadro_id FROM quadros_alterados WHERE versao > ?', (versao,)
+        )}
+
+    def obter(self, chave):
+        """(encontrado, valor) do fragmento gravado por qualquer processo"""
+        linha = self._conexao().execute('SELECT valor FROM fragmentos WHERE chave = ?', (repr(chave),)).fetchone()
+        with self._lock:
+            if linha is None:
+                self.falhas += 1
+                return False, None
+            self.acertos += 1
+        return True, pickle.loads(linha[0])
+
+    def gravar(self, chave, valor, versao=None):
+        """Grava o fragmento; versao=None para valores que não dependem dos dados (ex.: QR Code)"""
+        conexao = self._conexao()
+        conexao.execute(
+            'INSERT OR REPLACE INTO fragmentos (chave, valor, versao, gravado_em) VALUES (?, ?, ?, ?)',
+            (repr(chave), pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL), versao, time.time())
+        )
+
+        # De tempos em tempos remove os mais antigos acima do limite
+        with self._lock:
+            self._gravacoes += 1
+            podar = self._gravacoes % 64 == 0
+        if podar:
+            conexao.execute(
+                'DELETE FROM fragmentos WHERE chave IN '
+                '(SELECT chave FROM fragmentos ORDER BY gravado_em DESC LIMIT -1 OFFSET ?)',
+                (self.max_itens,)
+            )
+
+    def limpar(self):
+        self._conexao().execute('DELETE FROM fragmentos')
+
+    def reiniciar(self):
+        """Descarta tudo que foi derivado do banco (ex.: energia.db restaurado de um backup)
+
+        Apaga os fragmentos, incrementa a versão e os contadores nomeados e
+        esvazia o registro de quadros alterados: processos ainda rodando
+        recalculam seus caches derivados por inteiro.
+        """
+        conexao = self._conexao()
+        conexao.execute('BEGIN IMMEDIATE')
+        try:
+            conexao.execute('UPDATE contador SET versao = versao + 1, registro_desde = versao + 1 WHERE id = 1')
+            conexao.execute('DELETE FROM fragmentos')
+            conexao.execute('DELETE FROM quadros_alterados')
+            conexao.execute('UPDATE contadores SET valor = valor + 1')
+            conexao.execute('COMMIT')
+        except Exception:
+            conexao.execute('ROLLBACK')
+            raise
+
+    def estatisticas(self):
+        conexao = self._conexao()
+        with self._lock:
+            total = self.acertos + self.falhas
+            return {
+                'caminho': self.caminho,
+                'itens': conexao.execute('SELECT COUNT(*) FROM fragmentos').fetchone()[0],
+                'max_itens': self.max_itens,
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'taxa_acerto': round(self.acertos / total * 100, 1) if total else 0
+            }
+
+
+def caminho_banco_sqlite():
+    """Arquivo do banco SQLite configurado (None se não for um arquivo SQLite)"""
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite' and url.database and url.database != ':memory:':
+        # Caminho relativo no SQLite é resolvido pelo Flask-SQLAlchemy dentro da pasta instance
+        return url.database if os.path.isabs(url.database) else os.path.join(app.instance_path, url.database)
+    return None
+
+
+def caminho_cache_compartilhado():
+    """Arquivo do cache compartilhado: configurado ou ao lado do banco SQLite"""
+    if app.config['CACHE_COMPARTILHADO_CAMINHO']:
+        return app.config['CACHE_COMPARTILHADO_CAMINHO']
+
+    banco = caminho_banco_sqlite()
+    if banco:
+        return os.path.join(os.path.dirname(banco), 'cache_compartilhado.db')
+    return os.path.join(app.instance_path, 'cache_compartilhado.db')
+
+
+cache_compartilhado = CacheCompartilhado(caminho_cache_compartilhado(), app.config['CACHE_COMPARTILHADO_MAX_ITENS'])
+cache_fragmentos = CacheFragmentos(app.config['CACHE_FRAGMENTOS_MAX_ITENS'], cache_compartilhado)
+cache_estados_mobile = CacheFragmentos(app.config['SINCRONIZACAO_MAX_VERSOES'], cache_compartilhado)
+
+
+# Versão global dos dados (contador persistente no cache compartilhado): qualquer commit com
+# escrita, em qualquer processo, a incrementa e invalida as chaves antigas
+def obter_versao_dados():
+    """Versão atual dos dados, lida uma vez por requisição para a página inteira ser coerente"""
+    if has_request_context():
+        if 'versao_dados' not in g:
+            g.versao_dados = cache_compartilhado.versao()
+        return g.versao_dados
+    return cache_compartilhado.versao()
+
+
+def incrementar_versao_dados(quadro_ids=()):
+    """Invalida todos os fragmentos e registra os quadros alterados para os demais processos"""
+    versao = cache_compartilhado.incrementar_versao(quadro_ids)
+    if has_request_context():
+        g.versao_dados = versao
+
+
+@event.listens_for(Session, 'after_flush')
+def _marcar_escrita_flush(session, flush_context):
+    if session.new or session.dirty or session.deleted:
+        session.info['houve_escrita'] = True
+
+
+@event.listens_for(Quadro, 'after_insert')
+@event.listens_for(Quadro, 'after_delete')
+def _marcar_quadro_incluido_excluido(mapper, connection, quadro):
+    object_session(quadro).info['quadros_alterados'] = True
+
+
+@event.listens_for(Quadro, 'after_update')
+def _marcar_quadro_atualizado(mapper, connection, quadro):
+    # Cadastro de quadros (nome, localização, ativo) alterado: o índice de busca é refeito.
+    # Eventos por objeto gravado: percorrer session.dirty a cada flush custaria o mapa de
+    # identidade inteiro, e a importação faz um flush por linha
+    sessao = object_session(quadro)
+    if sessao.is_modified(quadro, include_collections=False):
+        sessao.info['quadros_alterados'] = True
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _marcar_escrita_em_lote(orm_execute_state):
+    # UPDATE/DELETE em lote (query.delete(), query.update()) não passam pelo flush
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info['houve_escrita'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _incrementar_versao_dados(session):
+    if session.info.pop('quadros_alterados', False):
+        cache_compartilhado.incrementar_contador('quadros')
+    if session.info.pop('houve_escrita', False):
+        incrementar_versao_dados()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_escrita(session):
+    session.info.pop('houve_escrita', None)
+    session.info.pop('quadros_alterados', None)
+
+
+def fragmento_em_cache(nome, gerar):
+    """Busca um fragmento pela versão dos dados e pelo dia (métricas de "hoje" mudam na virada)"""
+    versao = obter_versao_dados()
+    return cache_fragmentos.obter((nome, versao, datetime.now().date()), gerar, versao)
+
+
+def obter_qrcode_mobile():
+    """IP local, URL e QR Code da página mobile (o QR só é gerado de novo se o IP mudar)"""
+    ip_local = obter_ip_local()
+    url_mobile = f"{url_base_mobile(ip_local)}/registrar"
+    qrcode_img = cache_fragmentos.obter(('qrcode', url_mobile), lambda: gerar_qrcode(url_mobile))
+    return ip_local, url_mobile, qrcode_img
+
+
+@app.route('/api/cache/estatisticas', methods=['GET'])
+def api_cache_estatisticas():
+    """Retorna os contadores do cache de fragmentos e a versão atual dos dados"""
+    return jsonify({
+        'sucesso': True,
+        'versao_dados': obter_versao_dados(),
+        'cache': cache_fragmentos.estatisticas(),
+        'compartilhado': cache_compartilhado.estatisticas()
+    }), 200
+
+
+# ========================================
+# COMPRESSÃO DE RESPOSTAS (GZIP)
+# ========================================
+
+_estatisticas_compressao = {}
+_estatisticas_compressao_lock = threading.Lock()
+
+
+def registrar_estatistica_compressao(rota, bytes_originais, bytes_comprimidos, tempo_cpu):
+    with _estatisticas_compressao_lock:
+        item = _estatisticas_compressao.setdefault(rota, {
+            'respostas': 0, 'bytes_originais': 0, 'bytes_comprimidos': 0, 'tempo_cpu': 0.0
+        })
+        item['respostas'] += 1
+        item['bytes_originais'] += bytes_originais
+        item['bytes_comprimidos'] += bytes_comprimidos
+        item['tempo_cpu'] += tempo_cpu
+
+
+def comprimir_em_fluxo(partes, rota):
+    """Comprime uma resposta em streaming, liberando cada pedaço assim que é gerado"""
+    compressor = zlib.compressobj(app.config['COMPRESSAO_NIVEL'], zlib.DEFLATED, 31)  # 31 = cabeçalho gzip
+    bytes_originais = bytes_comprimidos = 0
+    tempo_cpu = 0.0
+
+    try:
+        for parte in partes:
+            if isinstance(parte, str):
+                parte = parte.encode('utf-8')
+            inicio = time.thread_time()
+            saida = compressor.compress(parte) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            tempo_cpu += time.thread_time() - inicio
+            bytes_originais += len(parte)
+            bytes_comprimidos += len(saida)
+            yield saida
+
+        saida = compressor.flush()
+        bytes_comprimidos += len(saida)
+        yield saida
+    finally:
+        registrar_estatistica_compressao(rota, bytes_originais, bytes_comprimidos, tempo_cpu)
+
+
+@app.after_request
+def comprimir_resposta(response):
+    """Comprime com gzip respostas de texto/JSON acima do limite quando o cliente aceita"""
+    if not app.config['COMPRESSAO_ATIVA']:
+        return response
+    if 'gzip' not in request.headers.get('Accept-Encoding', '').lower():
+        return response
+    if not 200 <= response.status_code < 300 or response.status_code == 206:
+        return response
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    if response.mimetype not in app.config['COMPRESSAO_TIPOS']:
+        return response
+
+    rota = request.url_rule.rule if request.url_rule else request.path
+    response.vary.add('Accept-Encoding')
+
+    if response.is_streamed:
+        response.response = comprimir_em_fluxo(response.response, rota)
+        response.headers.pop('Content-Length', None)
+        response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+    dados = response.get_data()
+    if len(dados) < app.config['COMPRESSAO_MIN_BYTES']:
+        return response
+
+    inicio = time.thread_time()
+    comprimido = gzip.compress(dados, compresslevel=app.config['COMPRESSAO_NIVEL'])
+    tempo_cpu = time.thread_time() - inicio
+
+    if len(comprimido) >= len(dados):
+        return response
+
+    registrar_estatistica_compressao(rota, len(dados), len(comprimido), tempo_cpu)
+    response.set_data(comprimido)
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+@app.route('/api/compressao/estatisticas', methods=['GET'])
+def api_compressao_estatisticas():
+    """Bytes economizados e custo de CPU da compressão, por rota"""
+    with _estatisticas_compressao_lock:
+        itens = {rota: dict(item) for rota, item in _estatisticas_compressao.items()}
+
+    rotas = []
+    for rota, item in sorted(itens.items(), key=lambda par: par[1]['bytes_originais'] - par[1]['bytes_comprimidos'], reverse=True):
+        economizados = item['bytes_originais'] - item['bytes_comprimidos']
+        rotas.append({
+            'rota': rota,
+            'respostas': item['respostas'],
+            'bytes_originais': item['bytes_originais'],
+            'bytes_comprimidos': item['bytes_comprimidos'],
+            'bytes_economizados': economizados,
+            'taxa_reducao': round(economizados / item['bytes_originais'] * 100, 1) if item['bytes_originais'] else 0,
+            'tempo_cpu_ms': round(item['tempo_cpu'] * 1000, 2),
+            'tempo_cpu_medio_ms': round(item['tempo_cpu'] * 1000 / item['respostas'], 3)
+        })
+
+    return jsonify({
+        'sucesso': True,
+        'config': {
+            'ativa': app.config['COMPRESSAO_ATIVA'],
+            'min_bytes': app.config['COMPRESSAO_MIN_BYTES'],
+            'nivel': app.config['COMPRESSAO_NIVEL']
+        },
+        'rotas': rotas
+    }), 200
+
+
+# ========================================
+# ANÁLISE DE DESVIOS (REVISÃO)
+# ========================================
+
+JANELA_LINHA_BASE_DIAS = 90     # Histórico usado para as linhas de base
+MIN_AMOSTRAS_DIA_SEMANA = 4     # Mínimo de leituras no dia da semana para usar a base específica
+LIMITE_ESCORE_ALERTA = 3.5      # Escore robusto (Iglewicz-Hoaglin) a partir do qual é alerta
+LIMITE_ESCORE_CRITICO = 5.0     # Escore robusto a partir do qual é crítico
+
+# Cache das linhas de base por quadro (recalculado por completo uma vez por dia e, nos
+# quadros alterados em qualquer processo, a cada nova versão dos dados)
+_cache_linhas_base = {'data': None, 'versao': 0, 'quadros': {}}
+_cache_linhas_base_lock = threading.Lock()
+
+
+def calcular_linhas_base(quadro_ids=None):
+    """Calcula mediana/MAD geral e por dia da semana de todos os quadros em uma única passada vetorizada"""
+    import pandas as pd
+    inicio = datetime.combine(datetime.now().date() - timedelta(days=JANELA_LINHA_BASE_DIAS), datetime.min.time())
+
+    # Lê a série distribuída: dias sem leitura não viram um pico no dia da leitura seguinte
+    query = db.session.query(ConsumoDistribuido.quadro_id, ConsumoDistribuido.data, ConsumoDistribuido.consumo)\
+        .filter(ConsumoDistribuido.data >= inicio.date())\
+        .filter(ConsumoDistribuido.reset == False)
+
+    if quadro_ids is not None:
+        query = query.filter(ConsumoDistribuido.quadro_id.in_(list(quadro_ids)))
+
+    df = pd.DataFrame(query.all(), columns=['quadro_id', 'data', 'consumo'])
+
+    if df.empty:
+        return {}
+
+    df['dia_semana'] = pd.to_datetime(df['data']).dt.weekday
+
+    # Base geral por quadro
+    por_quadro = df.groupby('quadro_id')['consumo']
+    df['desvio_abs'] = (df['consumo'] - por_quadro.transform('median')).abs()
+    geral = pd.DataFrame({
+        'mediana': por_quadro.median(),
+        'media': por_quadro.mean(),
+        'amostras': por_quadro.size(),
+        'mad': df.groupby('quadro_id')['desvio_abs'].median()
+    })
+
+    # Base por quadro e dia da semana (fins de semana têm perfil próprio)
+    por_dia = df.groupby(['quadro_id', 'dia_semana'])['consumo']
+    df['desvio_abs_dia'] = (df['consumo'] - por_dia.transform('median')).abs()
+    semanal = pd.DataFrame({
+        'mediana': por_dia.median(),
+        'amostras': por_dia.size(),
+        'mad': df.groupby(['quadro_id', 'dia_semana'])['desvio_abs_dia'].median()
+    })
+
+    linhas_base = {}
+    for quadro_id, linha in geral.iterrows():
+        linhas_base[int(quadro_id)] = {
+            'mediana': float(linha['mediana']),
+            'mad': float(linha['mad']),
+            'media': float(linha['media']),
+            'amostras': int(linha['amostras']),
+            'dias_semana': {}
+        }
+
+    for (quadro_id, dia_semana), linha in semanal.iterrows():
+        linhas_base[int(quadro_id)]['dias_semana'][int(dia_semana)] = {
+            'mediana': float(linha['mediana']),
+            'mad': float(linha['mad']),
+            'amostras': int(linha['amostras'])
+        }
+
+    return linhas_base
+
+
+def obter_linhas_base():
+    """Retorna as linhas de base em cache, recalculando tudo na virada do dia e só os quadros alterados depois"""
+    hoje = datetime.now().date()
+    versao = obter_versao_dados()
+
+    with _cache_linhas_base_lock:
+        alterados = set()
+        if _cache_linhas_base['data'] == hoje and _cache_linhas_base['versao'] != versao:
+            alterados = cache_compartilhado.quadros_alterados_desde(_cache_linhas_base['versao'])
+
+        if _cache_linhas_base['data'] != hoje or alterados is None:
+            _cache_linhas_base['quadros'] = calcular_linhas_base()
+            _cache_linhas_base['data'] = hoje
+        elif alterados:
+            # Atualiza incrementalmente apenas os quadros alterados
+            novas = calcular_linhas_base(alterados)
+            for quadro_id in alterados:
+                if quadro_id in novas:
+                    _cache_linhas_base['quadros'][quadro_id] = novas[quadro_id]
+                else:
+                    _cache_linhas_base['quadros'].pop(quadro_id, None)
+
+        _cache_linhas_base['versao'] = versao
+        return _cache_linhas_base['quadros']
+
+
+def pontuar_consumo(linhas_base, quadro_id, consumo, data_referencia):
+    """Classifica um consumo contra a linha de base do quadro usando escore robusto (mediana/MAD)"""
+    resultado = {
+        'media_90_dias': 0,
+        'referencia': 0,
+        'desvio_percentual': 0,
+        'escore_robusto': 0,
+        'status_desvio': 'normal'
+    }
+
+    base = linhas_base.get(quadro_id)
+    if not base:
+        return resultado
+
+    resultado['media_90_dias'] = base['media']
+
+    # Usa a base do dia da semana quando há amostras suficientes
+    mediana, mad = base['mediana'], base['mad']
+    base_dia = base['dias_semana'].get(data_referencia.weekday())
+    if base_dia and base_dia['amostras'] >= MIN_AMOSTRAS_DIA_SEMANA:
+        mediana, mad = base_dia['mediana'], base_dia['mad']
+
+    resultado['referencia'] = mediana
+
+    if not consumo or mediana <= 0:
+        return resultado
+
+    resultado['desvio_percentual'] = ((consumo - mediana) / mediana) * 100
+
+    if mad > 0:
+        escore = 0.6745 * (consumo - mediana) / mad
+        resultado['escore_robusto'] = escore
+
+        if abs(escore) > LIMITE_ESCORE_CRITICO:
+            resultado['status_desvio'] = 'critico'
+        elif abs(escore) > LIMITE_ESCORE_ALERTA:
+            resultado['status_desvio'] = 'alerta'
+    else:
+        # Série sem variação: mantém os limites percentuais antigos
+        if abs(resultado['desvio_percentual']) > 50:
+            resultado['status_desvio'] = 'critico'
+        elif abs(resultado['desvio_percentual']) > 30:
+            resultado['status_desvio'] = 'alerta'
+
+    return resultado
+
+
+def montar_dados_revisao(rascunhos):
+    """Monta as linhas da tela de revisão com a análise de desvio de cada rascunho"""
+    linhas_base = obter_linhas_base()
+    ultimas_oficiais = ultimas_leituras_por_quadro({r.quadro_id for r in rascunhos})
+    dados_revisao = []
+
+    for rascunho in rascunhos:
+        # Último valor registrado oficialmente
+        ultima_leitura_oficial = ultimas_oficiais.get(rascunho.quadro_id)
+
+        # Depois de dias sem leitura o consumo provisório cobre a lacuna inteira: compara a média diária
+        dias_sem_leitura = 1
+        if ultima_leitura_oficial:
+            dias_sem_leitura = max(1, (rascunho.data_registro.date() - ultima_leitura_oficial.data_registro.date()).days)
+        consumo_diario = rascunho.consumo_provisorio / dias_sem_leitura if rascunho.consumo_provisorio else rascunho.consumo_provisorio
+
+        analise = pontuar_consumo(linhas_base, rascunho.quadro_id, consumo_diario, rascunho.data_registro)
+
+        ultimo_valor_oficial = ultima_leitura_oficial.valor_leitura if ultima_leitura_oficial else 0
+        ultima_data_oficial = ultima_leitura_oficial.data_registro.strftime('%d/%m/%Y %H:%M') if ultima_leitura_oficial else 'Nunca'
+
+        dados_revisao.append({
+            'id': rascunho.id,
+            'quadro_id': rascunho.quadro_id,
+            'quadro_nome': rascunho.quadro.nome,
+            'quadro_localizacao': rascunho.quadro.localizacao,
+            'valor_leitura': rascunho.valor_leitura,
+            'consumo_provisorio': rascunho.consumo_provisorio,
+            'alerta_reset': rascunho.alerta_reset,
+            'dias_sem_leitura': dias_sem_leitura,
+            'media_90_dias': round(analise['media_90_dias'], 2),
+            'referencia': round(analise['referencia'], 2),
+            'desvio_percentual': round(analise['desvio_percentual'], 1),
+            'escore_robusto': round(analise['escore_robusto'], 2),
+            'status_desvio': analise['status_desvio'],
+            'ultimo_valor_oficial': round(ultimo_valor_oficial, 2),
+            'ultima_data_oficial': ultima_data_oficial
+        })
+
+    return dados_revisao
+
+
+def obter_dados_revisao(sessao_id=None):
+    """Dados da revisão dos rascunhos da sessão (ou de todas), em cache pela versão dos dados"""
+    return fragmento_em_cache(f'dados_revisao:{sessao_id or "todas"}',
+                              lambda: montar_dados_revisao(listar_rascunhos(sessao_id)))
+
+
+# ========================================
+# ROTAS
+# ========================================
+
+@app.route('/')
+@orcamento_consultas(7)
+def index():
+    """Dashboard principal com QR Code para acesso mobile"""
+    # Obtém IP local e gera QR Code
+    ip_local, url_mobile, qrcode_img = obter_qrcode_mobile()
+    
+    # Cards de KPI e tabela de status vêm prontos do cache enquanto os dados não mudarem
+    fragmento_kpis = fragmento_em_cache('dashboard_kpis', lambda: render_template(
+        'dashboard_kpis.html',
+        consumo_hoje=calcular_consumo_total_hoje(),
+        media_3_meses=calcular_media_ultimos_3_meses(),
+        custo_mes=obter_custo_planta_mes(datetime.now().strftime('%Y-%m')),
+        status_quadros=fragmento_em_cache('status_quadros', obter_status_quadros)
+    ))
+    fragmento_status = fragmento_em_cache('dashboard_status', lambda: render_template(
+        'dashboard_status.html',
+        status_quadros=fragmento_em_cache('status_quadros', obter_status_quadros)
+    ))
+    
+    # Conta rascunhos pendentes
+    total_rascunhos = fragmento_em_cache('total_rascunhos', LeituraRascunho.query.count)
+    
+    return render_template('dashboard.html',
+                         qrcode_img=qrcode_img,
+                         url_mobile=url_mobile,
+                         ip_local=ip_local,
+                         fragmento_kpis=fragmento_kpis,
+                         fragmento_status=fragmento_status,
+                         total_rascunhos=total_rascunhos)
+
+
+@app.route('/registrar', methods=['GET', 'POST'])
+@orcamento_consultas(7)
+def registrar():
+    """Rota principal para registro de leituras em RASCUNHO"""
+    
+    if request.method == 'GET':
+        # Renderiza template independente do status da sessão (?sessao_id= mostra só os quadros da equipe)
+        # O JavaScript no template fará o bloqueio visual se necessário
+        # ?quadro_id= (etiqueta QR colada no quadro) já abre o teclado daquele quadro
+        sessao_id = request.args.get('sessao_id', type=int)
+        query = SessaoLeitura.query.filter_by(ativa=True)
+        if sessao_id:
+            query = query.filter_by(id=sessao_id)
+        return render_template('mobile_form.html', sessao_ativa=(query.first() is not None), sessao_id=sessao_id,
+                               quadro_id=request.args.get('quadro_id', type=int))
+    
+    elif request.method == 'POST':
+        # Recebe dados do formulário
+        try:
+            quadro_id = request.form.get('quadro_id', type=int)
+            novo_valor = request.form.get('novo_valor', type=float)
+            
+            if not quadro_id or novo_valor is None:
+                return jsonify({
+                    'sucesso': False,
+                    'erro': 'Dados incompletos. Informe o quadro e o valor da leitura.'
+                }), 400
+            
+            # Bloqueia registro se o quadro não estiver em nenhuma sessão ativa
+            sessao_ativa = sessao_do_quadro(quadro_id)
+            if not sessao_ativa:
+                return jsonify({
+                    'sucesso': False,
+                    'erro': 'Não há sessão ativa para este quadro. Aguarde o supervisor iniciar uma sessão de leitura.'
+                }), 403
+            
+            # Verifica se o quadro existe
+            quadro = Quadro.query.get(quadro_id)
+            if not quadro:
+                return jsonify({
+                    'sucesso': False,
+                    'erro': 'Quadro não encontrado.'
+                }), 404
+            
+            # Busca a última leitura OFICIAL (da tabela Leitura)
+            ultima_leitura_oficial = Leitura.query.filter_by(quadro_id=quadro_id)\
+                .order_by(Leitura.data_registro.desc()).first()
+            
+            # Calcula o consumo provisório
+            consumo_provisorio = 0
+            alerta_reset = False
+            
+            if ultima_leitura_oficial:
+                valor_anterior = ultima_leitura_oficial.valor_leitura
+                
+                if novo_valor >= valor_anterior:
+                    # Consumo normal
+                    consumo_provisorio = novo_valor - valor_anterior
+                else:
+                    # INCONSISTÊNCIA DETECTADA: valor menor que o anterior
+                    return jsonify({
+                        'sucesso': False,
+                        'inconsistencia': True,
+                        'valor_anterior': valor_anterior,
+                        'novo_valor': novo_valor,
+                        'quadro_nome': quadro.nome,
+                        'mensagem': 'O valor informado é MENOR que a leitura anterior. O relógio do medidor virou?'
+                    }), 409  # 409 = Conflict
+            
+            # Verifica se já existe um rascunho para este quadro na sessão
+            rascunho_existente = LeituraRascunho.query.filter_by(sessao_id=sessao_ativa.id, quadro_id=quadro_id).first()
+            
+            # Usa a data de referência da sessão ativa
+            data_registro = datetime.combine(sessao_ativa.data_referencia, datetime.now().time())
+            
+            if rascunho_existente:
+                # Atualiza o rascunho existente
+                rascunho_existente.valor_leitura = novo_valor
+                rascunho_existente.consumo_provisorio = consumo_provisorio
+                rascunho_existente.alerta_reset = alerta_reset
+                rascunho_existente.data_registro = data_registro
+            else:
+                # Cria novo rascunho
+                rascunho_existente = LeituraRascunho(
+                    quadro_id=quadro_id,
+                    sessao_id=sessao_ativa.id,
+                    valor_leitura=novo_valor,
+                    consumo_provisorio=consumo_provisorio,
+                    alerta_reset=alerta_reset,
+                    data_registro=data_registro
+                )
+                db.session.add(rascunho_existente)
+            
+            db.session.commit()
+            
+            return jsonify({
+                'sucesso': True,
+                'mensagem': f'Leitura registrada no RASCUNHO!',
+                'leitura': rascunho_existente.to_dict(),
+                'tipo': 'rascunho'
+            }), 201
+            
+        except ValueError:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Valor inválido. Certifique-se de inserir um número válido.'
+            }), 400
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({
+                'sucesso': False,
+                'erro': f'Erro ao processar leitura: {str(e)}'
+            }), 500
+
+
+@app.route('/confirmar_reset', methods=['POST'])
+def confirmar_reset():
+    """Confirma e salva leitura em RASCUNHO quando o usuário confirma que o medidor virou"""
+    try:
+        quadro_id = request.form.get('quadro_id', type=int)
+        novo_valor = request.form.get('novo_valor', type=float)
+        
+        if not quadro_id or novo_valor is None:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Dados incompletos.'
+            }), 400
+        
+        # Verifica se o quadro existe
+        quadro = Quadro.query.get(quadro_id)
+        if not quadro:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Quadro não encontrado.'
+            }), 404
+        
+        # Busca a sessão ativa do quadro para obter data de referência
+        sessao_ativa = sessao_do_quadro(quadro_id)
+        data_registro = datetime.combine(sessao_ativa.data_referencia, datetime.now().time()) if sessao_ativa else datetime.now()
+        sessao_id = sessao_ativa.id if sessao_ativa else None
+        
+        # Verifica se já existe um rascunho para este quadro na sessão
+        rascunho_existente = LeituraRascunho.query.filter_by(sessao_id=sessao_id, quadro_id=quadro_id).first()
+        
+        if rascunho_existente:
+            # Atualiza o rascunho existente
+            rascunho_existente.valor_leitura = novo_valor
+            rascunho_existente.consumo_provisorio = novo_valor  # Considera o novo valor como consumo total
+            rascunho_existente.alerta_reset = True
+            rascunho_existente.data_registro = data_registro
+        else:
+            # Cria novo rascunho com alerta de reset
+            rascunho_existente = LeituraRascunho(
+                quadro_id=quadro_id,
+                sessao_id=sessao_id,
+                valor_leitura=novo_valor,
+                consumo_provisorio=novo_valor,  # Considera o novo valor como consumo total
+                alerta_reset=True,  # Marca que houve reset/virada do medidor
+                data_registro=data_registro
+            )
+            db.session.add(rascunho_existente)
+        
+        db.session.commit()
+        
+        return jsonify({
+            'sucesso': True,
+            'mensagem': f'Leitura com RESET registrada no RASCUNHO!',
+            'leitura': rascunho_existente.to_dict(),
+            'tipo': 'rascunho'
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro ao confirmar reset: {str(e)}'
+        }), 500
+
+
+@app.route('/iniciar_contagem', methods=['POST'])
+def iniciar_contagem():
+    """Limpa os rascunhos da sessão informada para ela iniciar uma nova contagem do dia"""
+    try:
+        sessao_id = ler_sessao_id()
+        
+        # Sem sessao_id: vale a única sessão ativa; sem nenhuma ativa, não há contagem de outra equipe a preservar
+        if sessao_id is None:
+            sessoes = SessaoLeitura.query.filter_by(ativa=True).limit(2).all()
+            if len(sessoes) > 1:
+                return jsonify({
+                    'sucesso': False,
+                    'erro': 'Há mais de uma sessão ativa. Informe sessao_id.'
+                }), 400
+            sessao_id = sessoes[0].id if sessoes else None
+        
+        query = LeituraRascunho.query
+        if sessao_id:
+            query = query.filter_by(sessao_id=sessao_id)
+        
+        # Limpa os rascunhos
+        total_rascunhos = query.delete(synchronize_session=False)
+        db.session.commit()
+        
+        return jsonify({
+            'sucesso': True,
+            'mensagem': f'Nova contagem iniciada! {total_rascunhos} rascunho(s) removido(s).'
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro ao iniciar contagem: {str(e)}'
+        }), 500
+
+
+@app.route('/revisao')
+@orcamento_consultas(6)
+def revisao():
+    """Tela de revisão e validação dos rascunhos antes da consolidação final (?sessao_id= para uma equipe)"""
+    sessao_id = request.args.get('sessao_id', type=int)
+    
+    # Prepara dados com análise de desvios (reaproveitados enquanto nenhum rascunho mudar)
+    dados_revisao = obter_dados_revisao(sessao_id)
+    
+    # Sessões ativas para alternar entre equipes e áreas para iniciar uma nova
+    sessoes_ativas = SessaoLeitura.query.filter_by(ativa=True).order_by(SessaoLeitura.id).all()
+    areas = Area.query.order_by(Area.nome).all()
+    
+    # Variáveis para a sidebar
+    ip_local, url_mobile, qrcode_img = obter_qrcode_mobile()
+    total_rascunhos = len(dados_revisao)
+    
+    return render_template('revisao.html', 
+                         dados_revisao=dados_revisao,
+                         sessao_id=sessao_id,
+                         sessoes_ativas=sessoes_ativas,
+                         areas=areas,
+                         qrcode_img=qrcode_img,
+                         ip_local=ip_local,
+                         total_rascunhos=total_rascunhos)
+
+
+@app.route('/revisao/editar/<int:id>', methods=['POST'])
+def editar_rascunho(id):
+    """Edita um rascunho específico"""
+    try:
+        rascunho = LeituraRascunho.query.get(id)
+        
+        if not rascunho:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Rascunho não encontrado.'
+            }), 404
+        
+        novo_valor = request.form.get('valor_leitura', type=float)
+        
+        if novo_valor is None:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Valor da leitura é obrigatório.'
+            }), 400
+        
+        # Busca última leitura oficial para recalcular consumo
+        ultima_oficial = Leitura.query.filter_by(quadro_id=rascunho.quadro_id)\
+            .order_by(Leitura.data_registro.desc()).first()
+        
+        # Recalcula consumo provisório
+        if ultima_oficial:
+            if novo_valor >= ultima_oficial.valor_leitura:
+                rascunho.consumo_provisorio = novo_valor - ultima_oficial.valor_leitura
+                rascunho.alerta_reset = False
+            else:
+                # Valor menor - marca como reset
+                rascunho.consumo_provisorio = novo_valor
+                rascunho.alerta_reset = True
+        else:
+            rascunho.consumo_provisorio = 0
+            rascunho.alerta_reset = False
+        
+        rascunho.valor_leitura = novo_valor
+        rascunho.data_registro = datetime.now()
+        
+        db.session.commit()
+        
+        return jsonify({
+            'sucesso': True,
+            'mensagem': 'Rascunho atualizado com sucesso!',
+            'rascunho': rascunho.to_dict()
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro ao editar rascunho: {str(e)}'
+        }), 500
+
+
+@app.route('/verificar_conflitos', methods=['GET'])
+@orcamento_consultas(3)
+def verificar_conflitos():
+    """Verifica se há conflitos de data antes de consolidar (apenas os rascunhos da sessão informada)"""
+    try:
+        rascunhos = listar_rascunhos(request.args.get('sessao_id', type=int))
+        
+        if not rascunhos:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Não há rascunhos para verificar.'
+            }), 400
+        
+        conflitos = []
+        existentes = leituras_no_mesmo_dia(rascunhos)
+        
+        for rascunho in rascunhos:
+            # Leitura oficial do mesmo quadro no mesmo DIA (ignora hora)
+            data_rascunho = rascunho.data_registro.date()
+            leitura_existente = existentes.get((rascunho.quadro_id, data_rascunho))
+            
+            if leitura_existente:
+                conflitos.append({
+                    'rascunho_id': rascunho.id,
+                    'quadro_nome': rascunho.quadro.nome,
+                    'quadro_localizacao': rascunho.quadro.localizacao,
+                    'rascunho_data': rascunho.data_registro.strftime('%d/%m/%Y às %H:%M'),
+                    'rascunho_valor': rascunho.valor_leitura,
+                    'existente_id': leitura_existente.id,
+                    'existente_data': leitura_existente.data_registro.strftime('%d/%m/%Y às %H:%M'),
+                    'existente_valor': leitura_existente.valor_leitura
+                })
+        
+        return jsonify({
+            'sucesso': True,
+            'tem_conflitos': len(conflitos) > 0,
+            'conflitos': conflitos,
+            'total_rascunhos': len(rascunhos)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro ao verificar conflitos: {str(e)}'
+        }), 500
+
+
+@app.route('/consolidar', methods=['POST'])
+@orcamento_consultas(20)
+def consolidar():
+    """Consolida os rascunhos (da sessão informada ou todos), movendo para a tabela definitiva Leitura"""
+    try:
+        # Recebe decisões de conflitos do frontend
+        decisoes = request.json.get('decisoes', {}) if request.is_json else {}
+        
+        # Busca os rascunhos da sessão (sem sessao_id: todos)
+        rascunhos = listar_rascunhos(ler_sessao_id())
+        
+        if not rascunhos:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Não há rascunhos para consolidar.'
+            }), 400
+        
+        total_consolidado = 0
+        total_substituido = 0
+        total_pulado = 0
+        alteracoes = []
+        existentes = leituras_no_mesmo_dia(rascunhos)
+        
+        # Processa cada rascunho
+        for rascunho in rascunhos:
+            rascunho_id_str = str(rascunho.id)
+            
+            # Verifica se existe leitura oficial do mesmo dia
+            data_rascunho = rascunho.data_registro.date()
+            leitura_existente = existentes.get((rascunho.quadro_id, data_rascunho))
+            
+            if leitura_existente:
+                # Há conflito - verifica decisão do usuário
+                decisao = decisoes.get(rascunho_id_str, 'pular')
+                
+                if decisao == 'substituir':
+                    # Remove a leitura antiga e adiciona a nova
+                    db.session.delete(leitura_existente)
+                    
+                    leitura_definitiva = Leitura(
+                        quadro_id=rascunho.quadro_id,
+                        data_registro=rascunho.data_registro,
+                        valor_leitura=rascunho.valor_leitura,
+                        consumo_dia=rascunho.consumo_provisorio,
+                        alerta_reset=rascunho.alerta_reset
+                    )
+                    db.session.add(leitura_definitiva)
+                    db.session.delete(rascunho)
+                    existentes[(rascunho.quadro_id, data_rascunho)] = leitura_definitiva
+                    alteracoes.append((rascunho.quadro_id, data_rascunho))
+                    total_substituido += 1
+                    
+                elif decisao == 'manter_ambas':
+                    # Mantém a antiga e adiciona a nova
+                    leitura_definitiva = Leitura(
+                        quadro_id=rascunho.quadro_id,
+                        data_registro=rascunho.data_registro,
+                        valor_leitura=rascunho.valor_leitura,
+                        consumo_dia=rascunho.consumo_provisorio,
+                        alerta_reset=rascunho.alerta_reset
+                    )
+                    db.session.add(leitura_definitiva)
+                    db.session.delete(rascunho)
+                    alteracoes.append((rascunho.quadro_id, data_rascunho))
+                    total_consolidado += 1
+                    
+                else:  # 'pular' ou sem decisão
+                    # Não faz nada, mantém o rascunho
+                    total_pulado += 1
+            else:
+                # Sem conflito - consolida normalmente
+                leitura_definitiva = Leitura(
+                    quadro_id=rascunho.quadro_id,
+                    data_registro=rascunho.data_registro,
+                    valor_leitura=rascunho.valor_leitura,
+                    consumo_dia=rascunho.consumo_provisorio,
+                    alerta_reset=rascunho.alerta_reset
+                )
+                db.session.add(leitura_definitiva)
+                db.session.delete(rascunho)
+                existentes[(rascunho.quadro_id, data_rascunho)] = leitura_definitiva
+                alteracoes.append((rascunho.quadro_id, data_rascunho))
+                total_consolidado += 1
+        
+        # Propaga as alterações para relatórios e agregados
+        registrar_alteracao_leituras(alteracoes)
+        
+        db.session.commit()
+        
+        # Atualiza caches e modelos apenas dos quadros consolidados
+        processar_apos_alteracao(alteracoes)
+        
+        mensagem_partes = []
+        if total_consolidado > 0:
+            mensagem_partes.append(f'{total_consolidado} leitura(s) consolidada(s)')
+        if total_substituido > 0:
+            mensagem_partes.append(f'{total_substituido} substituída(s)')
+        if total_pulado > 0:
+            mensagem_partes.append(f'{total_pulado} pulada(s)')
+        
+        return jsonify({
+            'sucesso': True,
+            'mensagem': ', '.join(mensagem_partes) + '!',
+            'total_consolidado': total_consolidado,
+            'total_substituido': total_substituido,
+            'total_pulado': total_pulado
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro ao consolidar: {str(e)}'
+        }), 500
+
+
+@app.route('/quadros')
+@orcamento_consultas(1)
+def listar_quadros():
+    """Lista todos os quadros"""
+    quadros = Quadro.query.filter_by(ativo=True).all()
+    return jsonify([q.to_dict() for q in quadros])
+
+
+@app.route('/quadro/<int:quadro_id>/ultima-leitura')
+@orcamento_consultas(2)
+def ultima_leitura_quadro(quadro_id):
+    """Retorna a última leitura de um quadro específico"""
+    quadro = Quadro.query.get(quadro_id)
+    
+    if not quadro:
+        return jsonify({
+            'erro': 'Quadro não encontrado'
+        }), 404
+    
+    ultima_leitura = Leitura.query.filter_by(quadro_id=quadro_id)\
+        .order_by(Leitura.data_registro.desc()).first()
+    
+    if ultima_leitura:
+        return jsonify({
+            'existe': True,
+            'valor': ultima_leitura.valor_leitura,
+            'data': ultima_leitura.data_registro.strftime('%d/%m/%Y às %H:%M'),
+            'consumo_anterior': ultima_leitura.consumo_dia,
+            'alerta_reset': ultima_leitura.alerta_reset
+        })
+    else:
+        return jsonify({
+            'existe': False,
+            'mensagem': 'Nenhuma leitura registrada ainda para este quadro'
+        })
+
+
+@app.route('/leituras')
+@orcamento_consultas(2)
+def listar_leituras():
+    """Lista todas as leituras"""
+    if pedido_compacto():
+        linhas = db.session.query(
+            Leitura.id, Leitura.quadro_id, Leitura.data_registro,
+            Leitura.valor_leitura, Leitura.consumo_dia, Leitura.alerta_reset
+        ).order_by(Leitura.data_registro.desc()).limit(50).all()
+        quadros, colunas = serializar_leituras_colunar(linhas)
+        return jsonify({'quadros': quadros, 'leituras': colunas})
+    
+    leituras = listar_leituras_recentes(50)
+    return jsonify([l.to_dict() for l in leituras])
+
+
+# Campos que /api/leituras pode devolver (?campos=...)
+CAMPOS_LEITURA = ['id', 'quadro_id', 'quadro_nome', 'data_registro', 'valor_leitura', 'consumo_dia', 'alerta_reset']
+LIMITE_PADRAO_LEITURAS = 100
+LIMITE_MAXIMO_LEITURAS = 1000
+
+
+def codificar_cursor(data_registro, leitura_id):
+    """Cursor opaco com a posição (data_registro, id) da última linha da página"""
+    bruto = json.dumps([data_registro.isoformat(), leitura_id]).encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    bruto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    data_registro, leitura_id = json.loads(bruto)
+    return datetime.fromisoformat(data_registro), int(leitura_id)
+
+
+@app.route('/api/leituras', methods=['GET'])
+@orcamento_consultas(2)
+def api_leituras():
+    """Leituras oficiais com paginação por cursor em (data_registro, id), filtros e escolha de campos"""
+    try:
+        limite = min(max(request.args.get('limite', LIMITE_PADRAO_LEITURAS, type=int), 1), LIMITE_MAXIMO_LEITURAS)
+        crescente = request.args.get('ordem', 'desc').lower() == 'asc'
+        quadro_ids = [int(q) for valor in request.args.getlist('quadro_id') for q in valor.split(',') if q.strip()]
+        data_inicio = request.args.get('data_inicio')
+        data_fim = request.args.get('data_fim')
+        alerta_reset = request.args.get('alerta_reset')
+        cursor = request.args.get('cursor')
+
+        campos = [c.strip() for c in request.args.get('campos', ','.join(CAMPOS_LEITURA)).split(',') if c.strip()]
+        invalidos = [c for c in campos if c not in CAMPOS_LEITURA]
+        if invalidos:
+            return jsonify({
+                'sucesso': False,
+                'erro': f'Campo(s) inválido(s): {", ".join(invalidos)}. Use: {", ".join(CAMPOS_LEITURA)}'
+            }), 400
+
+        query = filtrar_leituras(
+            datetime.strptime(data_inicio, '%Y-%m-%d').date() if data_inicio else None,
+            datetime.strptime(data_fim, '%Y-%m-%d').date() if data_fim else None
+        )
+        if quadro_ids:
+            query = query.filter(Leitura.quadro_id.in_(quadro_ids))
+        if alerta_reset is not None and alerta_reset != '':
+            query = query.filter(Leitura.alerta_reset == (alerta_reset.lower() in ('1', 'true', 'sim')))
+
+        # Continua exatamente depois da última linha da página anterior
+        if cursor:
+            try:
+                posicao = decodificar_cursor(cursor)
+            except (ValueError, TypeError):
+                return jsonify({'sucesso': False, 'erro': 'Cursor inválido.'}), 400
+            chave = tuple_(Leitura.data_registro, Leitura.id)
+            query = query.filter(chave > posicao if crescente else chave < posicao)
+
+        # Só as colunas pedidas (mais a chave do cursor); o índice de cobertura atende sem ler a tabela
+        colunas = ['data_registro', 'id'] + [c for c in campos if c not in ('data_registro', 'id', 'quadro_nome')]
+        if 'quadro_nome' in campos and 'quadro_id' not in colunas:
+            colunas.append('quadro_id')
+
+        if crescente:
+            ordem = (Leitura.data_registro.asc(), Leitura.id.asc())
+        else:
+            ordem = (Leitura.data_registro.desc(), Leitura.id.desc())
+
+        linhas = query.with_entities(*[getattr(Leitura, c) for c in colunas])\
+            .order_by(*ordem).limit(limite + 1).all()
+
+        tem_mais = len(linhas) > limite
+        linhas = linhas[:limite]
+
+        nomes = {}
+        if 'quadro_nome' in campos and linhas:
+            nomes = dict(db.session.query(Quadro.id, Quadro.nome)
+                         .filter(Quadro.id.in_({linha.quadro_id for linha in linhas})).all())
+
+        leituras = []
+        for linha in linhas:
+            item = {}
+            for campo in campos:
+                if campo == 'quadro_nome':
+                    item[campo] = nomes.get(linha.quadro_id)
+                elif campo == 'data_registro':
+                    item[campo] = linha.data_registro.strftime('%d/%m/%Y %H:%M:%S')
+                else:
+                    item[campo] = getattr(linha, campo)
+            leituras.append(item)
+
+        return jsonify({
+            'sucesso': True,
+            'leituras': leituras,
+            'total': len(leituras),
+            'tem_mais': tem_mais,
+            'proximo_cursor': codificar_cursor(linhas[-1].data_registro, linhas[-1].id) if tem_mais else None
+        }), 200
+
+    except ValueError as e:
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Parâmetro inválido: {str(e)}'
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro ao buscar leituras: {str(e)}'
+        }), 500
+
+
+# ========================================
+# ROTAS ADMINISTRATIVAS
+# ========================================
+
+@app.route('/admin/quadros')
+@orcamento_consultas(4)
+def admin_quadros():
+    """Interface administrativa para gerenciar quadros"""
+    quadros = Quadro.query.order_by(Quadro.nome).all()
+    areas = Area.query.order_by(Area.nome).all()
+    
+    # Variáveis para a sidebar
+    ip_local, url_mobile, qrcode_img = obter_qrcode_mobile()
+    total_rascunhos = LeituraRascunho.query.count()
+    
+    return render_template('admin_quadros.html', 
+                         quadros=quadros,
+                         areas=areas,
+                         qrcode_img=qrcode_img,
+                         ip_local=ip_local,
+                         total_rascunhos=total_rascunhos)
+
+
+def ler_hierarquia_quadro(localizacao, quadro_id=None):
+    """Lê e valida a área e o quadro pai do formulário, retornando (area_id, quadro_pai_id, erro)"""
+    area_id = request.form.get('area_id', type=int)
+    quadro_pai_id = request.form.get('quadro_pai_id', type=int) or None
+    
+    # Sem área escolhida: usa a área com o nome da localização
+    if area_id:
+        if not Area.query.get(area_id):
+            return None, None, 'Área não encontrada.'
+    else:
+        area_id = obter_ou_criar_area(localizacao).id
+    
+    if quadro_pai_id:
+        if quadro_pai_id == quadro_id:
+            return None, None, 'Um quadro não pode ser submedidor de si mesmo.'
+        
+        # Impede ciclos subindo pela cadeia de quadros pai
+        pai = Quadro.query.get(quadro_pai_id)
+        if not pai:
+            return None, None, 'Quadro pai não encontrado.'
+        visitados = set()
+        while pai and pai.id not in visitados:
+            if pai.id == quadro_id:
+                return None, None, 'O quadro pai não pode ser um submedidor deste quadro.'
+            visitados.add(pai.id)
+            pai = pai.quadro_pai
+    
+    return area_id, quadro_pai_id, None
+
+
+@app.route('/admin/quadros/criar', methods=['POST'])
+def criar_quadro():
+    """Cria um novo quadro"""
+    try:
+        nome = request.form.get('nome', '').strip()
+        localizacao = request.form.get('localizacao', '').strip()
+        
+        if not nome or not localizacao:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Nome e localização são obrigatórios.'
+            }), 400
+        
+        # Verifica se já existe um quadro com esse nome
+        quadro_existente = Quadro.query.filter_by(nome=nome).first()
+        if quadro_existente:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Já existe um quadro com este nome.'
+            }), 400
+        
+        # Área e quadro pai (submedidor)
+        area_id, quadro_pai_id, erro = ler_hierarquia_quadro(localizacao)
+        if erro:
+            return jsonify({
+                'sucesso': False,
+                'erro': erro
+            }), 400
+        
+        novo_quadro = Quadro(
+            nome=nome,
+            localizacao=localizacao,
+            ativo=True,
+            area_id=area_id,
+            quadro_pai_id=quadro_pai_id
+        )
+        
+        db.session.add(novo_quadro)
+        db.session.commit()
+        
+        return jsonify({
+            'sucesso': True,
+            'mensagem': f'Quadro "{nome}" criado com sucesso!',
+            'quadro': novo_quadro.to_dict()
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro ao criar quadro: {str(e)}'
+        }), 500
+
+
+@app.route('/admin/quadros/editar/<int:id>', methods=['POST'])
+def editar_quadro(id):
+    """Edita um quadro existente"""
+    try:
+        quadro = Quadro.query.get(id)
+        
+        if not quadro:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Quadro não encontrado.'
+            }), 404
+        
+        nome = request.form.get('nome', '').strip()
+        localizacao = request.form.get('localizacao', '').strip()
+        ativo = request.form.get('ativo') == 'true'
+        
+        if not nome or not localizacao:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Nome e localização são obrigatórios.'
+            }), 400
+        
+        # Verifica se já existe outro quadro com esse nome
+        quadro_existente = Quadro.query.filter(
+            Quadro.nome == nome,
+            Quadro.id != id
+        ).first()
+        
+        if quadro_existente:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Já existe outro quadro com este nome.'
+            }), 400
+        
+        # Área e quadro pai (submedidor)
+        area_id, quadro_pai_id, erro = ler_hierarquia_quadro(localizacao, quadro_id=id)
+        if erro:
+            return jsonify({
+                'sucesso': False,
+                'erro': erro
+            }), 400
+        
+        hierarquia_alterada = (quadro.area_id, quadro.quadro_pai_id) != (area_id, quadro_pai_id)
+        
+        quadro.nome = nome
+        quadro.localizacao = localizacao
+        quadro.ativo = ativo
+        quadro.area_id = area_id
+        quadro.quadro_pai_id = quadro_pai_id
+        
+        db.session.commit()
+        
+        # Consumo das áreas muda quando o quadro troca de área ou de pai
+        if hierarquia_alterada:
+            reconstruir_agregados_areas()
+        
+        return jsonify({
+            'sucesso': True,
+            'mensagem': f'Quadro "{nome}" atualizado com sucesso!',
+            'quadro': quadro.to_dict()
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro ao editar quadro: {str(e)}'
+        }), 500
+
+
+@app.route('/admin/quadros/excluir/<int:id>', methods=['POST'])
+def excluir_quadro(id):
+    """Exclui ou desativa um quadro (soft delete se houver leituras)"""
+    try:
+        quadro = Quadro.query.get(id)
+        
+        if not quadro:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Quadro não encontrado.'
+            }), 404
+        
+        # Verifica se existem leituras associadas
+        tem_leituras = Leitura.query.filter_by(quadro_id=id).count() > 0
+        
+        if tem_leituras:
+            # Soft Delete - apenas desativa o quadro
+            quadro.ativo = False
+            db.session.commit()
+            
+            return jsonify({
+                'sucesso': True,
+                'tipo': 'desativado',
+                'mensagem': f'Quadro "{quadro.nome}" foi DESATIVADO (possui leituras associadas).'
+            }), 200
+        else:
+            # Delete real - remove do banco
+            nome_quadro = quadro.nome
+            for submedidor in quadro.submedidores:
+                submedidor.quadro_pai_id = None
+            db.session.delete(quadro)
+            db.session.commit()
+            
+            return jsonify({
+                'sucesso': True,
+                'tipo': 'excluido',
+                'mensagem': f'Quadro "{nome_quadro}" foi EXCLUÍDO permanentemente.'
+            }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro ao excluir quadro: {str(e)}'
+        }), 500
+
+
+# ========================================
+# ÁREAS E AGREGADOS DIÁRIOS
+# ========================================
+
+def obter_ou_criar_area(nome):
+    """Busca a área pelo nome, criando-a se não existir (não faz commit)"""
+    nome = nome.strip()
+    area = Area.query.filter_by(nome=nome).first()
+
+    if not area:
+        area = Area(nome=nome)
+        db.session.add(area)
+        db.session.flush()  # Obtém o ID sem commitar
+
+    return area
+
+
+def sincronizar_areas_localizacao():
+    """Vincula quadros sem área à área com o mesmo nome da sua localização"""
+    quadros = Quadro.query.filter(Quadro.area_id.is_(None)).all()
+
+    for quadro in quadros:
+        quadro.area_id = obter_ou_criar_area(quadro.localizacao).id
+
+    if quadros:
+        db.session.commit()
+        reconstruir_agregados_areas()
+
+
+def carregar_hierarquia():
+    """Retorna os mapas quadro -> (área, quadro pai) e área -> área pai"""
+    quadros = {
+        quadro_id: (area_id, quadro_pai_id)
+        for quadro_id, area_id, quadro_pai_id in db.session.query(Quadro.id, Quadro.area_id, Quadro.quadro_pai_id).all()
+    }
+    areas = dict(db.session.query(Area.id, Area.area_pai_id).all())
+    return quadros, areas
+
+
+def cadeia_areas(area_id, areas):
+    """Retorna a área informada seguida de todos os seus ancestrais"""
+    cadeia = []
+    while area_id is not None and area_id not in cadeia:
+        cadeia.append(area_id)
+        area_id = areas.get(area_id)
+    return cadeia
+
+
+def somar_agregados_areas(linhas_quadros, quadros, areas):
+    """Soma linhas (quadro_id, dia, consumo, leituras) nas áreas ancestrais e na planta"""
+    totais = {}
+
+    for quadro_id, dia, consumo, leituras in linhas_quadros:
+        area_id, quadro_pai_id = quadros.get(quadro_id, (None, None))
+
+        # Submedidores já estão contidos no consumo do quadro pai
+        if quadro_pai_id is not None:
+            continue
+
+        chaves = [('planta', 0, dia)] + [('area', a, dia) for a in cadeia_areas(area_id, areas)]
+        for chave in chaves:
+            total = totais.setdefault(chave, [0, 0])
+            total[0] += consumo or 0
+            total[1] += leituras
+
+    return totais
+
+
+def recalcular_agregados_do_dia(dia, quadros, areas):
+    """Recalcula as linhas de área e planta de um dia a partir das linhas dos quadros"""
+    linhas_quadros = [
+        (linha.referencia_id, dia, linha.consumo, linha.total_leituras)
+        for linha in ConsumoDiario.query.filter_by(escopo='quadro', data=dia).all()
+    ]
+    totais = somar_agregados_areas(linhas_quadros, quadros, areas)
+
+    existentes = ConsumoDiario.query.filter(
+        ConsumoDiario.escopo.in_(['area', 'planta']),
+        ConsumoDiario.data == dia
+    ).all()
+
+    for linha in existentes:
+        total = totais.pop((linha.escopo, linha.referencia_id, dia), None)
+        if total is None:
+            db.session.delete(linha)
+        else:
+            linha.consumo, linha.total_leituras = total
+
+    for (escopo, referencia_id, _), (consumo, leituras) in totais.items():
+        db.session.add(ConsumoDiario(escopo=escopo, referencia_id=referencia_id, data=dia,
+                                     consumo=consumo, total_leituras=leituras))
+
+
+def atualizar_consumo_diario(alteracoes):
+    """Atualiza os agregados diários apenas dos pares (quadro_id, dia) alterados (não faz commit)"""
+    quadros, areas = carregar_hierarquia()
+
+    quadros_por_dia = {}
+    for quadro_id, dia in alteracoes:
+        quadros_por_dia.setdefault(dia, set()).add(quadro_id)
+
+    for dia, quadro_ids in quadros_por_dia.items():
+        inicio_dia = datetime.combine(dia, datetime.min.time())
+        fim_dia = inicio_dia + timedelta(days=1)
+
+        totais = {
+            quadro_id: (consumo or 0, leituras)
+            for quadro_id, consumo, leituras in db.session.query(
+                    Leitura.quadro_id, func.sum(Leitura.consumo_dia), func.count(Leitura.id)
+                )
+                .filter(Leitura.quadro_id.in_(quadro_ids))
+                .filter(Leitura.data_registro >= inicio_dia)
+                .filter(Leitura.data_registro < fim_dia)
+                .group_by(Leitura.quadro_id)
+                .all()
+        }
+
+        existentes = {
+            linha.referencia_id: linha
+            for linha in ConsumoDiario.query.filter(
+                ConsumoDiario.escopo == 'quadro',
+                ConsumoDiario.data == dia,
+                ConsumoDiario.referencia_id.in_(quadro_ids)
+            ).all()
+        }
+
+        for quadro_id in quadro_ids:
+            linha = existentes.get(quadro_id)
+            total = totais.get(quadro_id)
+
+            if total is None:
+                if linha:
+                    db.session.delete(linha)
+            elif linha:
+                linha.consumo, linha.total_leituras = total
+            else:
+                db.session.add(ConsumoDiario(escopo='quadro', referencia_id=quadro_id, data=dia,
+                                             consumo=total[0], total_leituras=total[1]))
+
+        recalcular_agregados_do_dia(dia, quadros, areas)
+
+
+def reconstruir_agregados_areas():
+    """Refaz as linhas de área e planta a partir das linhas dos quadros (após mudar a hierarquia)"""
+    quadros, areas = carregar_hierarquia()
+
+    linhas_quadros = db.session.query(
+        ConsumoDiario.referencia_id, ConsumoDiario.data, ConsumoDiario.consumo, ConsumoDiario.total_leituras
+    ).filter(ConsumoDiario.escopo == 'quadro').all()
+
+    totais = somar_agregados_areas(linhas_quadros, quadros, areas)
+
+    ConsumoDiario.query.filter(ConsumoDiario.escopo.in_(['area', 'planta'])).delete(synchronize_session=False)
+    if totais:
+        db.session.execute(ConsumoDiario.__table__.insert(), [
+            {'escopo': escopo, 'referencia_id': referencia_id, 'data': dia,
+             'consumo': consumo, 'total_leituras': leituras}
+            for (escopo, referencia_id, dia), (consumo, leituras) in totais.items()
+        ])
+    # O custo da planta exclui os submedidores: com a hierarquia mudada, todos os meses mudam
+    marcar_custos_periodo(None, None)
+    db.session.commit()
+    agendador_relatorios.notificar()
+
+
+def reconstruir_consumo_diario():
+    """Reconstrói todos os agregados diários a partir das leituras"""
+    linhas = db.session.query(
+        Leitura.quadro_id, func.date(Leitura.data_registro), func.sum(Leitura.consumo_dia), func.count(Leitura.id)
+    ).group_by(Leitura.quadro_id, func.date(Leitura.data_registro)).all()
+
+    ConsumoDiario.query.delete(synchronize_session=False)
+    if linhas:
+        db.session.execute(ConsumoDiario.__table__.insert(), [
+            {'escopo': 'quadro', 'referencia_id': quadro_id,
+             'data': datetime.strptime(dia, '%Y-%m-%d').date(),
+             'consumo': consumo or 0, 'total_leituras': leituras}
+            for quadro_id, dia, consumo, leituras in linhas
+        ])
+
+    reconstruir_consumo_distribuido()
+    reconstruir_agregados_areas()
+
+
+def somar_consumo_periodo(escopo, referencia_ids, inicio, fim):
+    """Soma o consumo agregado de cada referência no período"""
+    if not referencia_ids:
+        return {}
+
+    return dict(db.session.query(ConsumoDiario.referencia_id, func.sum(ConsumoDiario.consumo))
+                .filter(ConsumoDiario.escopo == escopo)
+                .filter(ConsumoDiario.referencia_id.in_(referencia_ids))
+                .filter(ConsumoDiario.data >= inicio)
+                .filter(ConsumoDiario.data <= fim)
+                .group_by(ConsumoDiario.referencia_id)
+                .all())
+
+
+@app.route('/api/areas', methods=['GET'])
+def api_areas():
+    """Lista as áreas com seus quadros"""
+    areas = Area.query.order_by(Area.nome).all()
+    resultado = []
+
+    for area in areas:
+        dados = area.to_dict()
+        dados['quadros'] = [q.to_dict() for q in sorted(area.quadros, key=lambda q: q.nome)]
+        resultado.append(dados)
+
+    return jsonify({
+        'sucesso': True,
+        'areas': resultado
+    })
+
+
+@app.route('/api/areas/consumo', methods=['GET'])
+def api_areas_consumo():
+    """Retorna o consumo de um nível da hierarquia (planta ou área) com os seus filhos, para drill-down"""
+    try:
+        data_inicio = request.args.get('data_inicio')
+        data_fim = request.args.get('data_fim')
+        area_id = request.args.get('area_id', type=int)
+
+        fim = datetime.strptime(data_fim, '%Y-%m-%d').date() if data_fim else datetime.now().date()
+        inicio = datetime.strptime(data_inicio, '%Y-%m-%d').date() if data_inicio else fim - timedelta(days=30)
+
+        # Bancos antigos: monta os agregados na primeira consulta
+        if ConsumoDiario.query.first() is None and Leitura.query.first() is not None:
+            reconstruir_consumo_diario()
+
+        quadros = Quadro.query.order_by(Quadro.nome).all()
+        areas = Area.query.order_by(Area.nome).all()
+        mapa_areas = {a.id: a for a in areas}
+
+        if area_id:
+            area = mapa_areas.get(area_id)
+            if not area:
+                return jsonify({
+                    'sucesso': False,
+                    'erro': 'Área não encontrada.'
+                }), 404
+
+            escopo, referencia_id, nome = 'area', area_id, area.nome
+            subareas = [a for a in areas if a.area_pai_id == area_id]
+            quadros_nivel = [q for q in quadros if q.area_id == area_id and q.quadro_pai_id is None]
+            caminho = [
+                {'id': a, 'nome': mapa_areas[a].nome}
+                for a in reversed(cadeia_areas(area_id, {a.id: a.area_pai_id for a in areas}))
+            ]
+        else:
+            escopo, referencia_id, nome = 'planta', 0, 'Planta'
+            subareas = [a for a in areas if a.area_pai_id is None]
+            quadros_nivel = [q for q in quadros if q.area_id is None and q.quadro_pai_id is None]
+            caminho = []
+
+        submedidores = {}
+        for quadro in quadros:
+            if quadro.quadro_pai_id is not None:
+                submedidores.setdefault(quadro.quadro_pai_id, []).append(quadro)
+
+        ids_quadros = [q.id for q in quadros_nivel]
+        for quadro_id in list(ids_quadros):
+            ids_quadros.extend(s.id for s in submedidores.get(quadro_id, []))
+
+        consumo_areas = somar_consumo_periodo('area', [a.id for a in subareas], inicio, fim)
+        consumo_quadros = somar_consumo_periodo('quadro', ids_quadros, inicio, fim)
+
+        serie = ConsumoDiario.query.filter_by(escopo=escopo, referencia_id=referencia_id)\
+            .filter(ConsumoDiario.data >= inicio)\
+            .filter(ConsumoDiario.data <= fim)\
+            .order_by(ConsumoDiario.data).all()
+
+        return jsonify({
+            'sucesso': True,
+            'nivel': {
+                'escopo': escopo,
+                'id': area_id,
+                'nome': nome,
+                'consumo_total': round(sum(linha.consumo for linha in serie), 2)
+            },
+            'caminho': caminho,
+            'serie': {
+                'labels': [linha.data.strftime('%d/%m/%Y') for linha in serie],
+                'valores': [round(linha.consumo, 2) for linha in serie]
+            },
+            'areas': [
+                {'id': a.id, 'nome': a.nome, 'consumo': round(consumo_areas.get(a.id, 0), 2)}
+                for a in subareas
+            ],
+            'quadros': [
+                {
+                    'id': q.id,
+                    'nome': q.nome,
+                    'localizacao': q.localizacao,
+                    'consumo': round(consumo_quadros.get(q.id, 0), 2),
+                    'submedidores': [
+                        {'id': s.id, 'nome': s.nome, 'consumo': round(consumo_quadros.get(s.id, 0), 2)}
+                        for s in submedidores.get(q.id, [])
+                    ]
+                }
+                for q in quadros_nivel
+            ]
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro ao buscar consumo por área: {str(e)}'
+        }), 500
+
+
+@app.route('/admin/areas/criar', methods=['POST'])
+def criar_area():
+    """Cria uma nova área"""
+    try:
+        nome = request.form.get('nome', '').strip()
+        area_pai_id = request.form.get('area_pai_id', type=int)
+
+        if not nome:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'O nome da área é obrigatório.'
+            }), 400
+
+        if Area.query.filter_by(nome=nome).first():
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Já existe uma área com este nome.'
+            }), 400
+
+        if area_pai_id and not Area.query.get(area_pai_id):
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Área pai não encontrada.'
+            }), 404
+
+        nova_area = Area(nome=nome, area_pai_id=area_pai_id or None)
+        db.session.add(nova_area)
+        db.session.commit()
+
+        return jsonify({
+            'sucesso': True,
+            'mensagem': f'Área "{nome}" criada com sucesso!',
+            'area': nova_area.to_dict()
+        }), 201
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro ao criar área: {str(e)}'
+        }), 500
+
+
+@app.route('/admin/areas/editar/<int:id>', methods=['POST'])
+def editar_area(id):
+    """Edita o nome ou a área pai de uma área"""
+    try:
+        area = Area.query.get(id)
+
+        if not area:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Área não encontrada.'
+            }), 404
+
+        nome = request.form.get('nome', '').strip()
+        area_pai_id = request.form.get('area_pai_id', type=int) or None
+
+        if not nome:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'O nome da área é obrigatório.'
+            }), 400
+
+        if Area.query.filter(Area.nome == nome, Area.id != id).first():
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Já existe outra área com este nome.'
+            }), 400
+
+        # Impede ciclos (a área não pode ficar dentro de si mesma)
+        _, mapa_areas = carregar_hierarquia()
+        if area_pai_id and id in cadeia_areas(area_pai_id, mapa_areas):
+            return jsonify({
+                'sucesso': False,
+                'erro': 'A área pai não pode ser a própria área ou uma de suas subáreas.'
+            }), 400
+
+        hierarquia_alterada = area.area_pai_id != area_pai_id
+        area.nome = nome
+        area.area_pai_id = area_pai_id
+        db.session.commit()
+
+        if hierarquia_alterada:
+            reconstruir_agregados_areas()
+
+        return jsonify({
+            'sucesso': True,
+            'mensagem': f'Área "{nome}" atualizada com sucesso!',
+            'area': area.to_dict()
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro ao editar área: {str(e)}'
+        }), 500
+
+
+@app.route('/admin/areas/excluir/<int:id>', methods=['POST'])
+def excluir_area(id):
+    """Exclui uma área vazia (sem quadros e sem subáreas)"""
+    try:
+        area = Area.query.get(id)
+
+        if not area:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Área não encontrada.'
+            }), 404
+
+        if area.quadros or area.subareas:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'A área possui quadros ou subáreas. Mova-os antes de excluir.'
+            }), 400
+
+        nome_area = area.nome
+        db.session.delete(area)
+        ConsumoDiario.query.filter_by(escopo='area', referencia_id=id).delete()
+        db.session.commit()
+
+        return jsonify({
+            'sucesso': True,
+            'mensagem': f'Área "{nome_area}" foi EXCLUÍDA.'
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro ao excluir área: {str(e)}'
+        }), 500
+
+
+# ========================================
+# CONSUMO DISTRIBUÍDO (DIAS SEM LEITURA)
+# ========================================
+# Quando um quadro fica dias sem leitura, o consumo_dia da leitura seguinte carrega todos
+# esses dias. A série distribuída espalha esse consumo pelos dias da lacuna, igualmente
+# ('linear') ou na proporção do perfil semanal da planta ('proporcional'), e é mantida
+# junto com os agregados diários. Gráficos e linhas de base leem dela, não das leituras.
+
+PERFIL_PLANTA_SEMANAS = 8       # Histórico usado no perfil semanal da planta
+MIN_AMOSTRAS_PERFIL = 10        # Leituras de um dia por dia da semana para confiar no perfil
+
+_cache_perfil_planta = {'data': None, 'perfil': None}
+_cache_perfil_planta_lock = threading.Lock()
+
+
+def carregar_consumo_por_dia(quadro_ids=None, desde=None):
+    """Consumo e reset de cada quadro por dia com leitura, em arrays ordenados por quadro e dia
+
+    Os dias são contados desde 1970-01-01, para as contas de lacuna serem subtrações. Dias sem
+    consumo calculado (a primeira leitura do quadro) saem como reset, fora das linhas de base.
+    """
+    import numpy as np
+    dia = func.date(Leitura.data_registro)
+    query = db.session.query(Leitura.quadro_id, dia, func.sum(Leitura.consumo_dia), func.max(Leitura.alerta_reset))
+    if quadro_ids is not None:
+        query = query.filter(Leitura.quadro_id.in_(list(quadro_ids)))
+    if desde is not None:
+        query = query.filter(Leitura.data_registro >= datetime.combine(desde, datetime.min.time()))
+    linhas = query.group_by(Leitura.quadro_id, dia).order_by(Leitura.quadro_id, dia).all()
+
+    if not linhas:
+        vazio = np.array([], dtype=np.int64)
+        return vazio, vazio, np.array([], dtype=float), np.array([], dtype=bool)
+
+    quadros, dias, consumos, resets = zip(*linhas)
+    return (np.array(quadros, dtype=np.int64),
+            np.array(dias, dtype='datetime64[D]').astype(np.int64),
+            np.array([c if c is not None else 0.0 for c in consumos], dtype=float),
+            np.array([bool(r) or c is None for r, c in zip(resets, consumos)], dtype=bool))
+
+
+def medir_lacunas(quadros, dias):
+    """Dias cobertos por cada leitura (1 = leitura no dia seguinte à anterior) e a primeira de cada quadro"""
+    import numpy as np
+    primeira = np.ones(len(dias), dtype=bool)
+    primeira[1:] = quadros[1:] != quadros[:-1]
+    lacuna = np.ones(len(dias), dtype=np.int64)
+    lacuna[1:] = dias[1:] - dias[:-1]
+    lacuna[primeira] = 1
+    return lacuna, primeira
+
+
+def calcular_perfil_semanal(quadros, dias, consumos, resets):
+    """Consumo médio por quadro em cada dia da semana (segunda = 0), só de leituras sem lacuna nem reset"""
+    import numpy as np
+    lacuna, primeira = medir_lacunas(quadros, dias)
+    um_dia = (lacuna == 1) & ~primeira & ~resets
+    dia_semana = (dias[um_dia] + 3) % 7  # 1970-01-01 foi uma quinta-feira
+    soma = np.bincount(dia_semana, weights=consumos[um_dia], minlength=7)
+    amostras = np.bincount(dia_semana, minlength=7)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(amostras >= MIN_AMOSTRAS_PERFIL, soma / amostras, np.nan)
+
+
+def obter_perfil_semanal():
+    """Perfil semanal da planta para a distribuição proporcional (recalculado uma vez por dia)"""
+    if app.config['DISTRIBUICAO_LACUNAS'] != 'proporcional':
+        return None
+
+    hoje = datetime.now().date()
+    with _cache_perfil_planta_lock:
+        if _cache_perfil_planta['data'] != hoje:
+            inicio = hoje - timedelta(weeks=PERFIL_PLANTA_SEMANAS)
+            _cache_perfil_planta['perfil'] = calcular_perfil_semanal(*carregar_consumo_por_dia(desde=inicio))
+            _cache_perfil_planta['data'] = hoje
+        return _cache_perfil_planta['perfil']
+
+
+def distribuir_lacunas(quadros, dias, consumos, resets, perfil_semanal=None):
+    """Espalha o consumo de cada leitura pelos dias desde a leitura anterior do mesmo quadro
+
+    Uma passada vetorizada sobre todos os quadros: cada leitura vira um bloco com um dia por
+    dia da lacuna. Com perfil, cada dia recebe a parte do seu dia da semana; lacunas em que o
+    perfil não tem dados voltam para a divisão igual. A soma de cada bloco é o consumo da leitura.
+    Retorna (quadro, dia, consumo, estimado, reset) por dia do calendário.
+    """
+    import numpy as np
+    lacuna, _ = medir_lacunas(quadros, dias)
+
+    origem = np.repeat(np.arange(len(dias)), lacuna)
+    passo = np.arange(len(origem)) - (np.cumsum(lacuna) - lacuna)[origem]
+    dia = dias[origem] - lacuna[origem] + 1 + passo
+
+    peso = 1.0 / lacuna[origem]
+    if perfil_semanal is not None and len(origem):
+        fator = perfil_semanal[(dia + 3) % 7]
+        soma = np.bincount(origem, weights=fator, minlength=len(dias))
+        valido = np.isfinite(soma) & (soma > 0)
+        peso = np.where(valido[origem], fator / np.where(valido, soma, 1.0)[origem], peso)
+
+    return quadros[origem], dia, consumos[origem] * peso, lacuna[origem] > 1, resets[origem]
+
+
+def linhas_consumo_distribuido(quadros, dias, consumos, estimados, resets):
+    """Linhas para inserir em lote na tabela consumo_distribuido"""
+    datas = dias.astype('datetime64[D]').tolist()
+    return [
+        {'quadro_id': int(quadro_id), 'data': data, 'consumo': float(consumo),
+         'estimado': bool(estimado), 'reset': bool(reset)}
+        for quadro_id, data, consumo, estimado, reset in zip(quadros, datas, consumos, estimados, resets)
+    ]
+
+
+def atualizar_consumo_distribuido(alteracoes):
+    """Refaz a série distribuída dos quadros alterados a partir da leitura anterior à alteração (não faz commit)"""
+    import numpy as np
+    desde = min(dia for _, dia in alteracoes)
+    quadro_ids = sorted({quadro_id for quadro_id, _ in alteracoes})
+
+    # Última leitura de cada quadro antes da alteração: a lacuna que ela fecha não muda
+    ancoras = {
+        quadro_id: data.date()
+        for quadro_id, data in db.session.query(Leitura.quadro_id, func.max(Leitura.data_registro))
+            .filter(Leitura.quadro_id.in_(quadro_ids))
+            .filter(Leitura.data_registro < datetime.combine(desde, datetime.min.time()))
+            .group_by(Leitura.quadro_id)
+            .all()
+    }
+    inicio = min(ancoras.values()) if ancoras else desde
+
+    quadros, dias, consumos, resets = carregar_consumo_por_dia(quadro_ids, inicio)
+    serie = distribuir_lacunas(quadros, dias, consumos, resets, obter_perfil_semanal())
+
+    # O primeiro dia carregado de um quadro com âncora fecha uma lacuna iniciada antes da janela:
+    # ele e os dias anteriores ficam como estão; quadros sem âncora são refeitos por inteiro
+    unicos, primeiros = np.unique(quadros, return_index=True)
+    com_ancora = np.isin(unicos, list(ancoras))
+    manter_ate = np.where(com_ancora, dias[primeiros], np.iinfo(np.int64).min)
+    if len(unicos):
+        refazer = serie[1] > manter_ate[np.searchsorted(unicos, serie[0])]
+        serie = tuple(coluna[refazer] for coluna in serie)
+
+    grupos = {}
+    for quadro_id, limite, ancorado in zip(unicos.tolist(), manter_ate.tolist(), com_ancora.tolist()):
+        if ancorado:
+            grupos.setdefault(limite, []).append(quadro_id)
+    for limite, ids in grupos.items():
+        ConsumoDistribuido.query.filter(
+            ConsumoDistribuido.quadro_id.in_(ids),
+            ConsumoDistribuido.data > np.datetime64(limite, 'D').tolist()
+        ).delete(synchronize_session=False)
+
+    ancorados = set(unicos[com_ancora].tolist())
+    refeitos = [quadro_id for quadro_id in quadro_ids if quadro_id not in ancorados]
+    if refeitos:
+        ConsumoDistribuido.query.filter(ConsumoDistribuido.quadro_id.in_(refeitos)).delete(synchronize_session=False)
+
+    linhas = linhas_consumo_distribuido(*serie)
+    if linhas:
+        db.session.execute(ConsumoDistribuido.__table__.insert(), linhas)
+
+
+def reconstruir_consumo_distribuido():
+    """Refaz a série distribuída de todos os quadros (não faz commit)"""
+    serie = distribuir_lacunas(*carregar_consumo_por_dia(), obter_perfil_semanal())
+    ConsumoDistribuido.query.delete(synchronize_session=False)
+    linhas = linhas_consumo_distribuido(*serie)
+    if linhas:
+        db.session.execute(ConsumoDistribuido.__table__.insert(), linhas)
+
+
+def montar_grafico_distribuido(inicio, fim, quadro_id=None):
+    """Séries diárias por quadro no formato colunar do gráfico, a partir da série distribuída"""
+    query = db.session.query(ConsumoDistribuido.quadro_id, ConsumoDistribuido.data, ConsumoDistribuido.consumo)
+    if inicio:
+        query = query.filter(ConsumoDistribuido.data >= inicio)
+    if fim:
+        query = query.filter(ConsumoDistribuido.data <= fim)
+    if quadro_id:
+        query = query.filter(ConsumoDistribuido.quadro_id == quadro_id)
+    linhas = query.all()
+
+    dias = sorted({data.toordinal() - ORDINAL_EPOCA for _, data, _ in linhas})
+    posicao_dia = {dia: i for i, dia in enumerate(dias)}
+    series = {}
+    for referencia_id, data, consumo in linhas:
+        serie = series.setdefault(referencia_id, [0.0] * len(dias))
+        serie[posicao_dia[data.toordinal() - ORDINAL_EPOCA]] += consumo
+
+    ordem_quadros = sorted(series)
+    return {
+        'dias': dias,
+        'quadros': ordem_quadros,
+        'series': [[round(v, 2) for v in series[q]] for q in ordem_quadros],
+        'total': [round(sum(series[q][i] for q in ordem_quadros), 2) for i in range(len(dias))],
+        'distribuido': True
+    }
+
+
+# ========================================
+# PREVISÃO DE CONSUMO (HOLT-WINTERS)
+# ========================================
+
+JANELA_PREVISAO_DIAS = 365      # Histórico máximo usado no ajuste
+MIN_DIAS_PREVISAO = 14          # Mínimo de dias com leitura para ajustar um quadro
+MAX_DIAS_AVANCO_INCREMENTAL = 60  # Acima disso o modelo é reajustado do zero
+
+# Grade de parâmetros testada para cada quadro (nível, tendência, sazonalidade semanal)
+GRADE_ALFA = [0.1, 0.3, 0.5]
+GRADE_BETA = [0.0, 0.05]
+GRADE_GAMA = [0.05, 0.2, 0.4]
+
+
+def montar_series_diarias(quadro_ids, inicio, fim):
+    """Monta a matriz quadros x dias de consumo a partir dos agregados (NaN = dia sem leitura)"""
+    import numpy as np
+    total_dias = (fim - inicio).days + 1
+    indice = {quadro_id: i for i, quadro_id in enumerate(quadro_ids)}
+    series = np.full((len(quadro_ids), max(total_dias, 0)), np.nan)
+
+    linhas = db.session.query(ConsumoDiario.referencia_id, ConsumoDiario.data, ConsumoDiario.consumo)\
+        .filter(ConsumoDiario.escopo == 'quadro')\
+        .filter(ConsumoDiario.referencia_id.in_(quadro_ids))\
+        .filter(ConsumoDiario.data >= inicio)\
+        .filter(ConsumoDiario.data <= fim)\
+        .all()
+
+    for quadro_id, dia, consumo in linhas:
+        series[indice[quadro_id], (dia - inicio).days] = consumo
+
+    return series
+
+
+def executar_holt_winters(series, dias_semana, nivel, tendencia, sazonal, alfa, beta, gama):
+    """Aplica as equações de Holt-Winters aditivo dia a dia, vetorizado em todos os quadros e parâmetros
+
+    As matrizes têm formato (parametros, quadros) e a sazonalidade (parametros, quadros, 7).
+    Dias sem leitura (NaN) apenas propagam o nível e a tendência.
+    """
+    import numpy as np
+    nivel, tendencia, sazonal = nivel.copy(), tendencia.copy(), sazonal.copy()
+    soma_quadrados = np.zeros_like(nivel)
+    observacoes = np.zeros_like(nivel)
+
+    for t, dia_semana in enumerate(dias_semana):
+        y = series[:, t]
+        observado = ~np.isnan(y)
+        s = sazonal[:, :, dia_semana]
+
+        previsto = nivel + tendencia + s
+        erro = np.where(observado, y - previsto, 0.0)
+        soma_quadrados += erro ** 2
+        observacoes += observado
+
+        y_obs = np.where(observado, y, previsto)
+        novo_nivel = alfa * (y_obs - s) + (1 - alfa) * (nivel + tendencia)
+        tendencia = beta * (novo_nivel - nivel) + (1 - beta) * tendencia
+        sazonal[:, :, dia_semana] = np.where(observado, gama * (y_obs - novo_nivel) + (1 - gama) * s, s)
+        nivel = novo_nivel
+
+    return nivel, tendencia, sazonal, soma_quadrados, observacoes
+
+
+def ajustar_modelos_previsao(quadro_ids):
+    """Ajusta em lote o modelo de todos os quadros informados e grava o estado (não faz commit)"""
+    import numpy as np
+    ontem = datetime.now().date() - timedelta(days=1)
+    inicio = ontem - timedelta(days=JANELA_PREVISAO_DIAS - 1)
+    quadro_ids = list(quadro_ids)
+
+    existentes = {
+        m.quadro_id: m
+        for m in ModeloPrevisao.query.filter(ModeloPrevisao.quadro_id.in_(quadro_ids)).all()
+    }
+
+    # Descarta quadros com poucos dias e corta o início vazio comum da série
+    series = montar_series_diarias(quadro_ids, inicio, ontem)
+    validos = np.sum(~np.isnan(series), axis=1) >= MIN_DIAS_PREVISAO
+
+    for quadro_id, valido in zip(quadro_ids, validos):
+        if not valido and quadro_id in existentes:
+            db.session.delete(existentes.pop(quadro_id))
+
+    if not validos.any():
+        return
+    series = series[validos]
+    quadro_ids = [q for q, valido in zip(quadro_ids, validos) if valido]
+
+    primeiro = int(np.argmax((~np.isnan(series)).any(axis=0)))
+    series = series[:, primeiro:]
+    inicio = inicio + timedelta(days=primeiro)
+    dias_semana = [(inicio + timedelta(days=t)).weekday() for t in range(series.shape[1])]
+
+    # Estado inicial: média das 4 primeiras semanas e perfil médio por dia da semana
+    periodo_inicial = series[:, :28]
+    with np.errstate(all='ignore'):
+        nivel_inicial = np.nan_to_num(np.nanmean(periodo_inicial, axis=1))
+        sazonal_inicial = np.zeros((len(quadro_ids), 7))
+        for t, dia_semana in enumerate(dias_semana[:28]):
+            sazonal_inicial[:, dia_semana] = np.nan_to_num(periodo_inicial[:, t] - nivel_inicial)
+
+    # Todas as combinações de parâmetros rodam juntas no eixo 0
+    grade = np.array([(a, b, g) for a in GRADE_ALFA for b in GRADE_BETA for g in GRADE_GAMA])
+    alfa, beta, gama = (grade[:, i][:, None] for i in range(3))
+    combinacoes = len(grade)
+
+    nivel, tendencia, sazonal, soma_quadrados, observacoes = executar_holt_winters(
+        series, dias_semana,
+        np.repeat(nivel_inicial[None, :], combinacoes, axis=0),
+        np.zeros((combinacoes, len(quadro_ids))),
+        np.repeat(sazonal_inicial[None, :, :], combinacoes, axis=0),
+        alfa, beta, gama
+    )
+
+    melhor = np.argmin(soma_quadrados, axis=0)
+    agora = datetime.now()
+
+    for i, quadro_id in enumerate(quadro_ids):
+        k = melhor[i]
+        modelo = existentes.get(quadro_id)
+        if not modelo:
+            modelo = ModeloPrevisao(quadro_id=quadro_id)
+            db.session.add(modelo)
+
+        modelo.nivel = float(nivel[k, i])
+        modelo.tendencia = float(tendencia[k, i])
+        modelo.sazonalidade = json.dumps([round(float(v), 6) for v in sazonal[k, i]])
+        modelo.alfa = float(grade[k, 0])
+        modelo.beta = float(grade[k, 1])
+        modelo.gama = float(grade[k, 2])
+        modelo.desvio_residual = float(np.sqrt(soma_quadrados[k, i] / max(observacoes[k, i], 1)))
+        modelo.ultima_data = ontem
+        modelo.ajustado_em = agora
+
+
+def avancar_modelos_previsao(modelos, ate):
+    """Avança incrementalmente o estado dos modelos com os dias novos, sem reajustar parâmetros"""
+    import numpy as np
+    por_data = {}
+    for modelo in modelos:
+        por_data.setdefault(modelo.ultima_data, []).append(modelo)
+
+    for ultima_data, grupo in por_data.items():
+        inicio = ultima_data + timedelta(days=1)
+        series = montar_series_diarias([m.quadro_id for m in grupo], inicio, ate)
+        dias_semana = [(inicio + timedelta(days=t)).weekday() for t in range(series.shape[1])]
+
+        nivel, tendencia, sazonal, _, _ = executar_holt_winters(
+            series, dias_semana,
+            np.array([[m.nivel for m in grupo]]),
+            np.array([[m.tendencia for m in grupo]]),
+            np.array([[json.loads(m.sazonalidade) for m in grupo]]),
+            np.array([[m.alfa for m in grupo]]),
+            np.array([[m.beta for m in grupo]]),
+            np.array([[m.gama for m in grupo]])
+        )
+
+        for i, modelo in enumerate(grupo):
+            modelo.nivel = float(nivel[0, i])
+            modelo.tendencia = float(tendencia[0, i])
+            modelo.sazonalidade = json.dumps([round(float(v), 6) for v in sazonal[0, i]])
+            modelo.ultima_data = ate
+
+
+def marcar_previsoes_pendentes(alteracoes):
+    """Marca os quadros alterados para reajuste da previsão, guardando o primeiro dia alterado (não faz commit)"""
+    primeira_alteracao = {}
+    for quadro_id, dia in alteracoes:
+        primeira_alteracao[quadro_id] = min(dia, primeira_alteracao.get(quadro_id, dia))
+    if not primeira_alteracao:
+        return
+
+    # Um único INSERT ... ON CONFLICT para todos os quadros, sem consultar as marcas existentes
+    agora = datetime.now()
+    comando = insert_sqlite(PrevisaoPendente.__table__)
+    comando = comando.on_conflict_do_update(
+        index_elements=['quadro_id'],
+        set_={'desde': func.min(PrevisaoPendente.__table__.c.desde, comando.excluded.desde),
+              'marcado_em': comando.excluded.marcado_em}
+    )
+    db.session.execute(comando, [
+        {'quadro_id': quadro_id, 'desde': dia, 'marcado_em': agora}
+        for quadro_id, dia in primeira_alteracao.items()
+    ])
+
+
+def processar_previsoes_pendentes():
+    """Reajusta os modelos dos quadros marcados e avança os demais até ontem"""
+    pendentes = PrevisaoPendente.query.all()
+    atualizar_previsoes([(p.quadro_id, p.desde) for p in pendentes])
+
+    # Só remove a marca se o quadro não foi alterado novamente durante o ajuste
+    por_marcacao = {}
+    for pendente in pendentes:
+        por_marcacao.setdefault(pendente.marcado_em, []).append(pendente.quadro_id)
+    for marcado_em, quadro_ids in por_marcacao.items():
+        PrevisaoPendente.query.filter(
+            PrevisaoPendente.quadro_id.in_(quadro_ids),
+            PrevisaoPendente.marcado_em <= marcado_em
+        ).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def garantir_previsoes_atualizadas():
+    """Sem o agendador rodando (ex.: outro servidor WSGI), reajusta os quadros pendentes na hora"""
+    if agendador_relatorios.ativo:
+        atualizar_previsoes()  # Só avança os modelos se o dia virou; reajustes ficam com o agendador
+    else:
+        processar_previsoes_pendentes()
+
+
+def atualizar_previsoes(alteracoes=()):
+    """Mantém os modelos em dia: reajusta quadros com dados passados alterados e avança os demais"""
+    ontem = datetime.now().date() - timedelta(days=1)
+    modelos = {m.quadro_id: m for m in ModeloPrevisao.query.all()}
+
+    primeira_alteracao = {}
+    for quadro_id, dia in alteracoes:
+        primeira_alteracao[quadro_id] = min(dia, primeira_alteracao.get(quadro_id, dia))
+
+    # Quadros ativos sem modelo ou com dias já incorporados que mudaram: reajuste completo
+    reajustar = {
+        quadro_id for quadro_id, dia in primeira_alteracao.items()
+        if quadro_id not in modelos or dia <= modelos[quadro_id].ultima_data
+    }
+    if not modelos:
+        reajustar |= {q.id for q in Quadro.query.filter_by(ativo=True).all()}
+
+    avancar = []
+    for quadro_id, modelo in modelos.items():
+        if quadro_id in reajustar or modelo.ultima_data >= ontem:
+            continue
+        if (ontem - modelo.ultima_data).days > MAX_DIAS_AVANCO_INCREMENTAL:
+            reajustar.add(quadro_id)
+        else:
+            avancar.append(modelo)
+
+    if not reajustar and not avancar:
+        return
+
+    if avancar:
+        avancar_modelos_previsao(avancar, ontem)
+    if reajustar:
+        ajustar_modelos_previsao(reajustar)
+
+    db.session.commit()
+
+
+def prever_consumo(modelo, dias):
+    """Gera a previsão diária a partir do estado salvo do modelo"""
+    import numpy as np
+    sazonal = json.loads(modelo.sazonalidade)
+    previsoes = []
+
+    for h in range(1, dias + 1):
+        data = modelo.ultima_data + timedelta(days=h)
+        valor = max(modelo.nivel + h * modelo.tendencia + sazonal[data.weekday()], 0)
+        margem = 1.96 * modelo.desvio_residual * np.sqrt(1 + (h - 1) * modelo.alfa ** 2)
+        previsoes.append({
+            'data': data,
+            'previsto': valor,
+            'inferior': max(valor - margem, 0),
+            'superior': valor + margem
+        })
+
+    return previsoes
+
+
+@app.route('/api/previsao', methods=['GET'])
+def api_previsao():
+    """Retorna a previsão de consumo dos próximos dias por quadro e da planta"""
+    try:
+        dias = min(request.args.get('dias', 30, type=int), 90)
+        quadro_id = request.args.get('quadro_id', type=int)
+
+        # Avança os modelos se o dia virou desde o último ajuste
+        garantir_previsoes_atualizadas()
+
+        query = ModeloPrevisao.query.join(Quadro, Quadro.id == ModeloPrevisao.quadro_id)\
+            .filter(Quadro.ativo == True)
+        if quadro_id:
+            query = query.filter(ModeloPrevisao.quadro_id == quadro_id)
+
+        hoje = datetime.now().date()
+        resultado = []
+        total_planta = {}
+
+        for modelo in query.all():
+            previsoes = [p for p in prever_consumo(modelo, dias + 1) if p['data'] >= hoje][:dias]
+
+            # A planta soma apenas medidores principais (submedidores já estão nos pais)
+            if modelo.quadro.quadro_pai_id is None:
+                for p in previsoes:
+                    total_planta[p['data']] = total_planta.get(p['data'], 0) + p['previsto']
+
+            resultado.append({
+                'quadro_id': modelo.quadro_id,
+                'quadro_nome': modelo.quadro.nome,
+                'ajustado_em': modelo.ajustado_em.strftime('%d/%m/%Y %H:%M:%S'),
+                'parametros': {'alfa': modelo.alfa, 'beta': modelo.beta, 'gama': modelo.gama},
+                'total_previsto': round(sum(p['previsto'] for p in previsoes), 2),
+                'previsao': [
+                    {
+                        'data': p['data'].strftime('%d/%m/%Y'),
+                        'previsto': round(p['previsto'], 2),
+                        'inferior': round(p['inferior'], 2),
+                        'superior': round(p['superior'], 2)
+                    }
+                    for p in previsoes
+                ]
+            })
+
+        datas = sorted(total_planta)
+        return jsonify({
+            'sucesso': True,
+            'quadros': resultado,
+            'planta': {
+                'labels': [d.strftime('%d/%m/%Y') for d in datas],
+                'valores': [round(total_planta[d], 2) for d in datas],
+                'total_previsto': round(sum(total_planta.values()), 2)
+            }
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro ao calcular previsão: {str(e)}'
+        }), 500
+
+
+# ========================================
+# ROTAS DE ANÁLISE E RELATÓRIOS
+# ========================================
+
+@app.route('/analise')
+def analise():
+    """Página de análise e inteligência de dados"""
+    quadros = Quadro.query.filter_by(ativo=True).order_by(Quadro.nome).all()
+    
+    # Variáveis para a sidebar
+    ip_local, url_mobile, qrcode_img = obter_qrcode_mobile()
+    total_rascunhos = LeituraRascunho.query.count()
+    
+    return render_template('analise.html', 
+                         quadros=quadros,
+                         qrcode_img=qrcode_img,
+                         ip_local=ip_local,
+                         total_rascunhos=total_rascunhos)
+
+
+@app.route('/api/analise/dados', methods=['GET'])
+@orcamento_consultas(8)
+def api_analise_dados():
+    """Retorna dados de leituras filtrados para análise"""
+    try:
+        # Recebe parâmetros do filtro
+        data_inicio = request.args.get('data_inicio')
+        data_fim = request.args.get('data_fim')
+        quadro_id = request.args.get('quadro_id', type=int)
+        distribuir = request.args.get('distribuir') == '1'
+        
+        # Monta a query com os filtros (data final inclui o dia inteiro)
+        inicio = datetime.strptime(data_inicio, '%Y-%m-%d').date() if data_inicio else None
+        fim = datetime.strptime(data_fim, '%Y-%m-%d').date() if data_fim else None
+        query = filtrar_leituras(inicio, fim, quadro_id)
+        
+        # Custo dos meses do período pelas tarifas (já calculado por quadro e mês)
+        garantir_custos_atualizados()
+        custos = obter_custos(meses_do_periodo(inicio, fim or datetime.now().date()) if inicio else None, quadro_id)
+        
+        if pedido_compacto():
+            resposta = dict(montar_analise_colunar(query), custos=custos)
+            if distribuir:
+                # Gráfico com o consumo dos dias sem leitura espalhado pela lacuna
+                resposta['grafico'] = montar_grafico_distribuido(inicio, fim, quadro_id)
+                faltantes = set(resposta['grafico']['quadros']) - set(resposta['quadros'])
+                if faltantes:
+                    resposta['quadros'].update({
+                        referencia_id: {'nome': nome, 'localizacao': localizacao}
+                        for referencia_id, nome, localizacao in db.session.query(Quadro.id, Quadro.nome, Quadro.localizacao)
+                            .filter(Quadro.id.in_(faltantes)).all()
+                    })
+            return jsonify(resposta), 200
+        
+        # Ordena por data
+        leituras = query.options(joinedload(Leitura.quadro)).order_by(Leitura.data_registro.asc()).all()
+        
+        # Prepara dados para a tabela
+        tabela_dados = []
+        for leitura in leituras:
+            tabela_dados.append({
+                'id': leitura.id,
+                'quadro_id': leitura.quadro_id,
+                'quadro_nome': leitura.quadro.nome,
+                'quadro_localizacao': leitura.quadro.localizacao,
+                'data_registro': leitura.data_registro.strftime('%d/%m/%Y'),
+                'hora_registro': leitura.data_registro.strftime('%H:%M:%S'),
+                'valor_leitura': round(leitura.valor_leitura, 2),
+                'consumo_dia': round(leitura.consumo_dia, 2) if leitura.consumo_dia else 0,
+                'alerta_reset': leitura.alerta_reset
+            })
+        
+        # Prepara dados para o gráfico
+        # Organiza por data e quadro
+        dados_grafico = {}
+        quadros_dict = {}
+        
+        for leitura in leituras:
+            data_str = leitura.data_registro.strftime('%Y-%m-%d')
+            quadro_nome = leitura.quadro.nome
             
-            # Usa a data de referência da sessão ativa
-            data_registro = datetime.combine(sessao_ativa.data_referencia, datetime.now().time())
+            if data_str not in dados_grafico:
+                dados_grafico[data_str] = {}
             
-            if rascunho_existente:
-                # Atualiza o rascunho existente
-                rascunho_existente.valor_leitura = novo_valor
-                rascunho_existente.consumo_provisorio = consumo_provisorio
-                rascunho_existente.alerta_reset = alerta_reset
-                rascunho_existente.data_registro = data_registro
-            else:
-                # Cria novo rascunho
-                rascunho_existente = LeituraRascunho(
-                    quadro_id=quadro_id,
-                    valor_leitura=novo_valor,
-                    consumo_provisorio=consumo_provisorio,
-                    alerta_reset=alerta_reset,
-                    data_registro=data_registro
-                )
-                db.session.add(rascunho_existente)
+            if quadro_nome not in dados_grafico[data_str]:
+                dados_grafico[data_str][quadro_nome] = 0
             
-            db.session.commit()
+            # Soma o consumo do dia
+            if leitura.consumo_dia:
+                dados_grafico[data_str][quadro_nome] += leitura.consumo_dia
             
-            return jsonify({
-                'sucesso': True,
-                'mensagem': f'Leitura registrada no RASCUNHO!',
-                'leitura': rascunho_existente.to_dict(),
-                'tipo': 'rascunho'
-            }), 201
+            # Guarda informações do quadro
+            if quadro_nome not in quadros_dict:
+                quadros_dict[quadro_nome] = {
+                    'id': leitura.quadro_id,
+                    'nome': quadro_nome
+                }
+        
+        if distribuir:
+            # Gráfico com o consumo dos dias sem leitura espalhado pela lacuna
+            grafico = montar_grafico_distribuido(inicio, fim, quadro_id)
+            nomes = dict(db.session.query(Quadro.id, Quadro.nome).filter(Quadro.id.in_(grafico['quadros'])).all()) \
+                if grafico['quadros'] else {}
+            dados_grafico = {}
+            quadros_dict = {}
+            for referencia_id, serie in zip(grafico['quadros'], grafico['series']):
+                quadro_nome = nomes.get(referencia_id, f'Quadro {referencia_id}')
+                quadros_dict[quadro_nome] = {'id': referencia_id, 'nome': quadro_nome}
+                for dia, valor in zip(grafico['dias'], serie):
+                    data_str = datetime.fromordinal(dia + ORDINAL_EPOCA).strftime('%Y-%m-%d')
+                    dados_grafico.setdefault(data_str, {})[quadro_nome] = valor
+        
+        # Formata dados para Chart.js
+        datas_ordenadas = sorted(dados_grafico.keys())
+        
+        # Dados separados por quadro
+        datasets_separados = []
+        cores = [
+            '#667eea', '#764ba2', '#f093fb', '#4facfe',
+            '#43e97b', '#fa709a', '#fee140', '#30cfd0',
+            '#a8edea', '#fed6e3', '#c471f5', '#12c2e9'
+        ]
+        
+        for idx, (quadro_nome, quadro_info) in enumerate(quadros_dict.items()):
+            dados_quadro = []
+            for data in datas_ordenadas:
+                valor = dados_grafico[data].get(quadro_nome, 0)
+                dados_quadro.append(round(valor, 2))
             
-        except ValueError:
-            return jsonify({
-                'sucesso': False,
-                'erro': 'Valor inválido. Certifique-se de inserir um número válido.'
-            }), 400
-        except Exception as e:
-            db.session.rollback()
-            return jsonify({
-                'sucesso': False,
-                'erro': f'Erro ao processar leitura: {str(e)}'
-            }), 500
+            datasets_separados.append({
+                'label': quadro_nome,
+                'data': dados_quadro,
+                'borderColor': cores[idx % len(cores)],
+                'backgroundColor': cores[idx % len(cores)] + '20',
+                'tension': 0.4,
+                'fill': False
+            })
+        
+        # Dados agrupados (soma total por dia)
+        dados_agrupados = []
+        for data in datas_ordenadas:
+            total_dia = sum(dados_grafico[data].values())
+            dados_agrupados.append(round(total_dia, 2))
+        
+        dataset_agrupado = [{
+            'label': 'Consumo Total da Empresa',
+            'data': dados_agrupados,
+            'borderColor': '#667eea',
+            'backgroundColor': 'rgba(102, 126, 234, 0.1)',
+            'tension': 0.4,
+            'fill': True,
+            'borderWidth': 3
+        }]
+        
+        # Formata labels das datas
+        labels = [datetime.strptime(d, '%Y-%m-%d').strftime('%d/%m/%Y') for d in datas_ordenadas]
+        
+        return jsonify({
+            'sucesso': True,
+            'tabela': tabela_dados,
+            'grafico': {
+                'labels': labels,
+                'datasets_separados': datasets_separados,
+                'dataset_agrupado': dataset_agrupado
+            },
+            'custos': custos,
+            'total_registros': len(tabela_dados)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({
+            'sucesso': False, 
+            'erro': str(e)
+        }), 500
+
+
+def montar_analise_colunar(query):
+    """Versão colunar de /api/analise/dados: tabela em colunas e séries do gráfico por quadro"""
+    linhas = query.with_entities(
+        Leitura.id, Leitura.quadro_id, Leitura.data_registro,
+        Leitura.valor_leitura, Leitura.consumo_dia, Leitura.alerta_reset
+    ).order_by(Leitura.data_registro.asc()).all()
+
+    quadros, colunas = serializar_leituras_colunar(linhas)
+
+    # Soma do consumo por (dia, quadro) para o gráfico
+    dias = sorted(set(colunas['dia']))
+    posicao_dia = {dia: i for i, dia in enumerate(dias)}
+    series = {}
+    for (_, quadro_id, _, _, consumo, _), dia in zip(linhas, colunas['dia']):
+        serie = series.setdefault(quadro_id, [0.0] * len(dias))
+        serie[posicao_dia[dia]] += consumo or 0
+
+    ordem_quadros = list(series)
+    total = [round(sum(series[q][i] for q in ordem_quadros), 2) for i in range(len(dias))]
+
+    return {
+        'sucesso': True,
+        'formato': 'colunar',
+        'quadros': quadros,
+        'tabela': colunas,
+        'grafico': {
+            'dias': dias,
+            'quadros': ordem_quadros,
+            'series': [[round(v, 2) for v in series[q]] for q in ordem_quadros],
+            'total': total
+        },
+        'total_registros': len(colunas['id'])
+    }
+
+
+# ROTAS DE IMPORTAÇÃO
+# ========================================
+
+@app.route('/admin/importacao')
+def importacao():
+    """Página de importação de dados históricos"""
+    # Variáveis para a sidebar
+    ip_local, url_mobile, qrcode_img = obter_qrcode_mobile()
+    total_rascunhos = LeituraRascunho.query.count()
+    
+    return render_template('importar.html',
+                         qrcode_img=qrcode_img,
+                         ip_local=ip_local,
+                         total_rascunhos=total_rascunhos)
 
 
-@app.route('/confirmar_reset', methods=['POST'])
-def confirmar_reset():
-    """Confirma e salva leitura em RASCUNHO quando o usuário confirma que o medidor virou"""
-    try:
-        quadro_id = request.form.get('quadro_id', type=int)
-        novo_valor = request.form.get('novo_valor', type=float)
+@app.route('/admin/importacao/modelo')
+def download_modelo():
+    """Gera e retorna modelo de planilha Excel para importação"""
+    import pandas as pd
+    # Cria um DataFrame de exemplo
+    df = pd.DataFrame({
+        'Data': ['01/01/2024', '02/01/2024', '03/01/2024'],
+        'Quadro': ['Galpão A', 'Galpão A', 'Escritório'],
+        'Localizacao': ['Área de Produção', 'Área de Produção', 'Prédio Administrativo'],
+        'Leitura': [1000.50, 1025.75, 500.00]
+    })
+    
+    # Cria buffer em memória
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name='Leituras')
         
-        if not quadro_id or novo_valor is None:
+        # Adiciona instruções em outra aba
+        instrucoes = pd.DataFrame({
+            'Instruções para Importação': [
+                '1. A coluna "Data" deve estar no formato DD/MM/AAAA ou DD/MM/AAAA HH:MM:SS',
+                '2. A coluna "Quadro" é o nome do quadro (será criado automaticamente se não existir)',
+                '3. A coluna "Localizacao" é a localização do quadro (obrigatória para novos quadros)',
+                '4. A coluna "Leitura" é o valor da leitura do medidor em kWh',
+                '5. O sistema calculará automaticamente o consumo com base na diferença entre leituras',
+                '6. Registros duplicados (mesmo quadro e mesma data) serão ignorados',
+                '7. Se um valor de leitura for menor que o anterior, será marcado como "Reset"',
+                '8. Mantenha os dados ordenados por data para melhor precisão'
+            ]
+        })
+        instrucoes.to_excel(writer, index=False, sheet_name='Instruções')
+    
+    output.seek(0)
+    
+    return send_file(
+        output,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name='modelo_importacao_leituras.xlsx'
+    )
+
+
+COLUNAS_IMPORTACAO = ['Data', 'Quadro', 'Localizacao', 'Leitura']  # Colunas obrigatórias da planilha
+
+
+def calcular_hash_arquivo(arquivo, tamanho_bloco=1024 * 1024):
+    """sha256 e tamanho do conteúdo, lido em blocos; o arquivo volta para o início"""
+    resumo = hashlib.sha256()
+    total = 0
+    arquivo.seek(0)
+    for bloco in iter(lambda: arquivo.read(tamanho_bloco), b''):
+        resumo.update(bloco)
+        total += len(bloco)
+    arquivo.seek(0)
+    return resumo.hexdigest(), total
+
+
+def verificar_reenvio_importacao(hash_conteudo):
+    """Importação anterior do mesmo conteúdo (contando o reenvio) ou None; não faz commit"""
+    anterior = ImportacaoArquivo.query.get(hash_conteudo)
+    if anterior:
+        anterior.reenvios += 1
+        anterior.ultimo_reenvio_em = datetime.now()
+    return anterior
+
+
+def resposta_reenvio_importacao(anterior):
+    """Resultado devolvido quando o arquivo já foi importado: o que a importação anterior fez"""
+    return {
+        'sucesso': True,
+        'reenvio': True,
+        'mensagem': f'Este arquivo já foi importado em {anterior.importado_em.strftime("%d/%m/%Y %H:%M")} '
+                    f'({anterior.nome_arquivo})'
+                    + (f' e importado de novo {anterior.reimportacoes} vez(es)' if anterior.reimportacoes else '')
+                    + '; nada foi reimportado.',
+        'importacao_anterior': anterior.to_dict(),
+        'detalhes': json.loads(anterior.detalhes)
+    }
+
+
+def registrar_importacao_arquivo(hash_conteudo, nome_arquivo, tamanho, detalhes, origem):
+    """Grava no histórico o resultado de um arquivo importado com sucesso (e com o consumo recalculado)
+
+    Numa reimportação forçada o registro original (data e resultado da primeira
+    importação) é mantido; só os contadores mudam.
+    """
+    anterior = ImportacaoArquivo.query.get(hash_conteudo)
+    if anterior:
+        anterior.reimportacoes += 1
+        anterior.ultimo_reenvio_em = datetime.now()
+    else:
+        db.session.add(ImportacaoArquivo(
+            hash_conteudo=hash_conteudo,
+            nome_arquivo=nome_arquivo,
+            bytes=tamanho,
+            origem=origem,
+            importado_em=datetime.now(),
+            detalhes=json.dumps(detalhes, ensure_ascii=False)
+        ))
+    db.session.commit()
+
+
+@app.route('/admin/importacao/processar', methods=['POST'])
+def processar_importacao():
+    """Processa arquivo Excel de importação de dados históricos"""
+    import pandas as pd
+    try:
+        # Verifica se arquivo foi enviado
+        if 'arquivo' not in request.files:
             return jsonify({
                 'sucesso': False,
-                'erro': 'Dados incompletos.'
+                'erro': 'Nenhum arquivo foi enviado.'
             }), 400
         
-        # Verifica se o quadro existe
-        quadro = Quadro.query.get(quadro_id)
-        if not quadro:
+        arquivo = request.files['arquivo']
+        
+        if arquivo.filename == '':
             return jsonify({
                 'sucesso': False,
-                'erro': 'Quadro não encontrado.'
-            }), 404
+                'erro': 'Nenhum arquivo selecionado.'
+            }), 400
         
-        # Busca sessão ativa para obter data de referência
-        sessao_ativa = SessaoLeitura.query.filter_by(ativa=True).first()
-        data_registro = datetime.combine(sessao_ativa.data_referencia, datetime.now().time()) if sessao_ativa else datetime.now()
+        if not arquivo.filename.endswith(('.xlsx', '.xls')):
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Formato inválido. Use arquivos .xlsx ou .xls'
+            }), 400
         
-        # Verifica se já existe um rascunho para este quadro
-        rascunho_existente = LeituraRascunho.query.filter_by(quadro_id=quadro_id).first()
+        # O arquivo já está no buffer do upload (memória ou arquivo temporário): nada é gravado em uploads/
+        filename = secure_filename(arquivo.filename)
+        hash_conteudo, tamanho = calcular_hash_arquivo(arquivo.stream)
         
-        if rascunho_existente:
-            # Atualiza o rascunho existente
-            rascunho_existente.valor_leitura = novo_valor
-            rascunho_existente.consumo_provisorio = novo_valor  # Considera o novo valor como consumo total
-            rascunho_existente.alerta_reset = True
-            rascunho_existente.data_registro = data_registro
-        else:
-            # Cria novo rascunho com alerta de reset
-            rascunho_existente = LeituraRascunho(
-                quadro_id=quadro_id,
-                valor_leitura=novo_valor,
-                consumo_provisorio=novo_valor,  # Considera o novo valor como consumo total
-                alerta_reset=True,  # Marca que houve reset/virada do medidor
-                data_registro=data_registro
-            )
-            db.session.add(rascunho_existente)
+        # Mesmo conteúdo já importado: devolve o resultado anterior sem ler a planilha
+        # (?forcar=1 importa de novo, ex.: depois de apagar leituras)
+        if request.values.get('forcar') != '1':
+            anterior = verificar_reenvio_importacao(hash_conteudo)
+            if anterior:
+                db.session.commit()
+                return jsonify(resposta_reenvio_importacao(anterior)), 200
         
-        db.session.commit()
+        # Lê o arquivo Excel
+        try:
+            df = pd.read_excel(arquivo.stream, sheet_name=0)
+        except Exception as e:
+            return jsonify({
+                'sucesso': False,
+                'erro': f'Erro ao ler arquivo Excel: {str(e)}'
+            }), 400
         
-        return jsonify({
-            'sucesso': True,
-            'mensagem': f'Leitura com RESET registrada no RASCUNHO!',
-            'leitura': rascunho_existente.to_dict(),
-            'tipo': 'rascunho'
-        }), 201
+        # Valida colunas obrigatórias
+        colunas_faltantes = [col for col in COLUNAS_IMPORTACAO if col not in df.columns]
         
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({
-            'sucesso': False,
-            'erro': f'Erro ao confirmar reset: {str(e)}'
-        }), 500
-
-
-@app.route('/iniciar_contagem', methods=['POST'])
-def iniciar_contagem():
-    """Limpa a tabela de rascunhos para iniciar uma nova contagem do dia"""
-    try:
-        # Conta quantos rascunhos existem
-        total_rascunhos = LeituraRascunho.query.count()
+        if colunas_faltantes:
+            return jsonify({
+                'sucesso': False,
+                'erro': f'Colunas obrigatórias faltando: {", ".join(colunas_faltantes)}'
+            }), 400
         
-        # Limpa todos os rascunhos
-        LeituraRascunho.query.delete()
-        db.session.commit()
+        # Processa importação
+        resultado = processar_dados_importacao(df)
         
-        return jsonify({
-            'sucesso': True,
-            'mensagem': f'Nova contagem iniciada! {total_rascunhos} rascunho(s) removido(s).'
-        }), 200
+        if resultado['sucesso']:
+            registrar_importacao_arquivo(hash_conteudo, filename, tamanho, resultado['detalhes'], 'web')
+            return jsonify(resultado), 200
+        else:
+            return jsonify(resultado), 400
         
     except Exception as e:
-        db.session.rollback()
         return jsonify({
             'sucesso': False,
-            'erro': f'Erro ao iniciar contagem: {str(e)}'
+            'erro': f'Erro ao processar importação: {str(e)}'
         }), 500
 
 
-@app.route('/revisao')
-def revisao():
-    """Tela de revisão e validação dos rascunhos antes da consolidação final"""
-    # Busca todos os rascunhos
-    rascunhos = LeituraRascunho.query.all()
-    
-    # Prepara dados com análise de desvios
-    dados_revisao = []
-    
-    for rascunho in rascunhos:
-        # Calcula média de consumo dos últimos 90 dias deste quadro
-        noventa_dias_atras = datetime.now() - timedelta(days=90)
-        
-        media_90_dias = db.session.query(func.avg(Leitura.consumo_dia))\
-            .filter(Leitura.quadro_id == rascunho.quadro_id)\
-            .filter(Leitura.data_registro >= noventa_dias_atras)\
-            .filter(Leitura.consumo_dia.isnot(None))\
-            .scalar()
-        
-        media_90_dias = media_90_dias if media_90_dias else 0
-        
-        # Busca o último valor registrado oficialmente
-        ultima_leitura_oficial = Leitura.query.filter_by(quadro_id=rascunho.quadro_id)\
-            .order_by(Leitura.data_registro.desc()).first()
-        
-        ultimo_valor_oficial = ultima_leitura_oficial.valor_leitura if ultima_leitura_oficial else 0
-        ultima_data_oficial = ultima_leitura_oficial.data_registro.strftime('%d/%m/%Y %H:%M') if ultima_leitura_oficial else 'Nunca'
-        
-        # Calcula desvio percentual
-        desvio_percentual = 0
-        status_desvio = 'normal'
-        
-        if media_90_dias > 0 and rascunho.consumo_provisorio:
-            desvio_percentual = ((rascunho.consumo_provisorio - media_90_dias) / media_90_dias) * 100
-            
-            if abs(desvio_percentual) > 50:
-                status_desvio = 'critico'  # Vermelho
-            elif abs(desvio_percentual) > 30:
-                status_desvio = 'alerta'   # Amarelo
-        
-        dados_revisao.append({
-            'id': rascunho.id,
-            'quadro_id': rascunho.quadro_id,
-            'quadro_nome': rascunho.quadro.nome,
-            'quadro_localizacao': rascunho.quadro.localizacao,
-            'valor_leitura': rascunho.valor_leitura,
-            'consumo_provisorio': rascunho.consumo_provisorio,
-            'alerta_reset': rascunho.alerta_reset,
-            'media_90_dias': round(media_90_dias, 2),
-            'desvio_percentual': round(desvio_percentual, 1),
-            'status_desvio': status_desvio,
-            'ultimo_valor_oficial': round(ultimo_valor_oficial, 2),
-            'ultima_data_oficial': ultima_data_oficial
-        })    
-    
-    # Variáveis para a sidebar
-    ip_local = obter_ip_local()
-    url_mobile = f"http://{ip_local}:5000/registrar"
-    qrcode_img = gerar_qrcode(url_mobile)
-    total_rascunhos = len(dados_revisao)
-    
-    return render_template('revisao.html', 
-                         dados_revisao=dados_revisao,
-                         qrcode_img=qrcode_img,
-                         ip_local=ip_local,
-                         total_rascunhos=total_rascunhos)
-
+def processar_dados_importacao(df, recalcular=True):
+    """Processa o DataFrame e importa os dados para o banco
 
-@app.route('/revisao/editar/<int:id>', methods=['POST'])
-def editar_rascunho(id):
-    """Edita um rascunho específico"""
+    Com recalcular=False (importação em lotes) o consumo não é recalculado aqui: o resultado
+    traz 'quadro_ids' e 'alteracoes' para o chamador recalcular uma vez no final.
+    """
+    import pandas as pd
+    registros_inseridos = 0
+    registros_duplicados = 0
+    quadros_criados = []
+    erros = []
+    
     try:
-        rascunho = LeituraRascunho.query.get(id)
+        # Remove linhas com dados vazios
+        df = df.dropna(subset=['Data', 'Quadro', 'Leitura'])
         
-        if not rascunho:
-            return jsonify({
-                'sucesso': False,
-                'erro': 'Rascunho não encontrado.'
-            }), 404
+        # Agrupa por quadro para processar separadamente
+        quadros_processados = {}
+        alteracoes = []
+        
+        for index, row in df.iterrows():
+            try:
+                # Converte data
+                if isinstance(row['Data'], str):
+                    # Tenta vários formatos de data
+                    for fmt in ['%d/%m/%Y', '%d/%m/%Y %H:%M:%S', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S']:
+                        try:
+                            data_leitura = datetime.strptime(row['Data'], fmt)
+                            break
+                        except ValueError:
+                            continue
+                    else:
+                        raise ValueError(f"Formato de data inválido: {row['Data']}")
+                else:
+                    data_leitura = pd.to_datetime(row['Data'])
+                
+                nome_quadro = str(row['Quadro']).strip()
+                localizacao = str(row['Localizacao']).strip()
+                valor_leitura = float(row['Leitura'])
+                
+                # Busca ou cria o quadro
+                quadro = Quadro.query.filter_by(nome=nome_quadro).first()
+                
+                if not quadro:
+                    quadro = Quadro(
+                        nome=nome_quadro,
+                        localizacao=localizacao,
+                        ativo=True,
+                        area_id=obter_ou_criar_area(localizacao).id
+                    )
+                    db.session.add(quadro)
+                    db.session.flush()  # Obtém o ID sem commitar
+                    quadros_criados.append(nome_quadro)
+                
+                # Verifica duplicata (mesma data e quadro)
+                data_inicio = data_leitura.replace(hour=0, minute=0, second=0)
+                data_fim = data_leitura.replace(hour=23, minute=59, second=59)
+                
+                existe = Leitura.query.filter(
+                    Leitura.quadro_id == quadro.id,
+                    Leitura.data_registro >= data_inicio,
+                    Leitura.data_registro <= data_fim
+                ).first()
+                
+                if existe:
+                    registros_duplicados += 1
+                    continue
+                
+                # Cria leitura temporária (consumo será calculado depois)
+                nova_leitura = Leitura(
+                    quadro_id=quadro.id,
+                    data_registro=data_leitura,
+                    valor_leitura=valor_leitura,
+                    consumo_dia=0,  # Será recalculado
+                    alerta_reset=False
+                )
+                
+                db.session.add(nova_leitura)
+                alteracoes.append((quadro.id, data_leitura))
+                registros_inseridos += 1
+                
+                # Marca quadro para recálculo
+                quadros_processados[quadro.id] = True
+                
+            except Exception as e:
+                erros.append(f"Linha {index + 2}: {str(e)}")
         
-        novo_valor = request.form.get('valor_leitura', type=float)
+        # Propaga as alterações para relatórios e agregados
+        registrar_alteracao_leituras(alteracoes)
         
-        if novo_valor is None:
-            return jsonify({
-                'sucesso': False,
-                'erro': 'Valor da leitura é obrigatório.'
-            }), 400
+        # Comita as inserções
+        db.session.commit()
         
-        # Busca última leitura oficial para recalcular consumo
-        ultima_oficial = Leitura.query.filter_by(quadro_id=rascunho.quadro_id)\
-            .order_by(Leitura.data_registro.desc()).first()
+        resultado = {
+            'sucesso': True,
+            'mensagem': 'Importação concluída com sucesso!',
+            'detalhes': {
+                'registros_inseridos': registros_inseridos,
+                'registros_duplicados': registros_duplicados,
+                'quadros_criados': quadros_criados,
+                'erros': erros
+            }
+        }
         
-        # Recalcula consumo provisório
-        if ultima_oficial:
-            if novo_valor >= ultima_oficial.valor_leitura:
-                rascunho.consumo_provisorio = novo_valor - ultima_oficial.valor_leitura
-                rascunho.alerta_reset = False
-            else:
-                # Valor menor - marca como reset
-                rascunho.consumo_provisorio = novo_valor
-                rascunho.alerta_reset = True
-        else:
-            rascunho.consumo_provisorio = 0
-            rascunho.alerta_reset = False
+        if not recalcular:
+            resultado['quadro_ids'] = list(quadros_processados)
+            resultado['alteracoes'] = alteracoes
+            return resultado
         
-        rascunho.valor_leitura = novo_valor
-        rascunho.data_registro = datetime.now()
+        # Recalcula consumo para cada quadro processado
+        for quadro_id in quadros_processados.keys():
+            recalcular_consumo_quadro(quadro_id)
         
-        db.session.commit()
+        processar_apos_alteracao(alteracoes)
         
-        return jsonify({
-            'sucesso': True,
-            'mensagem': 'Rascunho atualizado com sucesso!',
-            'rascunho': rascunho.to_dict()
-        }), 200
+        return resultado
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({
+        return {
             'sucesso': False,
-            'erro': f'Erro ao editar rascunho: {str(e)}'
-        }), 500
+            'erro': f'Erro durante importação: {str(e)}'
+        }
 
 
-@app.route('/verificar_conflitos', methods=['GET'])
-def verificar_conflitos():
-    """Verifica se há conflitos de data antes de consolidar"""
-    try:
-        rascunhos = LeituraRascunho.query.all()
-        
-        if not rascunhos:
-            return jsonify({
-                'sucesso': False,
-                'erro': 'Não há rascunhos para verificar.'
-            }), 400
-        
-        conflitos = []
+def calcular_consumo(valor, valor_anterior):
+    """Consumo e alerta de reset de uma leitura em relação à anterior do mesmo quadro"""
+    if valor_anterior is None:
+        # Primeira leitura: consumo = 0
+        return 0, False
+    if valor >= valor_anterior:
+        # Consumo normal
+        return valor - valor_anterior, False
+    # Reset detectado (medidor virou)
+    return valor, True
+
+
+def recalcular_consumo_quadro(quadro_id):
+    """Recalcula o consumo para todas as leituras de um quadro"""
+    # Busca todas as leituras do quadro ordenadas por data
+    leituras = Leitura.query.filter_by(quadro_id=quadro_id)\
+        .order_by(Leitura.data_registro.asc()).all()
+    
+    leitura_anterior = None
+    alteracoes = []
+    
+    for leitura in leituras:
+        consumo_antigo = leitura.consumo_dia
+        reset_antigo = leitura.alerta_reset
         
-        for rascunho in rascunhos:
-            # Busca leitura oficial do mesmo quadro no mesmo DIA (ignora hora)
-            data_rascunho = rascunho.data_registro.date()
-            
-            leitura_existente = Leitura.query.filter(
-                Leitura.quadro_id == rascunho.quadro_id,
-                db.func.date(Leitura.data_registro) == data_rascunho
-            ).first()
-            
-            if leitura_existente:
-                conflitos.append({
-                    'rascunho_id': rascunho.id,
-                    'quadro_nome': rascunho.quadro.nome,
-                    'quadro_localizacao': rascunho.quadro.localizacao,
-                    'rascunho_data': rascunho.data_registro.strftime('%d/%m/%Y às %H:%M'),
-                    'rascunho_valor': rascunho.valor_leitura,
-                    'existente_id': leitura_existente.id,
-                    'existente_data': leitura_existente.data_registro.strftime('%d/%m/%Y às %H:%M'),
-                    'existente_valor': leitura_existente.valor_leitura
-                })
+        leitura.consumo_dia, leitura.alerta_reset = calcular_consumo(
+            leitura.valor_leitura,
+            leitura_anterior.valor_leitura if leitura_anterior else None
+        )
         
-        return jsonify({
-            'sucesso': True,
-            'tem_conflitos': len(conflitos) > 0,
-            'conflitos': conflitos,
-            'total_rascunhos': len(rascunhos)
-        }), 200
+        if leitura.consumo_dia != consumo_antigo or leitura.alerta_reset != reset_antigo:
+            alteracoes.append((quadro_id, leitura.data_registro))
         
-    except Exception as e:
-        return jsonify({
-            'sucesso': False,
-            'erro': f'Erro ao verificar conflitos: {str(e)}'
-        }), 500
+        leitura_anterior = leitura
+    
+    # Propaga as leituras com consumo alterado para relatórios e agregados
+    registrar_alteracao_leituras(alteracoes)
+    
+    # Salva as alterações no banco de dados
+    db.session.commit()
 
 
-@app.route('/consolidar', methods=['POST'])
-def consolidar():
-    """Consolida todos os rascunhos, movendo para a tabela definitiva Leitura"""
+# ========================================
+# RECÁLCULO DA FROTA EM PARALELO
+# ========================================
+# Recalcula o consumo de todos os quadros (ex.: depois de corrigir uma importação errada).
+# Cada quadro é uma tarefa independente no pool de processos; cada processo tem a sua
+# conexão SQLite e lê/grava as leituras direto, sem o ORM. O checkpoint do quadro é gravado
+# na mesma transação das leituras: um recálculo interrompido continua de onde parou.
+# Os dados derivados (agregados, relatórios, custos) são atualizados uma vez no final.
+
+RECALCULO_LIMITE_INCREMENTAL = 5000  # Acima disso (pares quadro/dia), os agregados são refeitos por inteiro
+
+_conexao_recalculo = None
+
+
+def abrir_conexao_recalculo(banco):
+    """Inicializa um processo do pool com a sua própria conexão ao banco"""
+    global _conexao_recalculo
+    _conexao_recalculo = sqlite3.connect(banco, timeout=60, isolation_level=None)
+
+
+def recalcular_quadro_isolado(recalculo_id, quadro_id):
+    """Recalcula o consumo das leituras de um quadro e grava o checkpoint; retorna (quadro_id, leituras alteradas)"""
+    conexao = _conexao_recalculo
+    leituras = conexao.execute(
+        'SELECT id, data_registro, valor_leitura, consumo_dia, alerta_reset FROM leituras '
+        'WHERE quadro_id = ? ORDER BY data_registro', (quadro_id,)
+    ).fetchall()
+
+    atualizacoes = []
+    dias = set()
+    valor_anterior = None
+    for leitura_id, data_registro, valor, consumo_antigo, reset_antigo in leituras:
+        consumo, reset = calcular_consumo(valor, valor_anterior)
+        if consumo != consumo_antigo or reset != bool(reset_antigo):
+            atualizacoes.append((float(consumo), reset, leitura_id))
+            dias.add(data_registro[:10])
+        valor_anterior = valor
+
+    conexao.execute('BEGIN IMMEDIATE')
     try:
-        # Recebe decisões de conflitos do frontend
-        decisoes = request.json.get('decisoes', {}) if request.is_json else {}
+        conexao.executemany('UPDATE leituras SET consumo_dia = ?, alerta_reset = ? WHERE id = ?', atualizacoes)
+        conexao.execute(
+            'INSERT INTO recalculos_quadros (recalculo_id, quadro_id, leituras_alteradas, dias_alterados, concluido_em) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (recalculo_id, quadro_id, len(atualizacoes), json.dumps(sorted(dias)), datetime.now())
+        )
+        conexao.execute('COMMIT')
+    except Exception:
+        conexao.execute('ROLLBACK')
+        raise
+
+    return quadro_id, len(atualizacoes)
+
+
+def recalcular_frota(processos=None, reiniciar=False, ao_progredir=None, quadro_ids=None, recalculo_id=None):
+    """Recalcula o consumo de todos os quadros em paralelo, retomando o último recálculo não concluído
+
+    Com quadro_ids, recalcula só esses quadros em uma execução nova (ex.: os de uma importação).
+    recalculo_id usa uma execução já aberta (ex.: pela importação antes de gravar os lotes).
+    ao_progredir(concluidos, total, quadros_por_segundo) é chamado a cada quadro terminado.
+    Retorna o resumo da execução.
+    """
+    banco = caminho_banco_sqlite()
+    if not banco or not os.path.exists(banco):
+        raise RuntimeError('O recálculo em paralelo só funciona com o banco em arquivo SQLite.')
+
+    pendentes = RecalculoFrota.query.filter(RecalculoFrota.concluido_em.is_(None))
+    if recalculo_id is not None:
+        recalculo = RecalculoFrota.query.get(recalculo_id)
+    elif reiniciar:
+        ids = [recalculo.id for recalculo in pendentes]
+        if ids:
+            RecalculoQuadro.query.filter(RecalculoQuadro.recalculo_id.in_(ids)).delete(synchronize_session=False)
+            RecalculoFrota.query.filter(RecalculoFrota.id.in_(ids)).delete(synchronize_session=False)
+        recalculo = None
+    elif quadro_ids is None:
+        recalculo = pendentes.order_by(RecalculoFrota.id.desc()).first()
+    else:
+        recalculo = None
+
+    if quadro_ids is None:
+        todos = [quadro_id for (quadro_id,) in db.session.query(Quadro.id).order_by(Quadro.id)]
+    else:
+        todos = sorted(quadro_ids)
+    retomado = recalculo is not None
+    if recalculo is None:
+        recalculo = RecalculoFrota(total_quadros=len(todos))
+        db.session.add(recalculo)
+    elif recalculo_id is not None:
+        recalculo.total_quadros = len(todos)
+        retomado = RecalculoQuadro.query.filter_by(recalculo_id=recalculo.id).first() is not None
+
+    # Commit antes do pool: os processos gravam no banco e não podem esperar esta sessão
+    db.session.commit()
+
+    feitos = {quadro_id for (quadro_id,) in db.session.query(RecalculoQuadro.quadro_id)
+              .filter(RecalculoQuadro.recalculo_id == recalculo.id)}
+    restantes = [quadro_id for quadro_id in todos if quadro_id not in feitos]
+    total = len(feitos) + len(restantes)
+    processos = max(1, min(processos or app.config['RECALCULO_PROCESSOS'] or os.cpu_count() or 1, len(restantes) or 1))
+
+    inicio = time.perf_counter()
+    concluidos = 0
+    if restantes:
+        executor = ProcessPoolExecutor(max_workers=processos, initializer=abrir_conexao_recalculo, initargs=(banco,))
+        try:
+            futuros = [executor.submit(recalcular_quadro_isolado, recalculo.id, quadro_id) for quadro_id in restantes]
+            for futuro in as_completed(futuros):
+                futuro.result()
+                concluidos += 1
+                if ao_progredir:
+                    ao_progredir(len(feitos) + concluidos, total, concluidos / max(time.perf_counter() - inicio, 1e-9))
+        finally:
+            # Interrompido: quadros que ainda não começaram ficam para a retomada
+            executor.shutdown(wait=True, cancel_futures=True)
+    duracao = time.perf_counter() - inicio
+
+    # Propaga de uma vez tudo que mudou, inclusive o que execuções interrompidas gravaram
+    checkpoints = db.session.query(
+        RecalculoQuadro.quadro_id, RecalculoQuadro.leituras_alteradas, RecalculoQuadro.dias_alterados
+    ).filter(RecalculoQuadro.recalculo_id == recalculo.id).all()
+    leituras_alteradas = sum(alteradas for _, alteradas, _ in checkpoints)
+    alteracoes = {
+        (quadro_id, datetime.strptime(dia, '%Y-%m-%d').date())
+        for quadro_id, _, dias in checkpoints
+        for dia in json.loads(dias)
+    }
+
+    if len(alteracoes) > RECALCULO_LIMITE_INCREMENTAL:
+        # Dias demais alterados: refazer os agregados do zero sai mais barato que dia a dia
+        marcar_meses_alterados([dia for _, dia in alteracoes])
+        marcar_previsoes_pendentes(alteracoes)
+        reconstruir_consumo_diario()
+    else:
+        registrar_alteracao_leituras(alteracoes)
+    recalculo.leituras_alteradas = leituras_alteradas
+    recalculo.duracao_s += duracao
+    recalculo.concluido_em = datetime.now()
+    db.session.commit()
+    processar_apos_alteracao(alteracoes)
+
+    return {
+        'recalculo_id': recalculo.id,
+        'retomado': retomado,
+        'quadros': total,
+        'quadros_nesta_execucao': concluidos,
+        'processos': processos,
+        'leituras_alteradas': leituras_alteradas,
+        'dias_alterados': len(alteracoes),
+        'duracao_s': round(duracao, 2),
+        'quadros_por_segundo': round(concluidos / duracao, 1) if duracao > 0 else 0.0
+    }
+
+
+# ========================================
+# API: CONTROLE DE SESSÃO DE LEITURA
+# ========================================
+
+def ler_dados_pedido():
+    """Campos enviados como JSON ou formulário"""
+    return request.get_json(silent=True) or request.form
+
+
+def ler_sessao_id():
+    """sessao_id informado na URL, no JSON ou no formulário (None = todas as sessões ativas)"""
+    sessao_id = request.args.get('sessao_id', type=int)
+    if sessao_id is None:
+        valor = ler_dados_pedido().get('sessao_id') if request.method == 'POST' else None
+        sessao_id = int(valor) if valor not in (None, '') else None
+    return sessao_id
+
+
+def montar_escopo_sessao(area_id=None, quadro_ids=None):
+    """IDs dos quadros ativos cobertos por uma nova sessão: lista explícita, área (com subáreas) ou todos"""
+    quadros = db.session.query(Quadro.id, Quadro.area_id).filter(Quadro.ativo == True).all()
+
+    if quadro_ids:
+        quadro_ids = set(quadro_ids)
+        return sorted(quadro_id for quadro_id, _ in quadros if quadro_id in quadro_ids)
+
+    if area_id:
+        areas = dict(db.session.query(Area.id, Area.area_pai_id).all())
+        return sorted(quadro_id for quadro_id, area in quadros if area_id in cadeia_areas(area, areas))
+
+    return sorted(quadro_id for quadro_id, _ in quadros)
+
+
+def vincular_sessoes_sem_escopo():
+    """Sessões ativas de antes do escopo passam a cobrir todos os quadros e ficam com os rascunhos soltos"""
+    sem_escopo = SessaoLeitura.query.filter_by(ativa=True)\
+        .filter(~SessaoLeitura.quadros.any()).order_by(SessaoLeitura.id).all()
+    if not sem_escopo:
+        return
+
+    ocupados = {q for (q,) in db.session.query(SessaoQuadro.quadro_id)
+                .join(SessaoLeitura).filter(SessaoLeitura.ativa == True).all()}
+    for sessao in sem_escopo:
+        livres = [q for q in montar_escopo_sessao() if q not in ocupados]
+        db.session.add_all(SessaoQuadro(sessao_id=sessao.id, quadro_id=q) for q in livres)
+        ocupados.update(livres)
+
+    LeituraRascunho.query.filter(LeituraRascunho.sessao_id.is_(None))\
+        .update({'sessao_id': sem_escopo[0].id}, synchronize_session=False)
+    db.session.commit()
+
+
+@app.route('/api/sessao/iniciar', methods=['POST'])
+def api_sessao_iniciar():
+    """Inicia uma nova sessão de leitura para uma área ou lista de quadros (pode haver várias ativas)"""
+    try:
+        dados = ler_dados_pedido()
         
-        # Busca todos os rascunhos
-        rascunhos = LeituraRascunho.query.all()
+        # Recebe data de referência (data que está sendo registrada)
+        data_str = dados.get('data_referencia')
         
-        if not rascunhos:
+        if data_str:
+            try:
+                # Converte string para date
+                data_referencia = datetime.strptime(data_str, '%Y-%m-%d').date()
+            except ValueError:
+                return jsonify({
+                    'sucesso': False,
+                    'mensagem': 'Formato de data inválido. Use YYYY-MM-DD'
+                }), 400
+        else:
+            # Se não informada, usa a data de hoje
+            data_referencia = datetime.now().date()
+        
+        # Escopo: quadros informados, uma área (com subáreas) ou, sem nada, todos os quadros ativos
+        area_id = int(dados['area_id']) if dados.get('area_id') else None
+        quadro_ids = dados.get('quadro_ids') or []
+        if isinstance(quadro_ids, str):
+            quadro_ids = [q for q in quadro_ids.split(',') if q.strip()]
+        quadro_ids = [int(q) for q in quadro_ids]
+        
+        if area_id and not Area.query.get(area_id):
             return jsonify({
                 'sucesso': False,
-                'erro': 'Não há rascunhos para consolidar.'
-            }), 400
-        
-        total_consolidado = 0
-        total_substituido = 0
-        total_pulado = 0
+                'mensagem': 'Área não encontrada.'
+            }), 404
         
-        # Processa cada rascunho
-        for rascunho in rascunhos:
-            rascunho_id_str = str(rascunho.id)
-            
-            # Verifica se existe leitura oficial do mesmo dia
-            data_rascunho = rascunho.data_registro.date()
-            leitura_existente = Leitura.query.filter(
-                Leitura.quadro_id == rascunho.quadro_id,
-                db.func.date(Leitura.data_registro) == data_rascunho
-            ).first()
-            
-            if leitura_existente:
-                # Há conflito - verifica decisão do usuário
-                decisao = decisoes.get(rascunho_id_str, 'pular')
-                
-                if decisao == 'substituir':
-                    # Remove a leitura antiga e adiciona a nova
-                    db.session.delete(leitura_existente)
-                    
-                    leitura_definitiva = Leitura(
-                        quadro_id=rascunho.quadro_id,
-                        data_registro=rascunho.data_registro,
-                        valor_leitura=rascunho.valor_leitura,
-                        consumo_dia=rascunho.consumo_provisorio,
-                        alerta_reset=rascunho.alerta_reset
-                    )
-                    db.session.add(leitura_definitiva)
-                    db.session.delete(rascunho)
-                    total_substituido += 1
-                    
-                elif decisao == 'manter_ambas':
-                    # Mantém a antiga e adiciona a nova
-                    leitura_definitiva = Leitura(
-                        quadro_id=rascunho.quadro_id,
-                        data_registro=rascunho.data_registro,
-                        valor_leitura=rascunho.valor_leitura,
-                        consumo_dia=rascunho.consumo_provisorio,
-                        alerta_reset=rascunho.alerta_reset
-                    )
-                    db.session.add(leitura_definitiva)
-                    db.session.delete(rascunho)
-                    total_consolidado += 1
-                    
-                else:  # 'pular' ou sem decisão
-                    # Não faz nada, mantém o rascunho
-                    total_pulado += 1
-            else:
-                # Sem conflito - consolida normalmente
-                leitura_definitiva = Leitura(
-                    quadro_id=rascunho.quadro_id,
-                    data_registro=rascunho.data_registro,
-                    valor_leitura=rascunho.valor_leitura,
-                    consumo_dia=rascunho.consumo_provisorio,
-                    alerta_reset=rascunho.alerta_reset
-                )
-                db.session.add(leitura_definitiva)
-                db.session.delete(rascunho)
-                total_consolidado += 1
+        escopo = montar_escopo_sessao(area_id, quadro_ids)
+        if not escopo:
+            return jsonify({
+                'sucesso': False,
+                'mensagem': 'Nenhum quadro ativo no escopo informado.'
+            }), 400
         
-        db.session.commit()
+        # Um quadro só pode ser lido por uma equipe de cada vez
+        ocupados = db.session.query(Quadro.nome, SessaoLeitura.id, SessaoLeitura.nome)\
+            .join(SessaoQuadro, SessaoQuadro.quadro_id == Quadro.id)\
+            .join(SessaoLeitura, SessaoLeitura.id == SessaoQuadro.sessao_id)\
+            .filter(SessaoLeitura.ativa == True, SessaoQuadro.quadro_id.in_(escopo))\
+            .order_by(Quadro.nome).all()
+        if ocupados:
+            return jsonify({
+                'sucesso': False,
+                'mensagem': f'{len(ocupados)} quadro(s) já estão em outra sessão ativa: ' +
+                            ', '.join(f'{nome} ({nome_sessao or f"Sessão {sessao_id}"})' for nome, sessao_id, nome_sessao in ocupados[:10]),
+                'quadros_ocupados': [nome for nome, _, _ in ocupados]
+            }), 409
         
-        mensagem_partes = []
-        if total_consolidado > 0:
-            mensagem_partes.append(f'{total_consolidado} leitura(s) consolidada(s)')
-        if total_substituido > 0:
-            mensagem_partes.append(f'{total_substituido} substituída(s)')
-        if total_pulado > 0:
-            mensagem_partes.append(f'{total_pulado} pulada(s)')
+        # Limpa rascunhos antigos apenas dos quadros desta sessão (os de outras equipes ficam)
+        rascunhos_deletados = LeituraRascunho.query.filter(LeituraRascunho.quadro_id.in_(escopo))\
+            .delete(synchronize_session=False)
+        
+        # Cria nova sessão
+        nova_sessao = SessaoLeitura(
+            ativa=True, 
+            iniciada_por='Supervisor',
+            data_referencia=data_referencia,
+            nome=(dados.get('nome') or '').strip() or None,
+            area_id=area_id
+        )
+        db.session.add(nova_sessao)
+        db.session.flush()
+        db.session.add_all(SessaoQuadro(sessao_id=nova_sessao.id, quadro_id=q) for q in escopo)
+        db.session.commit()
         
         return jsonify({
             'sucesso': True,
-            'mensagem': ', '.join(mensagem_partes) + '!',
-            'total_consolidado': total_consolidado,
-            'total_substituido': total_substituido,
-            'total_pulado': total_pulado
-        }), 200
+            'mensagem': f'Sessão iniciada para {data_referencia.strftime("%d/%m/%Y")} com {len(escopo)} quadro(s). {rascunhos_deletados} rascunho(s) removido(s).',
+            'sessao': dict(nova_sessao.to_dict(), quadro_ids=escopo)
+        })
         
+    except (TypeError, ValueError):
+        db.session.rollback()
+        return jsonify({
+            'sucesso': False,
+            'mensagem': 'area_id e quadro_ids devem ser números.'
+        }), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({
             'sucesso': False,
-            'erro': f'Erro ao consolidar: {str(e)}'
+            'mensagem': f'Erro ao iniciar sessão: {str(e)}'
         }), 500
 
 
-@app.route('/quadros')
-def listar_quadros():
-    """Lista todos os quadros"""
-    quadros = Quadro.query.filter_by(ativo=True).all()
-    return jsonify([q.to_dict() for q in quadros])
+@app.route('/api/sessao/encerrar', methods=['POST'])
+def api_sessao_encerrar():
+    """Encerra uma sessão ativa e deleta apenas os rascunhos dela (Opção A)"""
+    try:
+        sessao_id = ler_sessao_id()
+        
+        # Sem sessao_id só é possível encerrar quando há uma única sessão ativa
+        query = SessaoLeitura.query.filter_by(ativa=True)
+        if sessao_id:
+            query = query.filter_by(id=sessao_id)
+        sessoes = query.limit(2).all()
+        
+        if not sessoes:
+            return jsonify({
+                'sucesso': False,
+                'mensagem': 'Não há sessão ativa'
+            }), 400
+        if len(sessoes) > 1:
+            return jsonify({
+                'sucesso': False,
+                'mensagem': 'Há mais de uma sessão ativa. Informe sessao_id.'
+            }), 400
+        
+        # Encerra sessão
+        sessao_ativa = sessoes[0]
+        sessao_ativa.ativa = False
+        sessao_ativa.data_fim = datetime.now()
+        
+        # OPÇÃO A: Deleta os rascunhos da sessão
+        rascunhos_deletados = LeituraRascunho.query.filter_by(sessao_id=sessao_ativa.id)\
+            .delete(synchronize_session=False)
+        
+        db.session.commit()
+        
+        return jsonify({
+            'sucesso': True,
+            'mensagem': f'Sessão encerrada e {rascunhos_deletados} rascunhos deletados',
+            'rascunhos_deletados': rascunhos_deletados
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'sucesso': False,
+            'mensagem': f'Erro ao encerrar sessão: {str(e)}'
+        }), 500
 
 
-@app.route('/quadro/<int:quadro_id>/ultima-leitura')
-def ultima_leitura_quadro(quadro_id):
-    """Retorna a última leitura de um quadro específico"""
-    quadro = Quadro.query.get(quadro_id)
-    
-    if not quadro:
-        return jsonify({
-            'erro': 'Quadro não encontrado'
-        }), 404
-    
-    ultima_leitura = Leitura.query.filter_by(quadro_id=quadro_id)\
-        .order_by(Leitura.data_registro.desc()).first()
-    
-    if ultima_leitura:
+@app.route('/api/sessao/status', methods=['GET'])
+@orcamento_consultas(2)
+def api_sessao_status():
+    """Retorna o status de uma sessão (?sessao_id=) ou de todas as sessões ativas"""
+    try:
+        sessao_id = request.args.get('sessao_id', type=int)
+        
+        query = SessaoLeitura.query.filter_by(ativa=True)
+        if sessao_id:
+            query = query.filter_by(id=sessao_id)
+        sessoes = query.order_by(SessaoLeitura.id).all()
+        
+        # Quantidade de quadros e de rascunhos de cada sessão em uma consulta
+        contagens = {}
+        if sessoes:
+            contagens = {
+                sid: (total_quadros, total_rascunhos)
+                for sid, total_quadros, total_rascunhos in db.session.query(
+                    SessaoQuadro.sessao_id,
+                    func.count(SessaoQuadro.quadro_id),
+                    func.count(LeituraRascunho.id)
+                ).outerjoin(LeituraRascunho, (LeituraRascunho.sessao_id == SessaoQuadro.sessao_id) &
+                            (LeituraRascunho.quadro_id == SessaoQuadro.quadro_id))
+                .filter(SessaoQuadro.sessao_id.in_([s.id for s in sessoes]))
+                .group_by(SessaoQuadro.sessao_id).all()
+            }
+        
+        lista = [
+            dict(s.to_dict(),
+                 total_quadros=contagens.get(s.id, (0, 0))[0],
+                 total_rascunhos=contagens.get(s.id, (0, 0))[1])
+            for s in sessoes
+        ]
+        
         return jsonify({
-            'existe': True,
-            'valor': ultima_leitura.valor_leitura,
-            'data': ultima_leitura.data_registro.strftime('%d/%m/%Y às %H:%M'),
-            'consumo_anterior': ultima_leitura.consumo_dia,
-            'alerta_reset': ultima_leitura.alerta_reset
+            'ativa': bool(lista),
+            'sessao': lista[0] if lista else None,
+            'sessoes': lista
         })
-    else:
+            
+    except Exception as e:
         return jsonify({
-            'existe': False,
-            'mensagem': 'Nenhuma leitura registrada ainda para este quadro'
-        })
+            'ativa': False,
+            'mensagem': f'Erro ao verificar status: {str(e)}'
+        }), 500
 
 
-@app.route('/leituras')
-def listar_leituras():
-    """Lista todas as leituras"""
-    leituras = Leitura.query.order_by(Leitura.data_registro.desc()).limit(50).all()
-    return jsonify([l.to_dict() for l in leituras])
+# Lista mobile por versão dos dados: o cursor de sincronização é a versão. O estado de cada
+# versão é montado uma vez (por todos os celulares) e guardado; a resposta de /sincronizar
+# é a diferença entre o estado do cursor e o atual, com os quadros que saíram da lista.
 
+class EstadoMobileInstavel(Exception):
+    """Os dados mudaram enquanto o estado era montado: ele não representa nenhuma versão"""
 
-# ========================================
-# ROTAS ADMINISTRATIVAS
-# ========================================
+    def __init__(self, estado):
+        super().__init__('Estado mobile alterado durante a leitura')
+        self.estado = estado
 
-@app.route('/admin/quadros')
-def admin_quadros():
-    """Interface administrativa para gerenciar quadros"""
-    quadros = Quadro.query.order_by(Quadro.nome).all()
+
+def montar_estado_mobile(sessao_id=None):
+    """Quadros no escopo das sessões ativas com o rascunho de cada um ({quadro_id: item}, por nome)"""
+    # Quadros ativos no escopo das sessões, ordenados alfabeticamente
+    quadros = db.session.query(Quadro, SessaoQuadro.sessao_id)\
+        .join(SessaoQuadro, SessaoQuadro.quadro_id == Quadro.id)\
+        .join(SessaoLeitura, SessaoLeitura.id == SessaoQuadro.sessao_id)\
+        .filter(Quadro.ativo == True, SessaoLeitura.ativa == True)
+    if sessao_id:
+        quadros = quadros.filter(SessaoQuadro.sessao_id == sessao_id)
+    quadros = quadros.order_by(Quadro.nome).all()
     
-    # Variáveis para a sidebar
-    ip_local = obter_ip_local()
-    url_mobile = f"http://{ip_local}:5000/registrar"
-    qrcode_img = gerar_qrcode(url_mobile)
-    total_rascunhos = LeituraRascunho.query.count()
+    # Rascunhos das mesmas sessões, pelo índice (sessao_id, quadro_id)
+    rascunhos = LeituraRascunho.query.filter(
+        LeituraRascunho.sessao_id.in_({sid for _, sid in quadros})
+    ).all() if quadros else []
     
-    return render_template('admin_quadros.html', 
-                         quadros=quadros,
-                         qrcode_img=qrcode_img,
-                         ip_local=ip_local,
-                         total_rascunhos=total_rascunhos)
+    # Cria dicionário de rascunhos por quadro_id
+    rascunhos_dict = {r.quadro_id: r for r in rascunhos}
+    
+    estado = {}
+    for quadro, quadro_sessao_id in quadros:
+        rascunho = rascunhos_dict.get(quadro.id)
+        estado[quadro.id] = {
+            'quadro_id': quadro.id,
+            'quadro_nome': quadro.nome,
+            'quadro_localizacao': quadro.localizacao,
+            'sessao_id': quadro_sessao_id,
+            'cadastrado': rascunho is not None,
+            'valor_leitura': rascunho.valor_leitura if rascunho else None,
+            'alerta_reset': rascunho.alerta_reset if rascunho else False,
+            'rascunho_id': rascunho.id if rascunho else None
+        }
+    return estado
 
 
-@app.route('/admin/quadros/criar', methods=['POST'])
-def criar_quadro():
-    """Cria um novo quadro"""
+def obter_estado_mobile(sessao_id=None):
+    """(versão, estado) atuais da lista mobile; versão None se os dados mudaram durante a montagem"""
+    versao = obter_versao_dados()
+    
+    def gerar():
+        estado = montar_estado_mobile(sessao_id)
+        if cache_compartilhado.versao() != versao:
+            raise EstadoMobileInstavel(estado)
+        return estado
+    
     try:
-        nome = request.form.get('nome', '').strip()
-        localizacao = request.form.get('localizacao', '').strip()
-        
-        if not nome or not localizacao:
-            return jsonify({
-                'sucesso': False,
-                'erro': 'Nome e localização são obrigatórios.'
-            }), 400
-        
-        # Verifica se já existe um quadro com esse nome
-        quadro_existente = Quadro.query.filter_by(nome=nome).first()
-        if quadro_existente:
-            return jsonify({
-                'sucesso': False,
-                'erro': 'Já existe um quadro com este nome.'
-            }), 400
-        
-        novo_quadro = Quadro(
-            nome=nome,
-            localizacao=localizacao,
-            ativo=True
-        )
-        
-        db.session.add(novo_quadro)
-        db.session.commit()
+        return versao, cache_estados_mobile.obter(('estado_mobile', sessao_id, versao), gerar)
+    except EstadoMobileInstavel as e:
+        return None, e.estado
+
+
+def estado_mobile_da_versao(sessao_id, versao):
+    """Estado já enviado aos celulares nessa versão (None se não estiver mais guardado)"""
+    encontrado, estado = cache_estados_mobile.consultar(('estado_mobile', sessao_id, versao))
+    return estado if encontrado else None
+
+
+@app.route('/api/rascunhos/mobile', methods=['GET'])
+@orcamento_consultas(3)
+def api_rascunhos_mobile():
+    """Retorna lista de quadros da sessão (ou de todas as sessões ativas) com status e valores para interface mobile"""
+    try:
+        _, estado = obter_estado_mobile(request.args.get('sessao_id', type=int))
         
         return jsonify({
             'sucesso': True,
-            'mensagem': f'Quadro "{nome}" criado com sucesso!',
-            'quadro': novo_quadro.to_dict()
-        }), 201
+            'quadros': list(estado.values())
+        })
         
     except Exception as e:
-        db.session.rollback()
         return jsonify({
             'sucesso': False,
-            'erro': f'Erro ao criar quadro: {str(e)}'
+            'mensagem': f'Erro ao buscar quadros: {str(e)}'
         }), 500
 
 
-@app.route('/admin/quadros/editar/<int:id>', methods=['POST'])
-def editar_quadro(id):
-    """Edita um quadro existente"""
+@app.route('/api/rascunhos/mobile/sincronizar', methods=['GET'])
+@orcamento_consultas(3)
+def api_rascunhos_mobile_sincronizar():
+    """Só o que mudou na lista mobile desde o cursor (?desde=): quadros novos/alterados e os removidos
+    
+    Sem cursor, ou com um cursor que não está mais guardado, devolve a lista inteira com completo=true.
+    Com o cursor atual responde sem consultar o banco.
+    """
     try:
-        quadro = Quadro.query.get(id)
+        sessao_id = request.args.get('sessao_id', type=int)
+        desde = request.args.get('desde', type=int)
         
-        if not quadro:
-            return jsonify({
-                'sucesso': False,
-                'erro': 'Quadro não encontrado.'
-            }), 404
+        if desde is not None and desde == obter_versao_dados():
+            return jsonify({'sucesso': True, 'cursor': desde, 'completo': False, 'quadros': [], 'removidos': []})
         
-        nome = request.form.get('nome', '').strip()
-        localizacao = request.form.get('localizacao', '').strip()
-        ativo = request.form.get('ativo') == 'true'
+        versao, estado = obter_estado_mobile(sessao_id)
+        anterior = estado_mobile_da_versao(sessao_id, desde) if desde is not None else None
         
-        if not nome or not localizacao:
+        if anterior is None:
             return jsonify({
-                'sucesso': False,
-                'erro': 'Nome e localização são obrigatórios.'
-            }), 400
+                'sucesso': True,
+                'cursor': versao,
+                'completo': True,
+                'quadros': list(estado.values()),
+                'removidos': []
+            })
         
-        # Verifica se já existe outro quadro com esse nome
-        quadro_existente = Quadro.query.filter(
-            Quadro.nome == nome,
-            Quadro.id != id
-        ).first()
+        return jsonify({
+            'sucesso': True,
+            'cursor': versao,
+            'completo': False,
+            'quadros': [item for quadro_id, item in estado.items() if anterior.get(quadro_id) != item],
+            'removidos': [quadro_id for quadro_id in anterior if quadro_id not in estado]
+        })
         
-        if quadro_existente:
-            return jsonify({
-                'sucesso': False,
-                'erro': 'Já existe outro quadro com este nome.'
-            }), 400
+    except Exception as e:
+        return jsonify({
+            'sucesso': False,
+            'mensagem': f'Erro ao sincronizar quadros: {str(e)}'
+        }), 500
+
+
+@app.route('/api/rascunhos/revisao', methods=['GET'])
+@orcamento_consultas(4)
+def api_rascunhos_revisao():
+    """Retorna dados de revisão em JSON para atualização em tempo real"""
+    try:
+        dados_revisao = obter_dados_revisao(request.args.get('sessao_id', type=int))
+        
+        return jsonify({
+            'sucesso': True,
+            'rascunhos': dados_revisao,
+            'total': len(dados_revisao)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'sucesso': False,
+            'mensagem': f'Erro ao buscar rascunhos: {str(e)}'
+        }), 500
+
+
+    db.session.commit()
+
+
+# ========================================
+# BUSCA DE QUADROS
+# ========================================
+# Índice em memória de nome e localização dos quadros ativos, sem acentos e em minúsculas:
+# trigramas para buscas de 3 letras ou mais (qualquer trecho) e prefixos de palavra para
+# 1-2 letras. É refeito só quando o cadastro de quadros muda (contador 'quadros' do cache
+# compartilhado, incrementado por qualquer processo), não a cada leitura gravada.
+
+def normalizar_busca(texto):
+    """Minúsculas, sem acentos e espaços simples ('Subestação  Norte' -> 'subestacao norte')"""
+    decomposto = unicodedata.normalize('NFKD', texto or '')
+    return ' '.join(''.join(c for c in decomposto if not unicodedata.combining(c)).casefold().split())
+
+
+def trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceQuadros:
+    """Índice de busca dos quadros ativos, refeito quando o contador de cadastro muda"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versao = None
+        self._indice = None
+
+    def _montar(self):
+        quadros = db.session.query(Quadro.id, Quadro.nome, Quadro.localizacao)\
+            .filter(Quadro.ativo == True).all()
+
+        textos = {quadro_id: (normalizar_busca(nome), normalizar_busca(localizacao))
+                  for quadro_id, nome, localizacao in quadros}
+        ordem = sorted(textos, key=lambda quadro_id: (textos[quadro_id][0], quadro_id))
+
+        por_trigrama = {}
+        por_prefixo = {}
+        for quadro_id, (nome, localizacao) in textos.items():
+            for trigrama in trigramas(nome) | trigramas(localizacao):
+                por_trigrama.setdefault(trigrama, set()).add(quadro_id)
+            for palavra in (nome + ' ' + localizacao).split():
+                por_prefixo.setdefault(palavra[:1], set()).add(quadro_id)
+                por_prefixo.setdefault(palavra[:2], set()).add(quadro_id)
+
+        return {
+            'textos': textos,
+            'ordem': ordem,
+            'posicao': {quadro_id: i for i, quadro_id in enumerate(ordem)},
+            'por_trigrama': por_trigrama,
+            'por_prefixo': por_prefixo
+        }
+
+    def _obter(self):
+        versao = cache_compartilhado.contador('quadros')
+        with self._lock:
+            if self._versao == versao:
+                return self._indice
+
+        indice = self._montar()
+        with self._lock:
+            self._versao, self._indice = versao, indice
+        return indice
+
+    def buscar(self, termo):
+        """Ids dos quadros que contêm o termo, primeiro os que o têm no início do nome"""
+        indice = self._obter()
+        termo = normalizar_busca(termo)
+        if not termo:
+            return list(indice['ordem'])
+
+        if len(termo) >= 3:
+            conjuntos = sorted((indice['por_trigrama'].get(t, set()) for t in trigramas(termo)), key=len)
+            candidatos = set.intersection(*conjuntos) if conjuntos else set()
+            textos = indice['textos']
+            encontrados = [q for q in candidatos if termo in textos[q][0] or termo in textos[q][1]]
+        else:
+            encontrados = indice['por_prefixo'].get(termo, set())
+
+        def relevancia(quadro_id):
+            nome, _ = indice['textos'][quadro_id]
+            if nome.startswith(termo):
+                grupo = 0
+            elif (' ' + termo) in (' ' + nome):
+                grupo = 1  # Começo de outra palavra do nome
+            elif termo in nome:
+                grupo = 2
+            else:
+                grupo = 3  # Só na localização
+            return grupo, indice['posicao'][quadro_id]
+
+        return sorted(encontrados, key=relevancia)
+
+
+indice_quadros = IndiceQuadros()
+
+
+@app.route('/api/quadros/buscar', methods=['GET'])
+@orcamento_consultas(3)
+def api_quadros_buscar():
+    """Busca paginada de quadros por nome/localização, sem diferenciar acentos (?q=, pagina, por_pagina)
+    
+    Com ?mobile=1 (e sessao_id opcional) busca só nos quadros das sessões ativas e devolve os
+    itens da lista mobile, com o rascunho de cada quadro.
+    """
+    try:
+        termo = request.args.get('q', '')
+        pagina = max(request.args.get('pagina', 1, type=int), 1)
+        por_pagina = min(max(request.args.get('por_pagina', 50, type=int), 1), 200)
         
-        quadro.nome = nome
-        quadro.localizacao = localizacao
-        quadro.ativo = ativo
+        ids = indice_quadros.buscar(termo)
         
-        db.session.commit()
+        if request.args.get('mobile'):
+            _, estado = obter_estado_mobile(request.args.get('sessao_id', type=int))
+            ids = [quadro_id for quadro_id in ids if quadro_id in estado]
+        
+        total = len(ids)
+        ids_pagina = ids[(pagina - 1) * por_pagina:pagina * por_pagina]
+        
+        if request.args.get('mobile'):
+            itens = [estado[quadro_id] for quadro_id in ids_pagina]
+        else:
+            quadros = {q.id: q for q in Quadro.query.filter(Quadro.id.in_(ids_pagina)).all()} if ids_pagina else {}
+            itens = [quadros[quadro_id].to_dict() for quadro_id in ids_pagina if quadro_id in quadros]
         
         return jsonify({
             'sucesso': True,
-            'mensagem': f'Quadro "{nome}" atualizado com sucesso!',
-            'quadro': quadro.to_dict()
-        }), 200
+            'q': termo,
+            'pagina': pagina,
+            'por_pagina': por_pagina,
+            'total': total,
+            'paginas': (total + por_pagina - 1) // por_pagina,
+            'quadros': itens
+        })
         
     except Exception as e:
-        db.session.rollback()
         return jsonify({
             'sucesso': False,
-            'erro': f'Erro ao editar quadro: {str(e)}'
+            'mensagem': f'Erro ao buscar quadros: {str(e)}'
         }), 500
 
 
-@app.route('/admin/quadros/excluir/<int:id>', methods=['POST'])
-def excluir_quadro(id):
-    """Exclui ou desativa um quadro (soft delete se houver leituras)"""
+# ========================================
+# RELATÓRIOS MENSAIS PRÉ-CALCULADOS
+# ========================================
+
+def marcar_meses_alterados(datas):
+    """Marca os meses das datas informadas para recálculo dos relatórios e custos (não faz commit)"""
+    agora = datetime.now()
+    for ano_mes in {d.strftime('%Y-%m') for d in datas if d}:
+        db.session.merge(RelatorioPendente(ano_mes=ano_mes, marcado_em=agora))
+        db.session.merge(CustoPendente(ano_mes=ano_mes, marcado_em=agora))
+
+
+def calcular_relatorio_mes(ano_mes):
+    """Recalcula e grava os resumos de um mês para cada quadro e para a planta inteira"""
+    ano, mes = map(int, ano_mes.split('-'))
+    primeiro_dia = datetime(ano, mes, 1).date()
+    proximo_mes = (primeiro_dia + timedelta(days=32)).replace(day=1)
+    inicio_mes = datetime.combine(primeiro_dia, datetime.min.time())
+    fim_mes = datetime.combine(proximo_mes, datetime.min.time())
+
+    # Dias considerados: o mês inteiro, ou até hoje se for o mês corrente
+    ultimo_dia = min(proximo_mes - timedelta(days=1), datetime.now().date())
+    total_dias = (ultimo_dia - primeiro_dia).days + 1 if ultimo_dia >= primeiro_dia else 0
+
+    # Consumo e resets por quadro e por dia em uma única consulta agregada
+    linhas = db.session.query(
+            Leitura.quadro_id,
+            func.date(Leitura.data_registro),
+            func.sum(Leitura.consumo_dia),
+            func.sum(db.case((Leitura.alerta_reset == True, 1), else_=0))
+        )\
+        .filter(Leitura.data_registro >= inicio_mes)\
+        .filter(Leitura.data_registro < fim_mes)\
+        .group_by(Leitura.quadro_id, func.date(Leitura.data_registro))\
+        .all()
+
+    # Quadros ativos que já estavam em uso também entram (com os dias faltantes)
+    quadros_em_uso = db.session.query(Leitura.quadro_id)\
+        .join(Quadro, Quadro.id == Leitura.quadro_id)\
+        .filter(Quadro.ativo == True)\
+        .filter(Leitura.data_registro < fim_mes)\
+        .distinct().all()
+
+    dias_por_quadro = {quadro_id: {} for (quadro_id,) in quadros_em_uso}
+    resets_por_quadro = {}
+    dias_planta = {}
+
+    for quadro_id, dia_str, consumo, resets in linhas:
+        dia = datetime.strptime(dia_str, '%Y-%m-%d').date()
+        consumo = consumo or 0
+        dias_por_quadro.setdefault(quadro_id, {})[dia] = consumo
+        resets_por_quadro[quadro_id] = resets_por_quadro.get(quadro_id, 0) + (resets or 0)
+        dias_planta[dia] = dias_planta.get(dia, 0) + consumo
+
+    def montar_resumo(quadro_id, consumo_por_dia, resets):
+        consumo_total = sum(consumo_por_dia.values())
+        dias_com_leitura = len(consumo_por_dia)
+        divisor = total_dias or dias_com_leitura
+        data_maior = max(consumo_por_dia, key=consumo_por_dia.get) if consumo_por_dia else None
+
+        return RelatorioMensal(
+            ano_mes=ano_mes,
+            quadro_id=quadro_id,
+            consumo_total=consumo_total,
+            media_diaria=consumo_total / divisor if divisor else 0,
+            maior_consumo_dia=consumo_por_dia[data_maior] if data_maior else 0,
+            data_maior_consumo=data_maior,
+            total_resets=resets,
+            dias_com_leitura=dias_com_leitura,
+            dias_faltantes=max(total_dias - dias_com_leitura, 0),
+            atualizado_em=datetime.now()
+        )
+
+    # Substitui os resumos anteriores do mês
+    RelatorioMensal.query.filter_by(ano_mes=ano_mes).delete()
+
+    for quadro_id, consumo_por_dia in dias_por_quadro.items():
+        db.session.add(montar_resumo(quadro_id, consumo_por_dia, resets_por_quadro.get(quadro_id, 0)))
+
+    db.session.add(montar_resumo(None, dias_planta, sum(resets_por_quadro.values())))
+
+
+def processar_relatorios_pendentes():
+    """Recalcula apenas os meses marcados como alterados desde a última execução"""
+    # Primeira execução: marca todos os meses que possuem leituras
+    if RelatorioMensal.query.first() is None and RelatorioPendente.query.first() is None:
+        meses = db.session.query(func.strftime('%Y-%m', Leitura.data_registro)).distinct().all()
+        agora = datetime.now()
+        for (ano_mes,) in meses:
+            db.session.add(RelatorioPendente(ano_mes=ano_mes, marcado_em=agora))
+        db.session.commit()
+
+    pendentes = RelatorioPendente.query.order_by(RelatorioPendente.ano_mes).all()
+    meses_processados = []
+
+    for pendente in pendentes:
+        ano_mes, marcado_em = pendente.ano_mes, pendente.marcado_em
+        calcular_relatorio_mes(ano_mes)
+
+        # Só remove a marca se o mês não foi alterado novamente durante o cálculo
+        RelatorioPendente.query.filter(
+            RelatorioPendente.ano_mes == ano_mes,
+            RelatorioPendente.marcado_em <= marcado_em
+        ).delete()
+        db.session.commit()
+        meses_processados.append(ano_mes)
+
+    return meses_processados
+
+
+class AgendadorRelatorios:
+    """Thread em segundo plano que atualiza os relatórios após consolidações e no horário configurado"""
+
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self.ultima_execucao = None
+        self.ultimos_meses = []
+        self._evento = threading.Event()
+        self._thread = None
+
+    @property
+    def ativo(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def iniciar(self):
+        """Inicia a thread do agendador (apenas uma vez por processo)"""
+        if self.ativo:
+            return
+        self._evento.set()  # Processa pendências logo na inicialização
+        self._thread = threading.Thread(target=self._executar, name='agendador-relatorios', daemon=True)
+        self._thread.start()
+
+    def notificar(self):
+        """Acorda o agendador para processar os meses pendentes"""
+        self._evento.set()
+
+    def _segundos_ate_horario(self):
+        """Calcula quantos segundos faltam até o próximo horário configurado"""
+        hora, minuto = map(int, self.app.config['RELATORIOS_HORARIO'].split(':'))
+        agora = datetime.now()
+        proximo = agora.replace(hour=hora, minute=minuto, second=0, microsecond=0)
+        if proximo <= agora:
+            proximo += timedelta(days=1)
+        return (proximo - agora).total_seconds()
+
+    def _executar(self):
+        while True:
+            acionado = self._evento.wait(timeout=self._segundos_ate_horario())
+            self._evento.clear()
+
+            with self.app.app_context():
+                try:
+                    if not acionado:
+                        # Execução diária: o mês corrente ganha mais um dia a considerar
+                        marcar_meses_alterados([datetime.now().date(), datetime.now().date() - timedelta(days=1)])
+                        db.session.commit()
+
+                    self.ultimos_meses = processar_relatorios_pendentes()
+                    processar_custos_pendentes()
+                    processar_previsoes_pendentes()
+                    self.ultima_execucao = datetime.now()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"⚠️ Erro ao atualizar relatórios mensais: {e}")
+                finally:
+                    db.session.remove()
+
+
+agendador_relatorios = AgendadorRelatorios(app)
+
+
+@app.route('/api/relatorios/mensal', methods=['GET'])
+def api_relatorios_mensal():
+    """Retorna os resumos mensais pré-calculados por quadro e da planta"""
     try:
-        quadro = Quadro.query.get(id)
-        
-        if not quadro:
-            return jsonify({
-                'sucesso': False,
-                'erro': 'Quadro não encontrado.'
-            }), 404
-        
-        # Verifica se existem leituras associadas
-        tem_leituras = Leitura.query.filter_by(quadro_id=id).count() > 0
-        
-        if tem_leituras:
-            # Soft Delete - apenas desativa o quadro
-            quadro.ativo = False
-            db.session.commit()
-            
-            return jsonify({
-                'sucesso': True,
-                'tipo': 'desativado',
-                'mensagem': f'Quadro "{quadro.nome}" foi DESATIVADO (possui leituras associadas).'
-            }), 200
-        else:
-            # Delete real - remove do banco
-            nome_quadro = quadro.nome
-            db.session.delete(quadro)
-            db.session.commit()
-            
-            return jsonify({
-                'sucesso': True,
-                'tipo': 'excluido',
-                'mensagem': f'Quadro "{nome_quadro}" foi EXCLUÍDO permanentemente.'
-            }), 200
-        
+        ano_mes = request.args.get('ano_mes')
+        mes_inicio = request.args.get('de')
+        mes_fim = request.args.get('ate')
+        quadro_id = request.args.get('quadro_id', type=int)
+
+        # Sem o agendador rodando (ex.: outro servidor WSGI), processa as pendências aqui
+        if not agendador_relatorios.ativo:
+            processar_relatorios_pendentes()
+
+        query = RelatorioMensal.query
+
+        if ano_mes:
+            query = query.filter(RelatorioMensal.ano_mes == ano_mes)
+        if mes_inicio:
+            query = query.filter(RelatorioMensal.ano_mes >= mes_inicio)
+        if mes_fim:
+            query = query.filter(RelatorioMensal.ano_mes <= mes_fim)
+        if quadro_id:
+            query = query.filter(RelatorioMensal.quadro_id == quadro_id)
+
+        relatorios = query.order_by(RelatorioMensal.ano_mes.desc(), RelatorioMensal.quadro_id).all()
+        pendentes = [p.ano_mes for p in RelatorioPendente.query.order_by(RelatorioPendente.ano_mes).all()]
+
+        return jsonify({
+            'sucesso': True,
+            'relatorios': [r.to_dict() for r in relatorios],
+            'meses_pendentes': pendentes,
+            'ultima_execucao': agendador_relatorios.ultima_execucao.strftime('%d/%m/%Y %H:%M:%S') if agendador_relatorios.ultima_execucao else None
+        }), 200
+
     except Exception as e:
         db.session.rollback()
         return jsonify({
             'sucesso': False,
-            'erro': f'Erro ao excluir quadro: {str(e)}'
+            'erro': f'Erro ao buscar relatórios mensais: {str(e)}'
         }), 500
 
 
 # ========================================
-# ROTAS DE ANÁLISE E RELATÓRIOS
+# TARIFAS E CUSTOS
 # ========================================
 
-@app.route('/analise')
-def analise():
-    """Página de análise e inteligência de dados"""
-    quadros = Quadro.query.filter_by(ativo=True).order_by(Quadro.nome).all()
-    
-    # Variáveis para a sidebar
-    ip_local = obter_ip_local()
-    url_mobile = f"http://{ip_local}:5000/registrar"
-    qrcode_img = gerar_qrcode(url_mobile)
-    total_rascunhos = LeituraRascunho.query.count()
-    
-    return render_template('analise.html', 
-                         quadros=quadros,
-                         qrcode_img=qrcode_img,
-                         ip_local=ip_local,
-                         total_rascunhos=total_rascunhos)
+# Os dados são diários, então cada posto tarifário (ponta, fora de ponta...) recebe uma
+# fração fixa do kWh do dia; as frações de cada dia da semana somam 1. As faixas cobram
+# um adicional sobre o kWh acumulado no mês acima de cada limite.
 
+def meses_do_periodo(inicio, fim):
+    """Meses AAAA-MM de inicio a fim (datas), inclusive"""
+    meses = []
+    atual = inicio.replace(day=1)
+    while atual <= fim:
+        meses.append(atual.strftime('%Y-%m'))
+        atual = (atual + timedelta(days=32)).replace(day=1)
+    return meses
+
+
+def marcar_custos_periodo(inicio, fim):
+    """Marca para recálculo os meses com consumo entre inicio e fim (None = sem limite; não faz commit)"""
+    primeiro, ultimo = db.session.query(func.min(ConsumoDiario.data), func.max(ConsumoDiario.data))\
+        .filter(ConsumoDiario.escopo == 'quadro').one()
+    if primeiro is None:
+        return
+
+    inicio = max(primeiro, inicio) if inicio else primeiro
+    fim = min(ultimo, fim) if fim else ultimo
+    agora = datetime.now()
+    for ano_mes in meses_do_periodo(inicio, fim):
+        db.session.merge(CustoPendente(ano_mes=ano_mes, marcado_em=agora))
+
+
+def montar_tabelas_tarifas(tarifas):
+    """Arrays do motor de custo: preço por kWh de cada dia da semana e faixas (limites/adicionais) por tarifa"""
+    import numpy as np
+
+    precos = np.zeros((len(tarifas), 7))
+    total_faixas = max((len(t.faixas) for t in tarifas), default=0)
+    # Faixas ausentes ficam com limite infinito e adicional zero
+    limites = np.full((len(tarifas), total_faixas), np.inf)
+    adicionais = np.zeros((len(tarifas), total_faixas))
+
+    for i, tarifa in enumerate(tarifas):
+        for periodo in tarifa.periodos:
+            precos[i, periodo.lista_dias()] += periodo.fracao * periodo.preco_kwh
+        for k, faixa in enumerate(sorted(tarifa.faixas, key=lambda f: f.acima_de_kwh)):
+            limites[i, k] = faixa.acima_de_kwh
+            adicionais[i, k] = faixa.adicional_kwh
+
+    return precos, limites, adicionais
+
+
+def calcular_custos(consumo_diario, tarifas):
+    """Aplica as tarifas à série diária de todos os quadros de uma vez.
+
+    consumo_diario: DataFrame com quadro_id, data e consumo. Devolve o custo por quadro
+    e mês (consumo_kwh, custo_energia, custo_faixas, consumo_sem_tarifa).
+    """
+    import numpy as np
+
+    df = consumo_diario.sort_values(['quadro_id', 'data'], kind='stable').reset_index(drop=True)
+    df['consumo'] = df['consumo'].clip(lower=0)
+    df['ano_mes'] = df['data'].dt.strftime('%Y-%m')
+
+    consumo = df['consumo'].to_numpy(dtype=float)
+    datas = df['data'].to_numpy()
+    quadros = df['quadro_id'].to_numpy()
+
+    # Tarifa de cada dia: gerais primeiro, depois as do quadro; entre iguais, a vigência mais recente
+    indice = np.full(len(df), -1)
+    for i in sorted(range(len(tarifas)), key=lambda i: (tarifas[i].quadro_id is not None, tarifas[i].vigencia_inicio)):
+        tarifa = tarifas[i]
+        mascara = datas >= np.datetime64(tarifa.vigencia_inicio)
+        if tarifa.vigencia_fim:
+            mascara &= datas <= np.datetime64(tarifa.vigencia_fim)
+        if tarifa.quadro_id is not None:
+            mascara &= quadros == tarifa.quadro_id
+        indice[mascara] = i
+
+    com_tarifa = indice >= 0
+    linha = np.where(com_tarifa, indice, 0)
+    precos, limites, adicionais = montar_tabelas_tarifas(tarifas) if tarifas else \
+        (np.zeros((1, 7)), np.zeros((1, 0)), np.zeros((1, 0)))
+
+    df['custo_energia'] = np.where(com_tarifa, consumo * precos[linha, df['data'].dt.weekday.to_numpy()], 0.0)
+
+    # Parte do kWh do dia que cai em cada faixa, pelo acumulado do quadro no mês
+    custo_faixas = np.zeros(len(df))
+    if limites.shape[1]:
+        acumulado = df.groupby(['quadro_id', 'ano_mes'])['consumo'].cumsum().to_numpy()
+        anterior = acumulado - consumo
+        inferior = limites[linha]
+        superior = np.concatenate([inferior[:, 1:], np.full((len(df), 1), np.inf)], axis=1)
+        na_faixa = np.maximum(0, np.minimum(acumulado[:, None], superior) - np.maximum(anterior[:, None], inferior))
+        custo_faixas = np.where(com_tarifa, (na_faixa * adicionais[linha]).sum(axis=1), 0.0)
+    df['custo_faixas'] = custo_faixas
+    df['consumo_sem_tarifa'] = np.where(com_tarifa, 0.0, consumo)
+
+    return df.groupby(['quadro_id', 'ano_mes'], as_index=False).agg(
+        consumo_kwh=('consumo', 'sum'),
+        custo_energia=('custo_energia', 'sum'),
+        custo_faixas=('custo_faixas', 'sum'),
+        consumo_sem_tarifa=('consumo_sem_tarifa', 'sum')
+    )
+
+
+def calcular_custos_meses(meses):
+    """Recalcula e grava os custos de todos os quadros (e da planta) nos meses informados"""
+    import pandas as pd
+
+    intervalos = []
+    for ano_mes in meses:
+        primeiro_dia = datetime.strptime(ano_mes + '-01', '%Y-%m-%d').date()
+        proximo_mes = (primeiro_dia + timedelta(days=32)).replace(day=1)
+        intervalos.append((ConsumoDiario.data >= primeiro_dia) & (ConsumoDiario.data < proximo_mes))
+
+    linhas = db.session.query(ConsumoDiario.referencia_id, ConsumoDiario.data, ConsumoDiario.consumo)\
+        .filter(ConsumoDiario.escopo == 'quadro', db.or_(*intervalos)).all()
+    tarifas = Tarifa.query.options(selectinload(Tarifa.periodos), selectinload(Tarifa.faixas)).all()
+    submedidores = {q for (q,) in db.session.query(Quadro.id).filter(Quadro.quadro_pai_id.isnot(None))}
+
+    CustoMensal.query.filter(CustoMensal.ano_mes.in_(meses)).delete(synchronize_session=False)
+    if not linhas:
+        return
+
+    consumo_diario = pd.DataFrame(linhas, columns=['quadro_id', 'data', 'consumo'])
+    consumo_diario['data'] = pd.to_datetime(consumo_diario['data'])
+    mensal = calcular_custos(consumo_diario, tarifas)
+    mensal['custo_total'] = mensal['custo_energia'] + mensal['custo_faixas']
+
+    # Planta: soma dos quadros que não são submedidores (o consumo deles já está no pai)
+    colunas = ['consumo_kwh', 'custo_energia', 'custo_faixas', 'custo_total', 'consumo_sem_tarifa']
+    planta = mensal[~mensal['quadro_id'].isin(submedidores)].groupby('ano_mes', as_index=False)[colunas].sum()
+    planta['quadro_id'] = 0
+
+    agora = datetime.now()
+    registros = pd.concat([mensal, planta], ignore_index=True)
+    db.session.execute(CustoMensal.__table__.insert(), [
+        dict(registro, quadro_id=int(registro['quadro_id']), atualizado_em=agora)
+        for registro in registros[['quadro_id', 'ano_mes'] + colunas].to_dict('records')
+    ])
+
+
+def processar_custos_pendentes():
+    """Recalcula os custos apenas dos meses marcados, todos de uma vez"""
+    pendentes = {p.ano_mes: p.marcado_em for p in CustoPendente.query.all()}
+    if not pendentes:
+        return []
+
+    with consultas_fora_do_orcamento():
+        calcular_custos_meses(sorted(pendentes))
+
+        # Só remove a marca se o mês não foi alterado novamente durante o cálculo
+        for ano_mes, marcado_em in pendentes.items():
+            CustoPendente.query.filter(
+                CustoPendente.ano_mes == ano_mes,
+                CustoPendente.marcado_em <= marcado_em
+            ).delete(synchronize_session=False)
+        db.session.commit()
+    return sorted(pendentes)
+
+
+def garantir_custos_atualizados():
+    """Sem o agendador rodando (ex.: outro servidor WSGI), processa os meses pendentes na hora"""
+    if not agendador_relatorios.ativo:
+        processar_custos_pendentes()
+
+
+def obter_custo_planta_mes(ano_mes):
+    """Custo da planta no mês para o card do dashboard, com os meses pendentes já recalculados"""
+    garantir_custos_atualizados()
+    return CustoMensal.query.get((0, ano_mes))
+
+
+def obter_custos(meses=None, quadro_id=None):
+    """Custos gravados por quadro e mês, com o nome do quadro ('Planta (Total)' para o quadro 0)"""
+    query = db.session.query(CustoMensal, Quadro.nome).outerjoin(Quadro, Quadro.id == CustoMensal.quadro_id)
+    if meses is not None:
+        query = query.filter(CustoMensal.ano_mes.in_(meses))
+    if quadro_id is not None:
+        query = query.filter(CustoMensal.quadro_id == quadro_id)
+
+    return [
+        dict(custo.to_dict(), quadro_nome=nome or 'Planta (Total)')
+        for custo, nome in query.order_by(CustoMensal.ano_mes, CustoMensal.quadro_id).all()
+    ]
+
+
+def ler_tarifa(dados):
+    """Valida o JSON de uma tarifa e devolve (Tarifa, erro)"""
+    nome = (dados.get('nome') or '').strip()
+    if not nome:
+        return None, 'Informe o nome da tarifa.'
+
+    try:
+        vigencia_inicio = datetime.strptime(dados.get('vigencia_inicio') or '', '%Y-%m-%d').date()
+        vigencia_fim = datetime.strptime(dados['vigencia_fim'], '%Y-%m-%d').date() if dados.get('vigencia_fim') else None
+    except ValueError:
+        return None, 'Vigência inválida. Use YYYY-MM-DD.'
+    if vigencia_fim and vigencia_fim < vigencia_inicio:
+        return None, 'O fim da vigência é anterior ao início.'
+
+    quadro_id = dados.get('quadro_id') or None
+    if quadro_id and not Quadro.query.get(int(quadro_id)):
+        return None, 'Quadro não encontrado.'
+
+    tarifa = Tarifa(nome=nome, quadro_id=int(quadro_id) if quadro_id else None,
+                    vigencia_inicio=vigencia_inicio, vigencia_fim=vigencia_fim)
+
+    periodos = dados.get('periodos') or []
+    if not isinstance(periodos, list) or not all(isinstance(p, dict) for p in periodos):
+        return None, 'periodos deve ser uma lista de postos ({"nome", "dias_semana", "fracao", "preco_kwh"}).'
+    if not periodos:
+        return None, 'Informe ao menos um posto tarifário (periodos).'
+    for periodo in periodos:
+        dias = periodo.get('dias_semana', list(range(7)))
+        if isinstance(dias, str):
+            dias = [d for d in dias.split(',') if d.strip()]
+        if not isinstance(dias, list):
+            return None, 'dias_semana deve ser uma lista ou texto separado por vírgulas.'
+        dias = sorted({int(d) for d in dias})
+        if not dias or any(d < 0 or d > 6 for d in dias):
+            return None, 'dias_semana deve conter números de 0 (segunda) a 6 (domingo).'
+        tarifa.periodos.append(TarifaPeriodo(
+            nome=(periodo.get('nome') or 'Único').strip(),
+            dias_semana=','.join(map(str, dias)),
+            fracao=float(periodo.get('fracao', 1)),
+            preco_kwh=float(periodo['preco_kwh'])
+        ))
+
+    # Em cada dia da semana as frações dos postos precisam cobrir o consumo inteiro
+    for dia in range(7):
+        soma = sum(p.fracao for p in tarifa.periodos if dia in p.lista_dias())
+        if abs(soma - 1) > 0.001:
+            return None, f'As frações dos postos no dia {dia} somam {soma:g}; devem somar 1.'
+
+    faixas = dados.get('faixas') or []
+    if not isinstance(faixas, list) or not all(isinstance(f, dict) for f in faixas):
+        return None, 'faixas deve ser uma lista de faixas ({"acima_de_kwh", "adicional_kwh"}).'
+    for faixa in faixas:
+        tarifa.faixas.append(TarifaFaixa(acima_de_kwh=float(faixa['acima_de_kwh']),
+                                         adicional_kwh=float(faixa['adicional_kwh'])))
+
+    return tarifa, None
+
+
+@app.route('/api/tarifas', methods=['GET'])
+def api_tarifas():
+    """Lista as tarifas cadastradas"""
+    tarifas = Tarifa.query.options(selectinload(Tarifa.periodos), selectinload(Tarifa.faixas))\
+        .order_by(Tarifa.vigencia_inicio.desc(), Tarifa.id).all()
+    return jsonify({'sucesso': True, 'tarifas': [t.to_dict() for t in tarifas]}), 200
+
+
+@app.route('/admin/tarifas/criar', methods=['POST'])
+def criar_tarifa():
+    """Cadastra uma tarifa (JSON com nome, vigencia_inicio, vigencia_fim, quadro_id, periodos e faixas)"""
+    try:
+        tarifa, erro = ler_tarifa(request.get_json(silent=True) or {})
+        if erro:
+            return jsonify({'sucesso': False, 'erro': erro}), 400
+
+        db.session.add(tarifa)
+        marcar_custos_periodo(tarifa.vigencia_inicio, tarifa.vigencia_fim)
+        db.session.commit()
+        agendador_relatorios.notificar()
 
-@app.route('/api/analise/dados', methods=['GET'])
-def api_analise_dados():
-    """Retorna dados de leituras filtrados para análise"""
-    try:
-        # Recebe parâmetros do filtro
-        data_inicio = request.args.get('data_inicio')
-        data_fim = request.args.get('data_fim')
-        quadro_id = request.args.get('quadro_id', type=int)
-        
-        # Monta a query base
-        query = Leitura.query
-        
-        # Aplica filtros
-        if data_inicio:
-            data_inicio_dt = datetime.strptime(data_inicio, '%Y-%m-%d')
-            query = query.filter(Leitura.data_registro >= data_inicio_dt)
-        
-        if data_fim:
-            data_fim_dt = datetime.strptime(data_fim, '%Y-%m-%d')
-            # Adiciona 23:59:59 para incluir todo o dia
-            data_fim_dt = datetime.combine(data_fim_dt.date(), datetime.max.time())
-            query = query.filter(Leitura.data_registro <= data_fim_dt)
-        
-        if quadro_id:
-            query = query.filter(Leitura.quadro_id == quadro_id)
-        
-        # Ordena por data
-        leituras = query.order_by(Leitura.data_registro.asc()).all()
-        
-        # Prepara dados para a tabela
-        tabela_dados = []
-        for leitura in leituras:
-            tabela_dados.append({
-                'id': leitura.id,
-                'quadro_id': leitura.quadro_id,
-                'quadro_nome': leitura.quadro.nome,
-                'quadro_localizacao': leitura.quadro.localizacao,
-                'data_registro': leitura.data_registro.strftime('%d/%m/%Y'),
-                'hora_registro': leitura.data_registro.strftime('%H:%M:%S'),
-                'valor_leitura': round(leitura.valor_leitura, 2),
-                'consumo_dia': round(leitura.consumo_dia, 2) if leitura.consumo_dia else 0,
-                'alerta_reset': leitura.alerta_reset
-            })
-        
-        # Prepara dados para o gráfico
-        # Organiza por data e quadro
-        dados_grafico = {}
-        quadros_dict = {}
-        
-        for leitura in leituras:
-            data_str = leitura.data_registro.strftime('%Y-%m-%d')
-            quadro_nome = leitura.quadro.nome
-            
-            if data_str not in dados_grafico:
-                dados_grafico[data_str] = {}
-            
-            if quadro_nome not in dados_grafico[data_str]:
-                dados_grafico[data_str][quadro_nome] = 0
-            
-            # Soma o consumo do dia
-            if leitura.consumo_dia:
-                dados_grafico[data_str][quadro_nome] += leitura.consumo_dia
-            
-            # Guarda informações do quadro
-            if quadro_nome not in quadros_dict:
-                quadros_dict[quadro_nome] = {
-                    'id': leitura.quadro_id,
-                    'nome': quadro_nome
-                }
-        
-        # Formata dados para Chart.js
-        datas_ordenadas = sorted(dados_grafico.keys())
-        
-        # Dados separados por quadro
-        datasets_separados = []
-        cores = [
-            '#667eea', '#764ba2', '#f093fb', '#4facfe',
-            '#43e97b', '#fa709a', '#fee140', '#30cfd0',
-            '#a8edea', '#fed6e3', '#c471f5', '#12c2e9'
-        ]
-        
-        for idx, (quadro_nome, quadro_info) in enumerate(quadros_dict.items()):
-            dados_quadro = []
-            for data in datas_ordenadas:
-                valor = dados_grafico[data].get(quadro_nome, 0)
-                dados_quadro.append(round(valor, 2))
-            
-            datasets_separados.append({
-                'label': quadro_nome,
-                'data': dados_quadro,
-                'borderColor': cores[idx % len(cores)],
-                'backgroundColor': cores[idx % len(cores)] + '20',
-                'tension': 0.4,
-                'fill': False
-            })
-        
-        # Dados agrupados (soma total por dia)
-        dados_agrupados = []
-        for data in datas_ordenadas:
-            total_dia = sum(dados_grafico[data].values())
-            dados_agrupados.append(round(total_dia, 2))
-        
-        dataset_agrupado = [{
-            'label': 'Consumo Total da Empresa',
-            'data': dados_agrupados,
-            'borderColor': '#667eea',
-            'backgroundColor': 'rgba(102, 126, 234, 0.1)',
-            'tension': 0.4,
-            'fill': True,
-            'borderWidth': 3
-        }]
-        
-        # Formata labels das datas
-        labels = [datetime.strptime(d, '%Y-%m-%d').strftime('%d/%m/%Y') for d in datas_ordenadas]
-        
         return jsonify({
             'sucesso': True,
-            'tabela': tabela_dados,
-            'grafico': {
-                'labels': labels,
-                'datasets_separados': datasets_separados,
-                'dataset_agrupado': dataset_agrupado
-            },
-            'total_registros': len(tabela_dados)
-        }), 200
-        
+            'mensagem': f'Tarifa "{tarifa.nome}" cadastrada.',
+            'tarifa': tarifa.to_dict()
+        }), 201
+
+    except (KeyError, TypeError, ValueError):
+        db.session.rollback()
+        return jsonify({'sucesso': False, 'erro': 'Postos precisam de preco_kwh e faixas de acima_de_kwh e adicional_kwh numéricos.'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'sucesso': False, 'erro': f'Erro ao cadastrar tarifa: {str(e)}'}), 500
+
+
+@app.route('/admin/tarifas/excluir/<int:id>', methods=['POST'])
+def excluir_tarifa(id):
+    """Remove uma tarifa e recalcula os meses da sua vigência"""
+    try:
+        tarifa = Tarifa.query.get(id)
+        if not tarifa:
+            return jsonify({'sucesso': False, 'erro': 'Tarifa não encontrada.'}), 404
+
+        nome = tarifa.nome
+        marcar_custos_periodo(tarifa.vigencia_inicio, tarifa.vigencia_fim)
+        db.session.delete(tarifa)
+        db.session.commit()
+        agendador_relatorios.notificar()
+
+        return jsonify({'sucesso': True, 'mensagem': f'Tarifa "{nome}" excluída.'}), 200
+
     except Exception as e:
+        db.session.rollback()
+        return jsonify({'sucesso': False, 'erro': f'Erro ao excluir tarifa: {str(e)}'}), 500
+
+
+@app.route('/api/custos', methods=['GET'])
+@orcamento_consultas(8)
+def api_custos():
+    """Custo por quadro e mês (e da planta) calculado pelas tarifas vigentes"""
+    try:
+        ano_mes = request.args.get('ano_mes')
+        mes_inicio = request.args.get('de')
+        mes_fim = request.args.get('ate')
+        quadro_id = request.args.get('quadro_id', type=int)
+
+        garantir_custos_atualizados()
+
+        meses = None
+        if ano_mes:
+            meses = [ano_mes]
+        elif mes_inicio or mes_fim:
+            inicio = datetime.strptime((mes_inicio or '2000-01') + '-01', '%Y-%m-%d').date()
+            fim = datetime.strptime((mes_fim or datetime.now().strftime('%Y-%m')) + '-01', '%Y-%m-%d').date()
+            meses = meses_do_periodo(inicio, fim)
+
         return jsonify({
-            'sucesso': False, 
-            'erro': str(e)
-        }), 500
+            'sucesso': True,
+            'custos': obter_custos(meses, quadro_id),
+            'meses_pendentes': [p.ano_mes for p in CustoPendente.query.order_by(CustoPendente.ano_mes).all()]
+        }), 200
 
-# ROTAS DE IMPORTAÇÃO
+    except ValueError:
+        return jsonify({'sucesso': False, 'erro': 'Meses inválidos. Use YYYY-MM.'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'sucesso': False, 'erro': f'Erro ao buscar custos: {str(e)}'}), 500
+
+
+# ========================================
+# FEDERAÇÃO MULTI-SITE
 # ========================================
 
-@app.route('/admin/importacao')
-def importacao():
-    """Página de importação de dados históricos"""
-    # Variáveis para a sidebar
-    ip_local = obter_ip_local()
-    url_mobile = f"http://{ip_local}:5000/registrar"
-    qrcode_img = gerar_qrcode(url_mobile)
-    total_rascunhos = LeituraRascunho.query.count()
-    
-    return render_template('importar.html',
-                         qrcode_img=qrcode_img,
-                         ip_local=ip_local,
-                         total_rascunhos=total_rascunhos)
+_executor_federacao = None
+_executor_federacao_lock = threading.Lock()
 
 
-@app.route('/admin/importacao/modelo')
-def download_modelo():
-    """Gera e retorna modelo de planilha Excel para importação"""
-    # Cria um DataFrame de exemplo
-    df = pd.DataFrame({
-        'Data': ['01/01/2024', '02/01/2024', '03/01/2024'],
-        'Quadro': ['Galpão A', 'Galpão A', 'Escritório'],
-        'Localizacao': ['Área de Produção', 'Área de Produção', 'Prédio Administrativo'],
-        'Leitura': [1000.50, 1025.75, 500.00]
-    })
-    
-    # Cria buffer em memória
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Leituras')
-        
-        # Adiciona instruções em outra aba
-        instrucoes = pd.DataFrame({
-            'Instruções para Importação': [
-                '1. A coluna "Data" deve estar no formato DD/MM/AAAA ou DD/MM/AAAA HH:MM:SS',
-                '2. A coluna "Quadro" é o nome do quadro (será criado automaticamente se não existir)',
-                '3. A coluna "Localizacao" é a localização do quadro (obrigatória para novos quadros)',
-                '4. A coluna "Leitura" é o valor da leitura do medidor em kWh',
-                '5. O sistema calculará automaticamente o consumo com base na diferença entre leituras',
-                '6. Registros duplicados (mesmo quadro e mesma data) serão ignorados',
-                '7. Se um valor de leitura for menor que o anterior, será marcado como "Reset"',
-                '8. Mantenha os dados ordenados por data para melhor precisão'
-            ]
-        })
-        instrucoes.to_excel(writer, index=False, sheet_name='Instruções')
-    
-    output.seek(0)
-    
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name='modelo_importacao_leituras.xlsx'
+def obter_executor_federacao():
+    """Retorna o pool de threads compartilhado das consultas federadas"""
+    global _executor_federacao
+
+    with _executor_federacao_lock:
+        if _executor_federacao is None:
+            _executor_federacao = ThreadPoolExecutor(
+                max_workers=app.config['FEDERACAO_MAX_WORKERS'],
+                thread_name_prefix='federacao'
+            )
+        return _executor_federacao
+
+
+def caminho_banco_local():
+    """Retorna o caminho do arquivo SQLite usado por esta instância"""
+    return db.engine.url.database
+
+
+def abrir_banco_somente_leitura(caminho, cancelado=None):
+    """Abre um energia.db em modo somente leitura (uma conexão por consulta/thread)
+
+    Com 'cancelado' (threading.Event), a consulta em andamento é interrompida
+    quando o evento é sinalizado.
+    """
+    uri = Path(caminho).resolve().as_uri() + '?mode=ro'
+    conn = sqlite3.connect(uri, uri=True, timeout=app.config['FEDERACAO_TIMEOUT'])
+    if cancelado is not None:
+        # O SQLite chama o handler a cada 1000 instruções; retorno diferente de zero aborta a consulta
+        conn.set_progress_handler(lambda: int(cancelado.is_set()), 1000)
+    return conn
+
+
+def formatar_data_sql(valor):
+    """Formata um datetime no mesmo formato de texto que o SQLAlchemy grava no SQLite"""
+    return valor.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def consultar_kpis_banco(caminho, cancelado=None):
+    """Calcula os KPIs do dashboard diretamente em um arquivo energia.db"""
+    hoje = datetime.now().date()
+    inicio_dia = datetime.combine(hoje, datetime.min.time())
+    fim_dia = inicio_dia + timedelta(days=1)
+    tres_meses_atras = datetime.now() - timedelta(days=90)
+
+    conn = abrir_banco_somente_leitura(caminho, cancelado)
+    try:
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            SELECT COALESCE(SUM(consumo_dia), 0) FROM leituras
+            WHERE data_registro >= ? AND data_registro < ? AND consumo_dia IS NOT NULL
+        """, (formatar_data_sql(inicio_dia), formatar_data_sql(fim_dia)))
+        consumo_hoje = cursor.fetchone()[0]
+
+        cursor.execute("""
+            SELECT COALESCE(SUM(consumo_dia), 0) FROM leituras
+            WHERE data_registro >= ? AND consumo_dia IS NOT NULL
+        """, (formatar_data_sql(tres_meses_atras),))
+        consumo_90_dias = cursor.fetchone()[0]
+
+        cursor.execute("SELECT COUNT(*) FROM quadros WHERE ativo = 1")
+        total_quadros = cursor.fetchone()[0]
+
+        cursor.execute("""
+            SELECT COUNT(*) FROM quadros q
+            WHERE q.ativo = 1 AND NOT EXISTS (
+                SELECT 1 FROM leituras l WHERE l.quadro_id = q.id AND l.data_registro >= ?
+            )
+        """, (formatar_data_sql(inicio_dia),))
+        quadros_pendentes = cursor.fetchone()[0]
+
+        try:
+            cursor.execute("SELECT COUNT(*) FROM leituras_rascunho")
+            total_rascunhos = cursor.fetchone()[0]
+        except sqlite3.OperationalError:
+            total_rascunhos = 0  # Banco antigo, sem a tabela de rascunhos
+
+        return {
+            'consumo_hoje': consumo_hoje,
+            'media_3_meses': consumo_90_dias / 90,
+            'total_quadros': total_quadros,
+            'quadros_pendentes': quadros_pendentes,
+            'total_rascunhos': total_rascunhos
+        }
+    finally:
+        conn.close()
+
+
+def consultar_analise_banco(caminho, inicio, fim, cancelado=None):
+    """Calcula a série diária e o consumo por quadro de um período diretamente em um arquivo energia.db"""
+    inicio_dt = datetime.combine(inicio, datetime.min.time())
+    fim_dt = datetime.combine(fim, datetime.min.time()) + timedelta(days=1)
+    parametros = (formatar_data_sql(inicio_dt), formatar_data_sql(fim_dt))
+
+    conn = abrir_banco_somente_leitura(caminho, cancelado)
+    try:
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            SELECT DATE(data_registro) AS dia, COALESCE(SUM(consumo_dia), 0)
+            FROM leituras
+            WHERE data_registro >= ? AND data_registro < ?
+            GROUP BY dia ORDER BY dia
+        """, parametros)
+        consumo_por_dia = {dia: consumo for dia, consumo in cursor.fetchall()}
+
+        cursor.execute("""
+            SELECT q.nome, q.localizacao, COALESCE(SUM(l.consumo_dia), 0), COUNT(l.id)
+            FROM leituras l JOIN quadros q ON q.id = l.quadro_id
+            WHERE l.data_registro >= ? AND l.data_registro < ?
+            GROUP BY q.id ORDER BY 3 DESC
+        """, parametros)
+        quadros = [
+            {'nome': nome, 'localizacao': localizacao, 'consumo': consumo, 'total_registros': registros}
+            for nome, localizacao, consumo, registros in cursor.fetchall()
+        ]
+
+        return {
+            'consumo_por_dia': consumo_por_dia,
+            'quadros': quadros
+        }
+    finally:
+        conn.close()
+
+
+def consultar_instancia(url, caminho, parametros=None):
+    """Consulta a API de federação de outra instância do sistema via HTTP"""
+    endereco = url.rstrip('/') + caminho
+    if parametros:
+        endereco += '?' + urllib.parse.urlencode(parametros)
+
+    with urllib.request.urlopen(endereco, timeout=app.config['FEDERACAO_TIMEOUT']) as resposta:
+        dados = json.loads(resposta.read().decode('utf-8'))
+
+    if not dados.get('sucesso'):
+        raise RuntimeError(dados.get('erro', 'Resposta inválida da instância'))
+    return dados['dados']
+
+
+def listar_sites_consulta():
+    """Lista os sites consultados: este site e os sites federados ativos"""
+    sites = [{'nome': 'Este site', 'caminho_banco': caminho_banco_local(), 'url': None}]
+    sites.extend(
+        {'nome': s.nome, 'caminho_banco': s.caminho_banco, 'url': s.url}
+        for s in SiteFederado.query.filter_by(ativo=True).order_by(SiteFederado.nome).all()
     )
+    return sites
 
 
-@app.route('/admin/importacao/processar', methods=['POST'])
-def processar_importacao():
-    """Processa arquivo Excel de importação de dados históricos"""
+def executar_em_sites(sites, consulta_banco, caminho_api, argumentos=(), parametros=None):
+    """Executa a mesma consulta em todos os sites em paralelo e devolve o resultado de cada um"""
+    executor = obter_executor_federacao()
+    cancelado = threading.Event()  # Sinalizado no tempo esgotado: consultas ainda na fila nem começam
+
+    def consultar(site):
+        if cancelado.is_set():
+            raise RuntimeError('Consulta cancelada antes de começar')
+        inicio = time.perf_counter()
+        if site['url']:
+            dados = consultar_instancia(site['url'], caminho_api, parametros)
+        else:
+            dados = consulta_banco(site['caminho_banco'], *argumentos, cancelado=cancelado)
+        return dados, (time.perf_counter() - inicio) * 1000
+
+    futuros = {executor.submit(consultar, site): site for site in sites}
+    wait(futuros, timeout=app.config['FEDERACAO_TIMEOUT'])
+    cancelado.set()
+
+    resultados = []
+    for futuro, site in futuros.items():
+        resultado = {'site': site['nome'], 'sucesso': False, 'dados': None, 'tempo_ms': None, 'erro': None}
+
+        if not futuro.done():
+            # Future.cancel() só funciona para o que ainda está na fila; uma consulta a banco já
+            # em andamento para pelo evento 'cancelado', e uma consulta HTTP só no timeout dela
+            if futuro.cancel():
+                resultado['erro'] = 'Tempo esgotado (consulta cancelada antes de começar)'
+            elif site['url']:
+                resultado['erro'] = 'Tempo esgotado (a consulta HTTP em andamento não pode ser cancelada; o resultado será descartado)'
+            else:
+                resultado['erro'] = 'Tempo esgotado (consulta ao banco em andamento interrompida)'
+        elif futuro.exception():
+            resultado['erro'] = str(futuro.exception())
+        else:
+            resultado['dados'], tempo_ms = futuro.result()
+            resultado['tempo_ms'] = round(tempo_ms, 1)
+            resultado['sucesso'] = True
+
+        resultados.append(resultado)
+
+    return resultados
+
+
+@app.route('/api/federacao/sites', methods=['GET'])
+def api_federacao_sites():
+    """Lista os sites federados cadastrados"""
+    sites = SiteFederado.query.order_by(SiteFederado.nome).all()
+    return jsonify({
+        'sucesso': True,
+        'sites': [s.to_dict() for s in sites]
+    })
+
+
+@app.route('/admin/federacao/sites/criar', methods=['POST'])
+def criar_site_federado():
+    """Cadastra um site federado (arquivo energia.db ou URL de outra instância)"""
     try:
-        # Verifica se arquivo foi enviado
-        if 'arquivo' not in request.files:
-            return jsonify({
-                'sucesso': False,
-                'erro': 'Nenhum arquivo foi enviado.'
-            }), 400
-        
-        arquivo = request.files['arquivo']
-        
-        if arquivo.filename == '':
+        nome = request.form.get('nome', '').strip()
+        caminho_banco = request.form.get('caminho_banco', '').strip() or None
+        url = request.form.get('url', '').strip() or None
+
+        if not nome or bool(caminho_banco) == bool(url):
             return jsonify({
                 'sucesso': False,
-                'erro': 'Nenhum arquivo selecionado.'
+                'erro': 'Informe o nome e apenas um entre caminho do banco ou URL.'
             }), 400
-        
-        if not arquivo.filename.endswith(('.xlsx', '.xls')):
+
+        if caminho_banco and not os.path.isfile(caminho_banco):
             return jsonify({
                 'sucesso': False,
-                'erro': 'Formato inválido. Use arquivos .xlsx ou .xls'
+                'erro': 'Arquivo de banco de dados não encontrado.'
             }), 400
-        
-        # Salva arquivo temporariamente
-        filename = secure_filename(arquivo.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        arquivo.save(filepath)
-        
-        # Lê o arquivo Excel
-        try:
-            df = pd.read_excel(filepath, sheet_name=0)
-        except Exception as e:
-            os.remove(filepath)
+
+        if SiteFederado.query.filter_by(nome=nome).first():
             return jsonify({
                 'sucesso': False,
-                'erro': f'Erro ao ler arquivo Excel: {str(e)}'
+                'erro': 'Já existe um site com este nome.'
             }), 400
-        
-        # Valida colunas obrigatórias
-        colunas_obrigatorias = ['Data', 'Quadro', 'Localizacao', 'Leitura']
-        colunas_faltantes = [col for col in colunas_obrigatorias if col not in df.columns]
-        
-        if colunas_faltantes:
-            os.remove(filepath)
+
+        novo_site = SiteFederado(nome=nome, caminho_banco=caminho_banco, url=url, ativo=True)
+        db.session.add(novo_site)
+        db.session.commit()
+
+        return jsonify({
+            'sucesso': True,
+            'mensagem': f'Site "{nome}" cadastrado com sucesso!',
+            'site': novo_site.to_dict()
+        }), 201
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro ao cadastrar site: {str(e)}'
+        }), 500
+
+
+@app.route('/admin/federacao/sites/excluir/<int:id>', methods=['POST'])
+def excluir_site_federado(id):
+    """Remove um site federado"""
+    try:
+        site = SiteFederado.query.get(id)
+
+        if not site:
             return jsonify({
                 'sucesso': False,
-                'erro': f'Colunas obrigatórias faltando: {", ".join(colunas_faltantes)}'
-            }), 400
-        
-        # Processa importação
-        resultado = processar_dados_importacao(df)
-        
-        # Remove arquivo temporário
-        os.remove(filepath)
-        
-        if resultado['sucesso']:
-            return jsonify(resultado), 200
-        else:
-            return jsonify(resultado), 400
-        
+                'erro': 'Site não encontrado.'
+            }), 404
+
+        nome_site = site.nome
+        db.session.delete(site)
+        db.session.commit()
+
+        return jsonify({
+            'sucesso': True,
+            'mensagem': f'Site "{nome_site}" foi removido da federação.'
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro ao remover site: {str(e)}'
+        }), 500
+
+
+@app.route('/api/federacao/local/kpis', methods=['GET'])
+def api_federacao_local_kpis():
+    """KPIs deste site, consultados por outras instâncias da federação"""
+    try:
+        return jsonify({
+            'sucesso': True,
+            'dados': consultar_kpis_banco(caminho_banco_local())
+        })
+    except Exception as e:
+        return jsonify({
+            'sucesso': False,
+            'erro': str(e)
+        }), 500
+
+
+@app.route('/api/federacao/local/analise', methods=['GET'])
+def api_federacao_local_analise():
+    """Dados de análise deste site, consultados por outras instâncias da federação"""
+    try:
+        inicio = datetime.strptime(request.args['data_inicio'], '%Y-%m-%d').date()
+        fim = datetime.strptime(request.args['data_fim'], '%Y-%m-%d').date()
+        return jsonify({
+            'sucesso': True,
+            'dados': consultar_analise_banco(caminho_banco_local(), inicio, fim)
+        })
     except Exception as e:
         return jsonify({
             'sucesso': False,
-            'erro': f'Erro ao processar importação: {str(e)}'
+            'erro': str(e)
         }), 500
 
 
-def processar_dados_importacao(df):
-    """Processa o DataFrame e importa os dados para o banco"""
-    registros_inseridos = 0
-    registros_duplicados = 0
-    quadros_criados = []
-    erros = []
-    
+@app.route('/api/federacao/kpis', methods=['GET'])
+def api_federacao_kpis():
+    """KPIs do dashboard de todos os sites, consultados em paralelo e somados"""
     try:
-        # Remove linhas com dados vazios
-        df = df.dropna(subset=['Data', 'Quadro', 'Leitura'])
-        
-        # Agrupa por quadro para processar separadamente
-        quadros_processados = {}
-        
-        for index, row in df.iterrows():
-            try:
-                # Converte data
-                if isinstance(row['Data'], str):
-                    # Tenta vários formatos de data
-                    for fmt in ['%d/%m/%Y', '%d/%m/%Y %H:%M:%S', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S']:
-                        try:
-                            data_leitura = datetime.strptime(row['Data'], fmt)
-                            break
-                        except ValueError:
-                            continue
-                    else:
-                        raise ValueError(f"Formato de data inválido: {row['Data']}")
-                else:
-                    data_leitura = pd.to_datetime(row['Data'])
-                
-                nome_quadro = str(row['Quadro']).strip()
-                localizacao = str(row['Localizacao']).strip()
-                valor_leitura = float(row['Leitura'])
-                
-                # Busca ou cria o quadro
-                quadro = Quadro.query.filter_by(nome=nome_quadro).first()
-                
-                if not quadro:
-                    quadro = Quadro(
-                        nome=nome_quadro,
-                        localizacao=localizacao,
-                        ativo=True
-                    )
-                    db.session.add(quadro)
-                    db.session.flush()  # Obtém o ID sem commitar
-                    quadros_criados.append(nome_quadro)
-                
-                # Verifica duplicata (mesma data e quadro)
-                data_inicio = data_leitura.replace(hour=0, minute=0, second=0)
-                data_fim = data_leitura.replace(hour=23, minute=59, second=59)
-                
-                existe = Leitura.query.filter(
-                    Leitura.quadro_id == quadro.id,
-                    Leitura.data_registro >= data_inicio,
-                    Leitura.data_registro <= data_fim
-                ).first()
-                
-                if existe:
-                    registros_duplicados += 1
-                    continue
-                
-                # Cria leitura temporária (consumo será calculado depois)
-                nova_leitura = Leitura(
-                    quadro_id=quadro.id,
-                    data_registro=data_leitura,
-                    valor_leitura=valor_leitura,
-                    consumo_dia=0,  # Será recalculado
-                    alerta_reset=False
-                )
-                
-                db.session.add(nova_leitura)
-                registros_inseridos += 1
-                
-                # Marca quadro para recálculo
-                quadros_processados[quadro.id] = True
-                
-            except Exception as e:
-                erros.append(f"Linha {index + 2}: {str(e)}")
-        
-        # Comita as inserções
-        db.session.commit()
-        
-        # Recalcula consumo para cada quadro processado
-        for quadro_id in quadros_processados.keys():
-            recalcular_consumo_quadro(quadro_id)
-        
-        return {
+        inicio = time.perf_counter()
+        resultados = executar_em_sites(listar_sites_consulta(), consultar_kpis_banco, '/api/federacao/local/kpis')
+
+        campos = ['consumo_hoje', 'media_3_meses', 'total_quadros', 'quadros_pendentes', 'total_rascunhos']
+        totais = {campo: 0 for campo in campos}
+        for resultado in resultados:
+            if resultado['sucesso']:
+                for campo in campos:
+                    totais[campo] += resultado['dados'][campo]
+
+        return jsonify({
             'sucesso': True,
-            'mensagem': 'Importação concluída com sucesso!',
-            'detalhes': {
-                'registros_inseridos': registros_inseridos,
-                'registros_duplicados': registros_duplicados,
-                'quadros_criados': quadros_criados,
-                'erros': erros
-            }
-        }
-        
+            'totais': {campo: round(valor, 2) for campo, valor in totais.items()},
+            'sites': resultados,
+            'tempo_total_ms': round((time.perf_counter() - inicio) * 1000, 1)
+        }), 200
+
     except Exception as e:
-        db.session.rollback()
-        return {
+        return jsonify({
             'sucesso': False,
-            'erro': f'Erro durante importação: {str(e)}'
-        }
+            'erro': f'Erro na consulta federada: {str(e)}'
+        }), 500
 
 
-def recalcular_consumo_quadro(quadro_id):
-    """Recalcula o consumo para todas as leituras de um quadro"""
-    # Busca todas as leituras do quadro ordenadas por data
-    leituras = Leitura.query.filter_by(quadro_id=quadro_id)\
-        .order_by(Leitura.data_registro.asc()).all()
-    
-    leitura_anterior = None
-    
-    for leitura in leituras:
-        if leitura_anterior is None:
-            # Primeira leitura: consumo = 0
-            leitura.consumo_dia = 0
-            leitura.alerta_reset = False
-        else:
-            if leitura.valor_leitura >= leitura_anterior.valor_leitura:
-                # Consumo normal
-                leitura.consumo_dia = leitura.valor_leitura - leitura_anterior.valor_leitura
-                leitura.alerta_reset = False
-            else:
-                # Reset detectado (medidor virou)
-                leitura.consumo_dia = leitura.valor_leitura
-                leitura.alerta_reset = True
-        
-        leitura_anterior = leitura
-    
-    # Salva as alterações no banco de dados
-    db.session.commit()
+@app.route('/api/federacao/analise', methods=['GET'])
+def api_federacao_analise():
+    """Consumo diário e por quadro de todos os sites em um período, consultados em paralelo"""
+    try:
+        data_inicio = request.args.get('data_inicio')
+        data_fim = request.args.get('data_fim')
+        fim = datetime.strptime(data_fim, '%Y-%m-%d').date() if data_fim else datetime.now().date()
+        inicio_periodo = datetime.strptime(data_inicio, '%Y-%m-%d').date() if data_inicio else fim - timedelta(days=30)
+
+        inicio = time.perf_counter()
+        resultados = executar_em_sites(
+            listar_sites_consulta(), consultar_analise_banco, '/api/federacao/local/analise',
+            argumentos=(inicio_periodo, fim),
+            parametros={'data_inicio': inicio_periodo.strftime('%Y-%m-%d'), 'data_fim': fim.strftime('%Y-%m-%d')}
+        )
+        sucessos = [r for r in resultados if r['sucesso']]
+
+        # Une as datas de todos os sites para montar o gráfico
+        datas = sorted({dia for r in sucessos for dia in r['dados']['consumo_por_dia']})
+        total_por_dia = {dia: 0 for dia in datas}
+
+        cores = [
+            '#667eea', '#764ba2', '#f093fb', '#4facfe',
+            '#43e97b', '#fa709a', '#fee140', '#30cfd0'
+        ]
+        datasets_sites = []
+
+        for idx, resultado in enumerate(sucessos):
+            consumo_por_dia = resultado['dados']['consumo_por_dia']
+            for dia, consumo in consumo_por_dia.items():
+                total_por_dia[dia] += consumo
+
+            resultado['consumo_total'] = round(sum(consumo_por_dia.values()), 2)
+            datasets_sites.append({
+                'label': resultado['site'],
+                'data': [round(consumo_por_dia.get(dia, 0), 2) for dia in datas],
+                'borderColor': cores[idx % len(cores)],
+                'backgroundColor': cores[idx % len(cores)] + '20',
+                'tension': 0.4,
+                'fill': False
+            })
+
+        return jsonify({
+            'sucesso': True,
+            'grafico': {
+                'labels': [datetime.strptime(d, '%Y-%m-%d').strftime('%d/%m/%Y') for d in datas],
+                'datasets_sites': datasets_sites,
+                'total': [round(total_por_dia[dia], 2) for dia in datas]
+            },
+            'consumo_total': round(sum(total_por_dia.values()), 2),
+            'sites': [
+                {
+                    'site': r['site'],
+                    'sucesso': r['sucesso'],
+                    'erro': r['erro'],
+                    'tempo_ms': r['tempo_ms'],
+                    'consumo_total': r.get('consumo_total'),
+                    'quadros': r['dados']['quadros'] if r['sucesso'] else []
+                }
+                for r in resultados
+            ],
+            'tempo_total_ms': round((time.perf_counter() - inicio) * 1000, 1)
+        }), 200
+
+    except Exception as e:
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro na consulta federada: {str(e)}'
+        }), 500
 
 
 # ========================================
-# API: CONTROLE DE SESSÃO DE LEITURA
+# INGESTÃO DE MEDIDORES (API PARA MÁQUINAS)
 # ========================================
 
-@app.route('/api/sessao/iniciar', methods=['POST'])
-def api_sessao_iniciar():
-    """Inicia uma nova sessão de leitura"""
+def hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class GravadorLeituras:
+    """Thread que grava em lote (group commit) as leituras recebidas pela API de ingestão
+
+    As requisições só enfileiram; a thread junta o que chegou em até
+    INGESTAO_INTERVALO_MS (ou INGESTAO_LOTE_MAX leituras) e grava tudo em uma
+    única transação, calculando o consumo com a mesma regra de reset de
+    recalcular_consumo_quadro.
+    """
+
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self._fila = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._alteracoes_pendentes = set()
+        self._gravando = False
+        self._leituras_na_fila = 0
+        self._ultimo_pos_processamento = time.monotonic()
+        self.estatisticas = {
+            'recebidas': 0, 'gravadas': 0, 'com_reset': 0, 'fora_de_ordem': 0,
+            'lotes': 0, 'maior_lote': 0, 'tempo_gravacao': 0.0, 'erros': 0, 'ultimo_erro': None
+        }
+
+    @property
+    def ativo(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def iniciar(self):
+        """Inicia a thread de gravação (apenas uma vez por processo)"""
+        with self._lock:
+            if self.ativo:
+                return
+            self._thread = threading.Thread(target=self._executar, name='gravador-leituras', daemon=True)
+            self._thread.start()
+
+    def enfileirar(self, leituras, token_id=None):
+        """Enfileira [(quadro_id, data_registro, valor)]; o Future devolvido termina após o commit (ou com o erro)"""
+        self.iniciar()
+        gravado = Future()
+        with self._lock:
+            self.estatisticas['recebidas'] += len(leituras)
+            self._leituras_na_fila += len(leituras)
+        self._fila.put((leituras, token_id, gravado))
+        return gravado
+
+    def tamanho_fila(self):
+        """Leituras aceitas que ainda não foram gravadas"""
+        return self._leituras_na_fila
+
+    def fila_cheia(self):
+        return self._leituras_na_fila >= self.app.config['INGESTAO_FILA_MAX']
+
+    def aguardar_fila(self, timeout=10):
+        """Espera a fila esvaziar (usado ao encerrar o servidor para não perder leituras aceitas)"""
+        limite = time.monotonic() + timeout
+        while self.ativo and (self._gravando or self._leituras_na_fila) and time.monotonic() < limite:
+            time.sleep(0.05)
+
+    def _coletar_lote(self):
+        """Espera a primeira remessa e junta as que chegarem dentro da janela do group commit
+
+        Devolve lista vazia se a fila ficar parada por 1 s (momento de descarregar o pós-processamento).
+        """
+        try:
+            remessas = [self._fila.get(timeout=1)]
+        except queue.Empty:
+            return []
+        total = len(remessas[0][0])
+        limite = time.monotonic() + self.app.config['INGESTAO_INTERVALO_MS'] / 1000
+
+        while total < self.app.config['INGESTAO_LOTE_MAX']:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                remessa = self._fila.get(timeout=restante)
+            except queue.Empty:
+                break
+            remessas.append(remessa)
+            total += len(remessa[0])
+
+        with self._lock:
+            self._leituras_na_fila -= total
+        return remessas
+
+    def _executar(self):
+        while True:
+            remessas = self._coletar_lote()
+            self._gravando = bool(remessas)
+            with self.app.app_context():
+                try:
+                    if not remessas:
+                        self._pos_processar(forcar=True)
+                        continue
+                    try:
+                        self._gravar([l for leituras, _, _ in remessas for l in leituras],
+                                     {token_id for _, token_id, _ in remessas if token_id})
+                        erros = [None] * len(remessas)
+                    except Exception as e:
+                        db.session.rollback()
+                        self._registrar_erro(e)
+                        # Group commit falhou: grava cada remessa sozinha, para que uma remessa
+                        # ruim não descarte as leituras válidas das outras
+                        erros = [e] if len(remessas) == 1 else [self._gravar_remessa(remessa) for remessa in remessas]
+
+                    for (_, _, gravado), erro in zip(remessas, erros):
+                        if erro is None:
+                            gravado.set_result(True)
+                        else:
+                            gravado.set_exception(erro)
+                    self._pos_processar()
+                except Exception as e:
+                    db.session.rollback()
+                    self._registrar_erro(e)
+                finally:
+                    db.session.remove()
+                    self._gravando = False
+                    for _, _, gravado in remessas:
+                        if not gravado.done():
+                            gravado.set_exception(RuntimeError('Gravação interrompida'))
+
+    def _gravar_remessa(self, remessa):
+        """Grava uma remessa isolada; devolve o erro (None se gravou)"""
+        leituras, token_id, _ = remessa
+        try:
+            self._gravar(leituras, {token_id} if token_id else set())
+            return None
+        except Exception as e:
+            db.session.rollback()
+            self._registrar_erro(e)
+            return e
+
+    def _registrar_erro(self, erro):
+        with self._lock:
+            self.estatisticas['erros'] += 1
+            self.estatisticas['ultimo_erro'] = str(erro)
+        print(f"⚠️ Erro ao gravar leituras da ingestão: {erro}")
+
+    def _gravar(self, leituras, token_ids):
+        inicio = time.perf_counter()
+
+        por_quadro = {}
+        for quadro_id, data_registro, valor in leituras:
+            por_quadro.setdefault(quadro_id, []).append((data_registro, valor))
+
+        ultimas = ultimas_leituras_por_quadro(list(por_quadro))
+        linhas = []
+        alteracoes = set()
+        fora_de_ordem = 0
+
+        for quadro_id, novas in por_quadro.items():
+            novas.sort(key=lambda item: item[0])
+            anterior = ultimas.get(quadro_id)
+            valor_anterior = anterior.valor_leitura if anterior else None
+
+            # (data, ordem, valor, leitura existente): existentes vêm antes das novas no mesmo horário
+            sequencia = [(data_registro, 1, valor, None) for data_registro, valor in novas]
+
+            # Leituras mais antigas que a última gravada: recalcula só o trecho a partir da mais antiga
+            if anterior and novas[0][0] < anterior.data_registro:
+                fora_de_ordem += 1
+                posteriores = Leitura.query.filter(Leitura.quadro_id == quadro_id)\
+                    .filter(Leitura.data_registro >= novas[0][0]).all()
+                antes = Leitura.query.filter(Leitura.quadro_id == quadro_id)\
+                    .filter(Leitura.data_registro < novas[0][0])\
+                    .order_by(Leitura.data_registro.desc(), Leitura.id.desc()).first()
+                valor_anterior = antes.valor_leitura if antes else None
+                sequencia += [(l.data_registro, 0, l.valor_leitura, l) for l in posteriores]
+                sequencia.sort(key=lambda item: (item[0], item[1], item[3].id if item[3] else 0))
+
+            for data_registro, _, valor, leitura in sequencia:
+                consumo, reset = calcular_consumo(valor, valor_anterior)
+                valor_anterior = valor
+
+                if leitura is None:
+                    linhas.append({
+                        'quadro_id': quadro_id,
+                        'data_registro': data_registro,
+                        'valor_leitura': valor,
+                        'consumo_dia': consumo,
+                        'alerta_reset': reset
+                    })
+                elif (leitura.consumo_dia, leitura.alerta_reset) != (consumo, reset):
+                    leitura.consumo_dia = consumo
+                    leitura.alerta_reset = reset
+                else:
+                    continue
+                alteracoes.add((quadro_id, data_registro.date()))
+
+        db.session.execute(Leitura.__table__.insert(), linhas)
+        if token_ids:
+            TokenIngestao.query.filter(TokenIngestao.id.in_(token_ids))\
+                .update({'ultimo_uso': datetime.now()}, synchronize_session=False)
+
+        registrar_alteracao_leituras(alteracoes)
+        db.session.commit()
+
+        with self._lock:
+            self.estatisticas['gravadas'] += len(linhas)
+            self.estatisticas['com_reset'] += sum(1 for linha in linhas if linha['alerta_reset'])
+            self.estatisticas['fora_de_ordem'] += fora_de_ordem
+            self.estatisticas['lotes'] += 1
+            self.estatisticas['maior_lote'] = max(self.estatisticas['maior_lote'], len(linhas))
+            self.estatisticas['tempo_gravacao'] += time.perf_counter() - inicio
+            self._alteracoes_pendentes |= alteracoes
+
+    def _pos_processar(self, forcar=False):
+        """Linhas base, previsões e relatórios: no máximo a cada INGESTAO_POS_PROCESSAMENTO_S ou quando a fila esvazia"""
+        if not forcar and time.monotonic() - self._ultimo_pos_processamento < self.app.config['INGESTAO_POS_PROCESSAMENTO_S']:
+            return
+        with self._lock:
+            pendentes, self._alteracoes_pendentes = self._alteracoes_pendentes, set()
+        self._ultimo_pos_processamento = time.monotonic()
+        if pendentes:
+            processar_apos_alteracao(pendentes)
+
+
+gravador_leituras = GravadorLeituras(app)
+atexit.register(gravador_leituras.aguardar_fila)
+
+
+def autenticar_ingestao():
+    """Valida o token enviado em 'Authorization: Bearer ...' ou 'X-Token-Ingestao'"""
+    cabecalho = request.headers.get('Authorization', '')
+    token = cabecalho[7:].strip() if cabecalho.lower().startswith('bearer ') else request.headers.get('X-Token-Ingestao', '')
+    if not token:
+        return None
+    return TokenIngestao.query.filter_by(token_hash=hash_token(token), ativo=True).first()
+
+
+def ler_data_ingestao(valor):
+    """Aceita data ISO (2026-01-31T08:00:00, com ou sem fuso) ou epoch em segundos; vazio = agora
+
+    As leituras são gravadas no horário local sem fuso: datas com fuso (ex.: 'Z'
+    ou '+00:00') são convertidas para o horário local.
+    """
+    if valor is None or valor == '':
+        return datetime.now()
+    if isinstance(valor, (int, float)) or str(valor).replace('.', '', 1).isdigit():
+        return datetime.fromtimestamp(float(valor))
+    texto = str(valor)
+    data = datetime.fromisoformat(texto[:-1] + '+00:00' if texto.endswith('Z') else texto)
+    if data.tzinfo is not None:
+        data = data.astimezone().replace(tzinfo=None)
+    return data
+
+
+def ler_corpo_ingestao():
+    """Lê o lote do corpo: JSON ({'leituras': [...]} ou lista) ou CSV com cabeçalho quadro_id,valor,data"""
+    if request.mimetype == 'text/csv':
+        texto = request.get_data(as_text=True)
+        return list(csv.DictReader(io.StringIO(texto)))
+
+    dados = request.get_json(silent=True)
+    if isinstance(dados, dict):
+        dados = dados.get('leituras')
+    if not isinstance(dados, list):
+        raise ValueError('Envie uma lista de leituras em JSON ou um CSV (quadro_id,valor,data).')
+    return dados
+
+
+@app.route('/api/ingestao/leituras', methods=['POST'])
+@orcamento_consultas(2)
+def api_ingestao_leituras():
+    """Recebe um lote de leituras de medidores e enfileira para gravação em grupo"""
+    token = autenticar_ingestao()
+    if not token:
+        return jsonify({
+            'sucesso': False,
+            'erro': 'Token de ingestão ausente ou inválido.'
+        }), 401
+
     try:
-        # Verifica se já existe uma sessão ativa
-        sessao_ativa = SessaoLeitura.query.filter_by(ativa=True).first()
-        if sessao_ativa:
-            return jsonify({
-                'sucesso': False,
-                'mensagem': 'Já existe uma sessão ativa'
-            }), 400
-        
-        # Recebe data de referência (data que está sendo registrada)
-        data_str = request.form.get('data_referencia') or request.json.get('data_referencia') if request.is_json else None
-        
-        if data_str:
+        itens = ler_corpo_ingestao()
+    except ValueError as e:
+        return jsonify({'sucesso': False, 'erro': str(e)}), 400
+
+    # Gravador atrasado: o medidor deve reenviar o lote depois (sem crescer a memória sem limite)
+    if gravador_leituras.fila_cheia():
+        resposta = jsonify({
+            'sucesso': False,
+            'erro': 'Fila de gravação cheia, tente novamente em instantes.'
+        })
+        resposta.headers['Retry-After'] = '1'
+        return resposta, 503
+
+    if len(itens) > app.config['INGESTAO_MAX_POR_REQUISICAO']:
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Máximo de {app.config["INGESTAO_MAX_POR_REQUISICAO"]} leituras por requisição.'
+        }), 413
+
+    quadros_ativos = {q for (q,) in db.session.query(Quadro.id).filter(Quadro.ativo == True).all()}
+    aceitas = []
+    rejeitadas = []
+
+    for posicao, item in enumerate(itens):
+        try:
+            quadro_id = int(item.get('quadro_id'))
+            valor = float(item.get('valor', item.get('valor_leitura')))
+            data_registro = ler_data_ingestao(item.get('data', item.get('data_registro')))
+        except (TypeError, ValueError, AttributeError):
+            rejeitadas.append({'posicao': posicao, 'erro': 'quadro_id, valor ou data inválidos'})
+            continue
+
+        if quadro_id not in quadros_ativos:
+            rejeitadas.append({'posicao': posicao, 'erro': f'Quadro {quadro_id} não encontrado ou inativo'})
+            continue
+
+        aceitas.append((quadro_id, data_registro, valor))
+
+    if aceitas:
+        gravado = gravador_leituras.enfileirar(aceitas, token.id)
+        # ?aguardar=1: só responde depois do commit do lote (ou com o erro da gravação)
+        if request.args.get('aguardar', '').lower() in ('1', 'true', 'sim'):
             try:
-                # Converte string para date
-                data_referencia = datetime.strptime(data_str, '%Y-%m-%d').date()
-            except ValueError:
+                gravado.result(timeout=30)
+            except FuturoEsgotado:
+                pass  # Continua na fila: responde 202 como sem ?aguardar
+            except Exception as e:
                 return jsonify({
                     'sucesso': False,
-                    'mensagem': 'Formato de data inválido. Use YYYY-MM-DD'
-                }), 400
-        else:
-            # Se não informada, usa a data de hoje
-            data_referencia = datetime.now().date()
-        
-        # Limpa todos os rascunhos antes de iniciar nova sessão
-        rascunhos_deletados = LeituraRascunho.query.delete()
-        
-        # Cria nova sessão
-        nova_sessao = SessaoLeitura(
-            ativa=True, 
-            iniciada_por='Supervisor',
-            data_referencia=data_referencia
-        )
-        db.session.add(nova_sessao)
+                    'erro': f'Erro ao gravar as leituras: {str(e)}'
+                }), 500
+
+    return jsonify({
+        'sucesso': True,
+        'aceitas': len(aceitas),
+        'rejeitadas': rejeitadas,
+        'fila': gravador_leituras.tamanho_fila()
+    }), 202
+
+
+@app.route('/api/ingestao/estatisticas', methods=['GET'])
+def api_ingestao_estatisticas():
+    """Contadores do gravador em lote da ingestão"""
+    with gravador_leituras._lock:
+        estatisticas = dict(gravador_leituras.estatisticas)
+
+    lotes = estatisticas['lotes']
+    return jsonify({
+        'sucesso': True,
+        'ativo': gravador_leituras.ativo,
+        'fila': gravador_leituras.tamanho_fila(),
+        'recebidas': estatisticas['recebidas'],
+        'gravadas': estatisticas['gravadas'],
+        'com_reset': estatisticas['com_reset'],
+        'fora_de_ordem': estatisticas['fora_de_ordem'],
+        'lotes': lotes,
+        'maior_lote': estatisticas['maior_lote'],
+        'media_por_lote': round(estatisticas['gravadas'] / lotes, 1) if lotes else 0,
+        'tempo_medio_lote_ms': round(estatisticas['tempo_gravacao'] * 1000 / lotes, 2) if lotes else 0,
+        'erros': estatisticas['erros'],
+        'ultimo_erro': estatisticas['ultimo_erro']
+    }), 200
+
+
+@app.route('/api/ingestao/tokens', methods=['GET'])
+def api_tokens_ingestao():
+    """Lista os tokens de ingestão cadastrados (sem o valor do token)"""
+    tokens = TokenIngestao.query.order_by(TokenIngestao.nome).all()
+    return jsonify({
+        'sucesso': True,
+        'tokens': [t.to_dict() for t in tokens]
+    }), 200
+
+
+@app.route('/admin/ingestao/tokens/criar', methods=['POST'])
+def criar_token_ingestao():
+    """Gera um token para um medidor/gateway (o valor só é mostrado nesta resposta)"""
+    try:
+        nome = request.form.get('nome', '').strip()
+
+        if not nome:
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Informe o nome do medidor ou gateway.'
+            }), 400
+
+        if TokenIngestao.query.filter_by(nome=nome).first():
+            return jsonify({
+                'sucesso': False,
+                'erro': 'Já existe um token com este nome.'
+            }), 400
+
+        token = secrets.token_urlsafe(32)
+        novo_token = TokenIngestao(nome=nome, token_hash=hash_token(token), ativo=True)
+        db.session.add(novo_token)
         db.session.commit()
-        
+
         return jsonify({
             'sucesso': True,
-            'mensagem': f'Sessão iniciada para {data_referencia.strftime("%d/%m/%Y")}. {rascunhos_deletados} rascunho(s) removido(s).',
-            'sessao': nova_sessao.to_dict()
-        })
-        
+            'mensagem': f'Token "{nome}" criado. Guarde o valor: ele não será mostrado novamente.',
+            'token': token,
+            'registro': novo_token.to_dict()
+        }), 201
+
     except Exception as e:
         db.session.rollback()
         return jsonify({
             'sucesso': False,
-            'mensagem': f'Erro ao iniciar sessão: {str(e)}'
+            'erro': f'Erro ao criar token: {str(e)}'
         }), 500
 
 
-@app.route('/api/sessao/encerrar', methods=['POST'])
-def api_sessao_encerrar():
-    """Encerra a sessão ativa e deleta todos os rascunhos (Opção A)"""
+@app.route('/admin/ingestao/tokens/excluir/<int:id>', methods=['POST'])
+def excluir_token_ingestao(id):
+    """Revoga um token de ingestão"""
     try:
-        # Busca sessão ativa
-        sessao_ativa = SessaoLeitura.query.filter_by(ativa=True).first()
-        if not sessao_ativa:
+        token = TokenIngestao.query.get(id)
+
+        if not token:
             return jsonify({
                 'sucesso': False,
-                'mensagem': 'Não há sessão ativa'
-            }), 400
-        
-        # Encerra sessão
-        sessao_ativa.ativa = False
-        sessao_ativa.data_fim = datetime.now()
-        
-        # OPÇÃO A: Deleta todos os rascunhos
-        rascunhos_deletados = LeituraRascunho.query.delete()
-        
+                'erro': 'Token não encontrado.'
+            }), 404
+
+        nome = token.nome
+        db.session.delete(token)
         db.session.commit()
-        
+
         return jsonify({
             'sucesso': True,
-            'mensagem': f'Sessão encerrada e {rascunhos_deletados} rascunhos deletados',
-            'rascunhos_deletados': rascunhos_deletados
-        })
-        
+            'mensagem': f'Token "{nome}" revogado.'
+        }), 200
+
     except Exception as e:
         db.session.rollback()
         return jsonify({
             'sucesso': False,
-            'mensagem': f'Erro ao encerrar sessão: {str(e)}'
+            'erro': f'Erro ao revogar token: {str(e)}'
         }), 500
 
 
-@app.route('/api/sessao/status', methods=['GET'])
-def api_sessao_status():
-    """Retorna o status da sessão atual"""
+# ========================================
+# ETIQUETAS QR POR QUADRO
+# ========================================
+# Cada quadro ganha uma etiqueta com um QR Code que abre /registrar?quadro_id=N direto no
+# teclado daquele quadro. O PNG fica em disco com o nome sha256(URL + configurações de
+# desenho): quadro novo, outro IP/porta do servidor ou outro ETIQUETAS_QR mudam a chave e
+# só essas etiquetas são desenhadas; as demais saem do disco sem tocar no qrcode/PIL.
+
+_executor_etiquetas = None
+_executor_etiquetas_lock = threading.Lock()
+
+
+def pasta_etiquetas():
+    return app.config['ETIQUETAS_PASTA'] or os.path.join(app.instance_path, 'etiquetas_qr')
+
+
+def obter_executor_etiquetas():
+    """Retorna o pool de processos das etiquetas (desenhar QR é CPU pura: threads ficariam presas no GIL)"""
+    global _executor_etiquetas
+
+    with _executor_etiquetas_lock:
+        if _executor_etiquetas is None:
+            _executor_etiquetas = ProcessPoolExecutor(max_workers=app.config['ETIQUETAS_PROCESSOS'])
+        return _executor_etiquetas
+
+
+def descartar_executor_etiquetas():
+    """Descarta um pool quebrado (processo morto); o próximo lote cria outro"""
+    global _executor_etiquetas
+
+    with _executor_etiquetas_lock:
+        if _executor_etiquetas is not None:
+            _executor_etiquetas.shutdown(wait=False, cancel_futures=True)
+            _executor_etiquetas = None
+
+
+def chave_etiqueta(url, configuracao):
+    """Nome do PNG no disco: muda junto com a URL ou com qualquer configuração de desenho"""
+    texto = json.dumps({'url': url, **configuracao}, sort_keys=True)
+    return hashlib.sha256(texto.encode()).hexdigest()
+
+
+def desenhar_etiquetas(urls, configuracao):
+    """PNGs das URLs, na mesma ordem; lotes grandes vão para o pool de processos"""
+    desenhar = partial(gerar_qrcode_png, **configuracao)
+
+    if len(urls) < app.config['ETIQUETAS_MIN_PARALELO']:
+        return [desenhar(url) for url in urls]
+
     try:
-        sessao_ativa = SessaoLeitura.query.filter_by(ativa=True).first()
-        
-        if sessao_ativa:
-            return jsonify({
-                'ativa': True,
-                'sessao': sessao_ativa.to_dict()
-            })
-        else:
-            return jsonify({
-                'ativa': False,
-                'sessao': None
-            })
-            
-    except Exception as e:
-        return jsonify({
-            'ativa': False,
-            'mensagem': f'Erro ao verificar status: {str(e)}'
-        }), 500
+        executor = obter_executor_etiquetas()
+        processos = executor._max_workers
+        return list(executor.map(desenhar, urls, chunksize=max(1, len(urls) // (processos * 4))))
+    except BrokenProcessPool:
+        app.logger.warning('Pool de etiquetas quebrado; desenhando no próprio processo')
+        descartar_executor_etiquetas()
+        return [desenhar(url) for url in urls]
 
 
-@app.route('/api/rascunhos/mobile', methods=['GET'])
-def api_rascunhos_mobile():
-    """Retorna lista de quadros com status e valores para interface mobile"""
+def garantir_etiquetas(urls):
+    """Garante o PNG de cada URL na pasta; retorna ({url: chave}, quantas foram desenhadas agora)"""
+    configuracao = app.config['ETIQUETAS_QR']
+    pasta = pasta_etiquetas()
+    os.makedirs(pasta, exist_ok=True)
+
+    chaves = {url: chave_etiqueta(url, configuracao) for url in urls}
+    faltando = [url for url, chave in chaves.items()
+                if not os.path.exists(os.path.join(pasta, chave + '.png'))]
+
+    if faltando:
+        for url, png in zip(faltando, desenhar_etiquetas(faltando, configuracao)):
+            # Grava em arquivo temporário e renomeia: outra requisição nunca lê um PNG pela metade
+            destino = os.path.join(pasta, chaves[url] + '.png')
+            temporario = f'{destino}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temporario, 'wb') as arquivo:
+                arquivo.write(png)
+            os.replace(temporario, destino)
+
+        remover_etiquetas_antigas(set(chaves.values()))
+
+    return chaves, len(faltando)
+
+
+def remover_etiquetas_antigas(em_uso):
+    """Apaga as etiquetas mais antigas acima de ETIQUETAS_MAX_ARQUIVOS (nunca as da folha atual)"""
+    pasta = pasta_etiquetas()
+    arquivos = [nome for nome in os.listdir(pasta) if nome.endswith('.png')]
+    excesso = len(arquivos) - app.config['ETIQUETAS_MAX_ARQUIVOS']
+    if excesso <= 0:
+        return
+
+    candidatos = sorted(
+        (nome for nome in arquivos if nome[:-4] not in em_uso),
+        key=lambda nome: os.path.getmtime(os.path.join(pasta, nome))
+    )
+    for nome in candidatos[:excesso]:
+        try:
+            os.remove(os.path.join(pasta, nome))
+        except FileNotFoundError:
+            pass
+
+
+@app.route('/admin/quadros/etiquetas')
+@orcamento_consultas(3)
+def admin_etiquetas():
+    """Folha de etiquetas QR para imprimir (?area_id= ou ?ids=1,2,3 restringem os quadros; ?formato=json)"""
     try:
-        # Busca todos os quadros ativos ordenados alfabeticamente
-        quadros = Quadro.query.filter_by(ativo=True).order_by(Quadro.nome).all()
-        
-        # Busca todos os rascunhos do dia atual
-        hoje = datetime.now().date()
-        rascunhos_hoje = LeituraRascunho.query.filter(
-            db.func.date(LeituraRascunho.data_registro) == hoje
-        ).all()
-        
-        # Cria dicionário de rascunhos por quadro_id
-        rascunhos_dict = {r.quadro_id: r for r in rascunhos_hoje}
-        
-        # Monta lista de resposta
-        resultado = []
-        for quadro in quadros:
-            rascunho = rascunhos_dict.get(quadro.id)
-            resultado.append({
-                'quadro_id': quadro.id,
-                'quadro_nome': quadro.nome,
-                'quadro_localizacao': quadro.localizacao,
-                'cadastrado': rascunho is not None,
-                'valor_leitura': rascunho.valor_leitura if rascunho else None,
-                'alerta_reset': rascunho.alerta_reset if rascunho else False,
-                'rascunho_id': rascunho.id if rascunho else None
+        query = Quadro.query.filter_by(ativo=True)
+
+        area_id = request.args.get('area_id', type=int)
+        if area_id:
+            query = query.filter_by(area_id=area_id)
+
+        ids = request.args.get('ids')
+        if ids:
+            try:
+                query = query.filter(Quadro.id.in_([int(i) for i in ids.split(',') if i.strip()]))
+            except ValueError:
+                return jsonify({'sucesso': False, 'erro': 'Parâmetro ids inválido. Use números separados por vírgula.'}), 400
+
+        quadros = query.order_by(Quadro.nome).all()
+
+        ip_local = obter_ip_local()
+        url_base = url_base_mobile(ip_local)
+        urls = {quadro.id: f'{url_base}/registrar?quadro_id={quadro.id}' for quadro in quadros}
+
+        inicio = time.perf_counter()
+        chaves, desenhadas = garantir_etiquetas(list(urls.values()))
+        tempo_s = round(time.perf_counter() - inicio, 3)
+
+        etiquetas = [{
+            'quadro_id': quadro.id,
+            'nome': quadro.nome,
+            'localizacao': quadro.localizacao,
+            'url': urls[quadro.id],
+            'imagem': f'/admin/quadros/etiquetas/{chaves[urls[quadro.id]]}.png'
+        } for quadro in quadros]
+
+        if request.args.get('formato') == 'json':
+            return jsonify({
+                'sucesso': True,
+                'total': len(etiquetas),
+                'desenhadas': desenhadas,
+                'do_disco': len(etiquetas) - desenhadas,
+                'tempo_s': tempo_s,
+                'etiquetas': etiquetas
+            }), 200
+
+        # Variáveis para a sidebar
+        _, url_mobile, qrcode_img = obter_qrcode_mobile()
+        total_rascunhos = LeituraRascunho.query.count()
+
+        return render_template('admin_etiquetas.html',
+                               etiquetas=etiquetas,
+                               areas=Area.query.order_by(Area.nome).all(),
+                               area_id=area_id,
+                               desenhadas=desenhadas,
+                               tempo_s=tempo_s,
+                               url_base=url_base,
+                               qrcode_img=qrcode_img,
+                               ip_local=ip_local,
+                               total_rascunhos=total_rascunhos)
+
+    except OSError as e:
+        return jsonify({'sucesso': False, 'erro': f'Erro ao gravar etiquetas: {str(e)}'}), 500
+
+
+@app.route('/admin/quadros/etiquetas/<chave>.png')
+def etiqueta_png(chave):
+    """PNG de uma etiqueta; o nome é o hash do conteúdo, então o navegador pode guardá-lo para sempre"""
+    if len(chave) != 64 or any(c not in '0123456789abcdef' for c in chave):
+        return jsonify({'sucesso': False, 'erro': 'Etiqueta inválida.'}), 400
+
+    caminho = os.path.join(pasta_etiquetas(), chave + '.png')
+    if not os.path.exists(caminho):
+        return jsonify({'sucesso': False, 'erro': 'Etiqueta não encontrada.'}), 404
+    return send_file(caminho, mimetype='image/png', max_age=365 * 24 * 3600)
+
+
+# ========================================
+# BACKUP ONLINE E COMPACTAÇÃO DO BANCO
+# ========================================
+
+class BackupReiniciado(Exception):
+    """A cópia em passos foi reiniciada vezes demais por gravações concorrentes"""
+
+
+class ManutencaoBanco:
+    """Thread que, no horário configurado, roda incremental_vacuum/ANALYZE no energia.db,
+    faz o backup online (API de backup do SQLite, em passos) e rotaciona as cópias"""
+
+    MAX_HISTORICO = 20
+
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self.historico = []  # Execuções mais recentes primeiro
+        self.progresso = None  # {'etapa', 'copiadas', 'total'} durante a execução
+        self._lock = threading.Lock()
+        self._evento = threading.Event()
+        self._thread = None
+
+    @property
+    def ativo(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def em_andamento(self):
+        return self._lock.locked()
+
+    def iniciar(self):
+        """Inicia a thread do agendamento (apenas uma vez por processo)"""
+        if self.ativo:
+            return
+        self._thread = threading.Thread(target=self._executar, name='manutencao-banco', daemon=True)
+        self._thread.start()
+
+    def notificar(self):
+        """Pede uma execução imediata"""
+        self._evento.set()
+
+    def _segundos_ate_horario(self):
+        hora, minuto = map(int, self.app.config['BACKUP_HORARIO'].split(':'))
+        agora = datetime.now()
+        proximo = agora.replace(hour=hora, minute=minuto, second=0, microsecond=0)
+        if proximo <= agora:
+            proximo += timedelta(days=1)
+        return (proximo - agora).total_seconds()
+
+    def _executar(self):
+        while True:
+            self._evento.wait(timeout=self._segundos_ate_horario())
+            self._evento.clear()
+            try:
+                self.executar()
+            except Exception as e:
+                print(f"⚠️ Erro na manutenção do banco: {e}")
+
+    def pasta(self):
+        return self.app.config['BACKUP_PASTA'] or os.path.join(self.app.instance_path, 'backups')
+
+    def listar_copias(self):
+        """Cópias gravadas, da mais recente para a mais antiga"""
+        pasta = self.pasta()
+        if not os.path.isdir(pasta):
+            return []
+        copias = []
+        for nome in sorted((n for n in os.listdir(pasta) if n.startswith('energia-') and n.endswith('.db')), reverse=True):
+            info = os.stat(os.path.join(pasta, nome))
+            copias.append({
+                'nome': nome,
+                'bytes': info.st_size,
+                'data': datetime.fromtimestamp(info.st_mtime).isoformat(timespec='seconds')
             })
-        
-        return jsonify({
-            'sucesso': True,
-            'quadros': resultado
-        })
-        
-    except Exception as e:
-        return jsonify({
-            'sucesso': False,
-            'mensagem': f'Erro ao buscar quadros: {str(e)}'
-        }), 500
+        return copias
 
+    def executar(self):
+        """Compactação + ANALYZE + backup + rotação; devolve o registro da execução (None se já estava rodando)"""
+        if not self._lock.acquire(blocking=False):
+            return None
+        registro = {'inicio': datetime.now().isoformat(timespec='seconds'), 'sucesso': False, 'erro': None}
+        try:
+            banco = caminho_banco_sqlite()
+            if not banco or not os.path.exists(banco):
+                raise RuntimeError('O backup online só funciona com o banco em arquivo SQLite.')
+
+            # Compacta antes de copiar: as páginas livres não vão para a cópia
+            registro.update(self._compactar(banco))
+            registro.update(self._copiar(banco))
+            registro['removidas'] = self._rotacionar()
+            registro['sucesso'] = True
+        except Exception as e:
+            registro['erro'] = str(e)
+            raise
+        finally:
+            self.progresso = None
+            self.historico.insert(0, registro)
+            del self.historico[self.MAX_HISTORICO:]
+            self._lock.release()
+        return registro
+
+    def _copiar(self, banco):
+        """Copia o banco em passos de BACKUP_PAGINAS_POR_PASSO páginas, liberando-o entre os passos"""
+        pasta = self.pasta()
+        os.makedirs(pasta, exist_ok=True)
+        base = f"energia-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        nome, sufixo = base + '.db', 1
+        while os.path.exists(os.path.join(pasta, nome)):
+            sufixo += 1
+            nome = f'{base}_{sufixo}.db'
+        destino_caminho = os.path.join(pasta, nome)
+        parcial = destino_caminho + '.parcial'
+
+        pausa = self.app.config['BACKUP_PAUSA_MS'] / 1000
+        estado = {'passos': 0, 'reinicios': 0, 'restantes': None}
+
+        def progresso(status, restantes, total):
+            # Página restante a mais que no passo anterior = outra conexão gravou e a cópia recomeçou
+            if estado['restantes'] is not None and restantes > estado['restantes']:
+                estado['reinicios'] += 1
+                if estado['reinicios'] >= self.app.config['BACKUP_MAX_REINICIOS']:
+                    raise BackupReiniciado()
+            estado['restantes'] = restantes
+            estado['passos'] += 1
+            self.progresso = {'etapa': 'copiando', 'copiadas': total - restantes, 'total': total}
+            time.sleep(pausa)
+
+        inicio = time.perf_counter()
+        origem = sqlite3.connect(banco, timeout=30)
+        try:
+            modo = 'passos'
+            destino = sqlite3.connect(parcial)
+            try:
+                origem.backup(destino, pages=self.app.config['BACKUP_PAGINAS_POR_PASSO'], progress=progresso)
+            except BackupReiniciado:
+                # Banco muito movimentado: uma cópia única segura o banco por pouco tempo e não recomeça
+                modo = 'completo'
+                origem.backup(destino)
+            verificacao = destino.execute('PRAGMA quick_check').fetchone()[0]
+            destino.close()
+        finally:
+            origem.close()
+
+        if verificacao != 'ok':
+            os.remove(parcial)
+            raise RuntimeError(f'Cópia inválida ({verificacao})')
+        os.replace(parcial, destino_caminho)
+
+        return {
+            'copia': nome,
+            'copia_bytes': os.path.getsize(destino_caminho),
+            'copia_s': round(time.perf_counter() - inicio, 3),
+            'copia_modo': modo,
+            'copia_passos': estado['passos'],
+            'copia_reinicios': estado['reinicios'],
+            'fim': datetime.now().isoformat(timespec='seconds')
+        }
+
+    def _rotacionar(self):
+        """Apaga as cópias além de BACKUP_MANTER"""
+        removidas = []
+        for copia in self.listar_copias()[self.app.config['BACKUP_MANTER']:]:
+            os.remove(os.path.join(self.pasta(), copia['nome']))
+            removidas.append(copia['nome'])
+        return removidas
+
+    def _compactar(self, banco):
+        """Devolve ao disco as páginas livres (rascunhos apagados) em passos e atualiza as estatísticas"""
+        inicio = time.perf_counter()
+        tamanho_antes = os.path.getsize(banco)
+        pausa = self.app.config['BACKUP_PAUSA_MS'] / 1000
+        passo = self.app.config['BACKUP_PAGINAS_POR_PASSO']
+
+        conexao = sqlite3.connect(banco, timeout=30, isolation_level=None)
+        try:
+            livres_antes = conexao.execute('PRAGMA freelist_count').fetchone()[0]
+            convertido = False
+            if conexao.execute('PRAGMA auto_vacuum').fetchone()[0] != 2 and livres_antes:
+                # Só um VACUUM completo passa o banco para o modo incremental (uma vez, na primeira execução)
+                self.progresso = {'etapa': 'convertendo para vacuum incremental', 'copiadas': 0, 'total': livres_antes}
+                conexao.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                conexao.execute('VACUUM')
+                convertido = True
+            else:
+                while True:
+                    livres = conexao.execute('PRAGMA freelist_count').fetchone()[0]
+                    if not livres:
+                        break
+                    self.progresso = {'etapa': 'compactando', 'copiadas': livres_antes - livres, 'total': livres_antes}
+                    conexao.execute(f'PRAGMA incremental_vacuum({passo})').fetchall()
+                    time.sleep(pausa)
+
+            # Estatísticas do planejador com leitura limitada por índice, para não varrer as tabelas grandes
+            self.progresso = {'etapa': 'analisando', 'copiadas': 0, 'total': 0}
+            inicio_analyze = time.perf_counter()
+            conexao.execute('PRAGMA analysis_limit = 1000')
+            conexao.execute('ANALYZE')
+            analyze_s = time.perf_counter() - inicio_analyze
+        finally:
+            conexao.close()
+
+        return {
+            'paginas_livres': livres_antes,
+            'convertido_incremental': convertido,
+            'banco_bytes_antes': tamanho_antes,
+            'banco_bytes_depois': os.path.getsize(banco),
+            'compactacao_s': round(time.perf_counter() - inicio - analyze_s, 3),
+            'analyze_s': round(analyze_s, 3)
+        }
+
+
+manutencao_banco = ManutencaoBanco(app)
+
+
+@app.route('/admin/backup')
+def admin_backup():
+    """Cópias do banco, últimas execuções do backup/compactação e tamanhos"""
+    banco = caminho_banco_sqlite()
+    dados = {
+        'horario': app.config['BACKUP_HORARIO'],
+        'pasta': manutencao_banco.pasta(),
+        'agendado': manutencao_banco.ativo,
+        'em_andamento': manutencao_banco.em_andamento,
+        'progresso': manutencao_banco.progresso,
+        'banco_bytes': os.path.getsize(banco) if banco and os.path.exists(banco) else None,
+        'copias': manutencao_banco.listar_copias(),
+        'historico': manutencao_banco.historico
+    }
+
+    if request.args.get('formato') == 'json':
+        return jsonify(dict(dados, sucesso=True))
+
+    # Variáveis para a sidebar
+    ip_local, url_mobile, qrcode_img = obter_qrcode_mobile()
+    total_rascunhos = LeituraRascunho.query.count()
+
+    return render_template('admin_backup.html',
+                           **dados,
+                           qrcode_img=qrcode_img,
+                           ip_local=ip_local,
+                           total_rascunhos=total_rascunhos)
+
+
+@app.route('/admin/backup/executar', methods=['POST'])
+def executar_backup():
+    """Executa backup e compactação agora (em segundo plano; ?aguardar=1 espera terminar)"""
+    if manutencao_banco.em_andamento:
+        return jsonify({'sucesso': False, 'erro': 'Já há um backup em andamento.'}), 409
+
+    if request.args.get('aguardar') or not manutencao_banco.ativo:
+        try:
+            registro = manutencao_banco.executar()
+        except Exception as e:
+            return jsonify({'sucesso': False, 'erro': f'Erro no backup: {str(e)}'}), 500
+        if registro is None:
+            return jsonify({'sucesso': False, 'erro': 'Já há um backup em andamento.'}), 409
+        return jsonify({'sucesso': True, 'mensagem': f"Backup {registro['copia']} concluído.", 'execucao': registro}), 200
+
+    manutencao_banco.notificar()
+    return jsonify({'sucesso': True, 'mensagem': 'Backup iniciado em segundo plano.'}), 202
+
+
+# ========================================
+# COMANDOS DE LINHA (flask --app app energia ...)
+# ========================================
+
+energia_cli = AppGroup('energia', help='Manutenção do banco de energia sem o servidor web.')
+app.cli.add_command(energia_cli)
+
+
+@energia_cli.command('recalcular')
+@click.option('--processos', type=int, default=None, help='Processos em paralelo (padrão: núcleos da CPU).')
+@click.option('--reiniciar', is_flag=True, help='Descarta o recálculo interrompido e começa do zero.')
+def comando_recalcular(processos, reiniciar):
+    """Recalcula o consumo de todos os quadros, retomando um recálculo interrompido"""
+    inicializar_banco()
+    ultimo_aviso = [0.0]
+
+    def mostrar_progresso(concluidos, total, quadros_por_segundo):
+        if time.perf_counter() - ultimo_aviso[0] >= 1 or concluidos == total:
+            ultimo_aviso[0] = time.perf_counter()
+            click.echo(f'🔄 {concluidos}/{total} quadros ({quadros_por_segundo:.1f} quadros/s)')
+
+    resumo = recalcular_frota(processos, reiniciar, mostrar_progresso)
+    if resumo['retomado']:
+        click.echo(f"↩️  Recálculo #{resumo['recalculo_id']} retomado")
+    click.echo(
+        f"✅ {resumo['quadros_nesta_execucao']} quadros em {resumo['duracao_s']:.2f} s com {resumo['processos']} processo(s) "
+        f"({resumo['quadros_por_segundo']:.1f} quadros/s); {resumo['leituras_alteradas']} leituras alteradas "
+        f"em {resumo['dias_alterados']} dias"
+    )
+
+
+LOTE_CLI_LINHAS = 5000  # Linhas lidas/gravadas por vez em importar e exportar
+
+# Rotas medidas por 'flask energia bench' (as mesmas que os navegadores e celulares usam)
+ROTAS_BENCH = [
+    '/',
+    '/registrar',
+    '/revisao',
+    '/leituras',
+    '/api/leituras',
+    '/api/rascunhos/mobile',
+    '/api/quadros/buscar?q=a',
+    '/api/analise/dados?compact=1',
+    '/api/custos'
+]
+
+
+def ler_planilha_em_lotes(caminho, tamanho_lote, separador=','):
+    """Lê .csv ou .xlsx do disco em DataFrames de até tamanho_lote linhas, sem carregar o arquivo inteiro
+
+    O índice de cada lote continua o do anterior, para os erros apontarem a linha certa do arquivo.
+    .xls (formato antigo) não tem leitura em fluxo e é lido de uma vez.
+    """
+    import pandas as pd
+    extensao = os.path.splitext(caminho)[1].lower()
+
+    if extensao == '.csv':
+        yield from pd.read_csv(caminho, sep=separador, chunksize=tamanho_lote,
+                               dtype={'Data': str, 'Quadro': str, 'Localizacao': str})
+    elif extensao == '.xlsx':
+        from openpyxl import load_workbook
+        livro = load_workbook(caminho, read_only=True, data_only=True)
+        try:
+            linhas = livro.worksheets[0].iter_rows(values_only=True)
+            cabecalho = [str(coluna).strip() if coluna is not None else '' for coluna in next(linhas, ())]
+            lote, inicio = [], 0
+            for linha in linhas:
+                lote.append(linha)
+                if len(lote) >= tamanho_lote:
+                    yield pd.DataFrame(lote, columns=cabecalho, index=range(inicio, inicio + len(lote)))
+                    inicio += len(lote)
+                    lote = []
+            if lote:
+                yield pd.DataFrame(lote, columns=cabecalho, index=range(inicio, inicio + len(lote)))
+        finally:
+            livro.close()
+    elif extensao == '.xls':
+        yield pd.read_excel(caminho, sheet_name=0)
+    else:
+        raise ValueError('Formato inválido. Use arquivos .csv, .xlsx ou .xls')
+
+
+def ler_leituras_em_lotes(data_inicio=None, data_fim=None, quadro_id=None, tamanho_lote=LOTE_CLI_LINHAS):
+    """Leituras do filtro em ordem de (data_registro, id), em lotes paginados pela última linha do lote anterior"""
+    posicao = None
+    while True:
+        query = filtrar_leituras(data_inicio, data_fim, quadro_id).with_entities(
+            Leitura.data_registro, Leitura.id, Leitura.quadro_id,
+            Leitura.valor_leitura, Leitura.consumo_dia, Leitura.alerta_reset
+        )
+        if posicao:
+            query = query.filter(tuple_(Leitura.data_registro, Leitura.id) > posicao)
+        lote = query.order_by(Leitura.data_registro.asc(), Leitura.id.asc()).limit(tamanho_lote).all()
+        if not lote:
+            return
+        yield lote
+        posicao = (lote[-1].data_registro, lote[-1].id)
+
+
+def formatar_vazao(quantidade, segundos, unidade):
+    return f'{quantidade / segundos:,.0f} {unidade}/s' if segundos > 0 else f'- {unidade}/s'
+
+
+def encerrar_importacao_interrompida(recalculo, linhas, reaproveitado):
+    """Importação parou no meio: o recálculo aberto fica pendente se algum lote já foi gravado"""
+    if linhas or reaproveitado:
+        click.echo(f'⚠️  {linhas} linha(s) gravada(s) agora; o consumo aguarda o recálculo: rode '
+                   f'"flask --app app energia recalcular" ou importe o arquivo de novo', err=True)
+    else:
+        # Nenhum lote gravado: não há o que retomar
+        db.session.rollback()
+        db.session.delete(recalculo)
+        db.session.commit()
+
+
+@energia_cli.command('importar')
+@click.argument('caminho', type=click.Path(exists=True, dir_okay=False))
+@click.option('--lote', type=int, default=LOTE_CLI_LINHAS, show_default=True, help='Linhas por lote.')
+@click.option('--separador', default=',', show_default=True, help='Separador do CSV.')
+@click.option('--processos', type=int, default=None, help='Processos do recálculo (padrão: núcleos da CPU).')
+@click.option('--forcar', is_flag=True, help='Importa mesmo que o arquivo idêntico já tenha sido importado.')
+def comando_importar(caminho, lote, separador, processos, forcar):
+    """Importa uma planilha (.csv, .xlsx ou .xls) do disco, sem limite de tamanho"""
+    inicializar_banco()
+    inicio = time.perf_counter()
+
+    # Os lotes são gravados com consumo zerado e recalculados no final. A execução do recálculo
+    # fica aberta antes do primeiro lote: se a importação parar no meio, 'flask energia recalcular'
+    # (ou a próxima importação) a retoma. Uma execução já interrompida é reaproveitada; como
+    # não se sabe quais quadros ela cobria, o recálculo no final passa por todos.
+    recalculo = RecalculoFrota.query.filter(RecalculoFrota.concluido_em.is_(None))\
+        .order_by(RecalculoFrota.id.desc()).first()
+    interrompido = recalculo is not None
+
+    # Arquivo idêntico já importado: pula, a não ser com --forcar ou com recálculo pendente a concluir
+    with open(caminho, 'rb') as arquivo:
+        hash_conteudo, tamanho = calcular_hash_arquivo(arquivo)
+    anterior = None if forcar or interrompido else verificar_reenvio_importacao(hash_conteudo)
+    if anterior:
+        db.session.commit()
+        resposta = resposta_reenvio_importacao(anterior)
+        detalhes = resposta['detalhes']
+        click.echo(f"⏭️  {resposta['mensagem']}\n"
+                   f"   Na ocasião: {detalhes['registros_inseridos']} inseridas, {detalhes['registros_duplicados']} "
+                   f"duplicadas, {len(detalhes['erros'])} erro(s), {len(detalhes['quadros_criados'])} quadro(s) criado(s) "
+                   f"({time.perf_counter() - inicio:.2f} s)")
+        return
+
+    if interrompido:
+        click.echo(f'⚠️  Recálculo #{recalculo.id} não concluído (importação ou recálculo interrompido): '
+                   f'todos os quadros serão recalculados no final')
+    else:
+        recalculo = RecalculoFrota(total_quadros=0)
+        db.session.add(recalculo)
+        db.session.commit()
+
+    linhas = inseridas = duplicadas = 0
+    erros, quadros_criados, quadro_ids, alteracoes = [], [], set(), []
 
-@app.route('/api/rascunhos/revisao', methods=['GET'])
-def api_rascunhos_revisao():
-    """Retorna dados de revisão em JSON para atualização em tempo real"""
     try:
-        rascunhos = LeituraRascunho.query.all()
-        dados_revisao = []
-        
-        for rascunho in rascunhos:
-            # Calcula média dos últimos 90 dias
-            noventa_dias_atras = datetime.now() - timedelta(days=90)
-            media_90_dias = db.session.query(func.avg(Leitura.consumo_dia))\
-                .filter(Leitura.quadro_id == rascunho.quadro_id)\
-                .filter(Leitura.data_registro >= noventa_dias_atras)\
-                .filter(Leitura.consumo_dia.isnot(None))\
-                .scalar()
-            
-            media_90_dias = media_90_dias if media_90_dias else 0
-            
-            # Busca o último valor registrado oficialmente
-            ultima_leitura_oficial = Leitura.query.filter_by(quadro_id=rascunho.quadro_id)\
-                .order_by(Leitura.data_registro.desc()).first()
-            
-            ultimo_valor_oficial = ultima_leitura_oficial.valor_leitura if ultima_leitura_oficial else 0
-            ultima_data_oficial = ultima_leitura_oficial.data_registro.strftime('%d/%m/%Y %H:%M') if ultima_leitura_oficial else 'Nunca'
-            
-            # Calcula desvio percentual
-            desvio_percentual = 0
-            status_desvio = 'normal'
-            
-            if media_90_dias > 0 and rascunho.consumo_provisorio:
-                desvio_percentual = ((rascunho.consumo_provisorio - media_90_dias) / media_90_dias) * 100
-                
-                if abs(desvio_percentual) > 50:
-                    status_desvio = 'critico'
-                elif abs(desvio_percentual) > 30:
-                    status_desvio = 'alerta'
-            
-            dados_revisao.append({
-                'id': rascunho.id,
-                'quadro_id': rascunho.quadro_id,
-                'quadro_nome': rascunho.quadro.nome,
-                'quadro_localizacao': rascunho.quadro.localizacao,
-                'valor_leitura': rascunho.valor_leitura,
-                'consumo_provisorio': rascunho.consumo_provisorio,
-                'alerta_reset': rascunho.alerta_reset,
-                'media_90_dias': round(media_90_dias, 2),
-                'desvio_percentual': round(desvio_percentual, 1),
-                'status_desvio': status_desvio,
-                'ultimo_valor_oficial': round(ultimo_valor_oficial, 2),
-                'ultima_data_oficial': ultima_data_oficial
-            })
-        
-        return jsonify({
-            'sucesso': True,
-            'rascunhos': dados_revisao,
-            'total': len(dados_revisao)
-        })
-        
-    except Exception as e:
-        return jsonify({
-            'sucesso': False,
-            'mensagem': f'Erro ao buscar rascunhos: {str(e)}'
-        }), 500
+        for df in ler_planilha_em_lotes(caminho, lote, separador):
+            faltantes = [coluna for coluna in COLUNAS_IMPORTACAO if coluna not in df.columns]
+            if faltantes:
+                raise click.ClickException(f'Colunas obrigatórias faltando: {", ".join(faltantes)}')
 
-    
-    db.session.commit()
+            resultado = processar_dados_importacao(df, recalcular=False)
+            if not resultado['sucesso']:
+                raise click.ClickException(resultado['erro'])
 
+            detalhes = resultado['detalhes']
+            linhas += len(df)
+            inseridas += detalhes['registros_inseridos']
+            duplicadas += detalhes['registros_duplicados']
+            erros += detalhes['erros']
+            quadros_criados += detalhes['quadros_criados']
+            quadro_ids.update(resultado['quadro_ids'])
+            alteracoes += resultado['alteracoes']
+            click.echo(f'📥 {linhas} linhas lidas ({formatar_vazao(linhas, time.perf_counter() - inicio, "linhas")})')
+    except ValueError as e:
+        encerrar_importacao_interrompida(recalculo, linhas, interrompido)
+        raise click.ClickException(str(e))
+    except (click.ClickException, KeyboardInterrupt):
+        encerrar_importacao_interrompida(recalculo, linhas, interrompido)
+        raise
+    leitura_s = time.perf_counter() - inicio
 
+    # Consumo dos quadros importados recalculado uma vez no final, não a cada lote, no
+    # recálculo em paralelo de 'flask energia recalcular'
+    if interrompido:
+        resumo = recalcular_frota(processos, recalculo_id=recalculo.id)
+    elif quadro_ids:
+        resumo = recalcular_frota(processos, quadro_ids=quadro_ids, recalculo_id=recalculo.id)
+    else:
+        resumo = None
+        recalculo.concluido_em = datetime.now()
+        db.session.commit()
+    processar_apos_alteracao(alteracoes)
+    registrar_importacao_arquivo(hash_conteudo, os.path.basename(caminho), tamanho, {
+        'registros_inseridos': inseridas,
+        'registros_duplicados': duplicadas,
+        'quadros_criados': quadros_criados,
+        'erros': erros
+    }, 'cli')
+    total_s = time.perf_counter() - inicio
+
+    for erro in erros[:20]:
+        click.echo(f'⚠️  {erro}')
+    if len(erros) > 20:
+        click.echo(f'⚠️  ... e mais {len(erros) - 20} erro(s)')
+    megabytes = os.path.getsize(caminho) / (1024 * 1024)
+    click.echo(
+        f'✅ {inseridas} inseridas, {duplicadas} duplicadas, {len(erros)} erro(s), {len(quadros_criados)} quadro(s) criado(s)\n'
+        f'⏱️  Leitura e gravação: {leitura_s:.2f} s ({formatar_vazao(linhas, leitura_s, "linhas")}, '
+        f'{megabytes / leitura_s if leitura_s > 0 else 0:.1f} MB/s); '
+        f"recálculo de {resumo['quadros_nesta_execucao'] if resumo else 0} quadro(s): {total_s - leitura_s:.2f} s"
+        + (f" ({resumo['quadros_por_segundo']:.1f} quadros/s)" if resumo else '') + f'; total {total_s:.2f} s'
+    )
+
+
+@energia_cli.command('exportar')
+@click.argument('destino', type=click.Path(dir_okay=False, writable=True))
+@click.option('--de', 'data_inicio', type=click.DateTime(['%Y-%m-%d']), help='Data inicial (AAAA-MM-DD).')
+@click.option('--ate', 'data_fim', type=click.DateTime(['%Y-%m-%d']), help='Data final, inclusiva (AAAA-MM-DD).')
+@click.option('--quadro-id', type=int, help='Só as leituras de um quadro.')
+@click.option('--lote', type=int, default=LOTE_CLI_LINHAS, show_default=True, help='Linhas por lote.')
+@click.option('--separador', default=',', show_default=True, help='Separador do CSV.')
+def comando_exportar(destino, data_inicio, data_fim, quadro_id, lote, separador):
+    """Exporta as leituras para CSV no formato da importação (com consumo e reset)"""
+    inicio = time.perf_counter()
+    quadros = {quadro_id: (nome, localizacao)
+               for quadro_id, nome, localizacao in db.session.query(Quadro.id, Quadro.nome, Quadro.localizacao)}
+    total = 0
+
+    with open(destino, 'w', newline='', encoding='utf-8') as arquivo:
+        escritor = csv.writer(arquivo, delimiter=separador)
+        escritor.writerow(COLUNAS_IMPORTACAO + ['Consumo', 'Reset'])
+        for linhas in ler_leituras_em_lotes(data_inicio and data_inicio.date(), data_fim and data_fim.date(),
+                                            quadro_id, lote):
+            escritor.writerows(
+                (data_registro.strftime('%Y-%m-%d %H:%M:%S'), *quadros.get(referencia_id, ('', '')),
+                 valor, consumo if consumo is not None else '', 1 if reset else 0)
+                for data_registro, _, referencia_id, valor, consumo, reset in linhas
+            )
+            total += len(linhas)
+            click.echo(f'📤 {total} leituras ({formatar_vazao(total, time.perf_counter() - inicio, "leituras")})')
+
+    duracao = time.perf_counter() - inicio
+    megabytes = os.path.getsize(destino) / (1024 * 1024)
+    click.echo(f'✅ {total} leituras em {destino} ({megabytes:.1f} MB) em {duracao:.2f} s '
+               f'({formatar_vazao(total, duracao, "leituras")})')
+
+
+@energia_cli.command('bench')
+@click.option('--repeticoes', type=int, default=20, show_default=True, help='Requisições por rota.')
+@click.option('--frio', is_flag=True, help='Sem cache: limpa o cache em memória deste processo antes de cada '
+                                           'requisição e não usa o cache compartilhado dos workers.')
+@click.option('--rota', 'rotas', multiple=True, help='Rota a medir (pode repetir); padrão: as principais.')
+def comando_bench(repeticoes, frio, rotas):
+    """Mede as rotas principais no próprio processo, sem servidor: tempo, requisições/s e consultas SQL"""
+    import statistics
+    inicializar_banco(reiniciar_cache=False)
+    cliente = app.test_client()
+
+    # Frio: o cache compartilhado (arquivo usado pelos workers do servidor) fica de fora, sem ser
+    # lido nem apagado; só o cache em memória deste processo é limpo a cada requisição
+    caches = (cache_fragmentos, cache_estados_mobile)
+    compartilhados = [cache.compartilhado for cache in caches]
+    if frio:
+        for cache in caches:
+            cache.compartilhado = None
+
+    try:
+        click.echo(f"{'Rota':<36} {'Mediana':>10} {'p95':>10} {'Req/s':>8} {'SQL':>5} Status")
+        for rota in rotas or ROTAS_BENCH:
+            tempos, consultas, status = [], 0, None
+            for _ in range(repeticoes):
+                if frio:
+                    for cache in caches:
+                        cache.limpar()
+                inicio = time.perf_counter()
+                # Contexto próprio por requisição, como no servidor (o do comando acumularia o g)
+                with app.app_context():
+                    resposta = cliente.get(rota)
+                tempos.append(time.perf_counter() - inicio)
+                consultas = max(consultas, int(resposta.headers.get('X-Consultas-SQL', 0)))
+                status = resposta.status_code
+
+            tempos.sort()
+            mediana = statistics.median(tempos)
+            p95 = tempos[min(len(tempos) - 1, int(len(tempos) * 0.95))]
+            click.echo(f'{rota:<36} {mediana * 1000:>8.1f}ms {p95 * 1000:>8.1f}ms '
+                       f'{1 / mediana if mediana > 0 else 0:>8.1f} {consultas:>5} {status}')
+    finally:
+        for cache, compartilhado in zip(caches, compartilhados):
+            cache.compartilhado = compartilhado
 
 
 # ========================================
@@ -1704,6 +7274,11 @@ if __name__ == '__main__':
     
     # Abre o navegador apenas no processo principal (não no reloader do debug)
     if os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
-        threading.Thread(target=abrir_navegador, daemon=True).start()
+        if not os.environ.get('ENERGIA_SEM_NAVEGADOR'):
+            threading.Thread(target=abrir_navegador, daemon=True).start()
+    else:
+        # Agendador dos relatórios mensais roda no processo que atende as requisições
+        agendador_relatorios.iniciar()
+        manutencao_banco.iniciar()
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('ENERGIA_PORTA', 5000)))
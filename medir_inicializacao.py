@@ -0,0 +1,127 @@
+# ====================================================
+# MEDIÇÃO DO TEMPO DE INICIALIZAÇÃO DO SERVIDOR
+# ====================================================
+#
+# Uso: python medir_inicializacao.py [--orcamento 5] [--repeticoes 3] [--porta 5055]
+#
+# 1. Importa app.py em um processo novo e confere que pandas, numpy, qrcode/PIL
+#    e openpyxl NÃO foram carregados (devem ser importados só no primeiro uso).
+# 2. Inicia "python app.py" como o INICIAR_SISTEMA.bat faz e mede o tempo até a
+#    primeira resposta 200 em /registrar (partida a frio).
+#
+# Sai com código 1 se algum módulo pesado for carregado na importação ou se a
+# partida a frio passar do orçamento, para poder ser usado antes de publicar mudanças.
+
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+PASTA_APP = os.path.dirname(os.path.abspath(__file__))
+
+MODULOS_PESADOS = ['pandas', 'numpy', 'qrcode', 'PIL', 'openpyxl']
+
+CODIGO_IMPORTACAO = '''
+import json, sys, time
+inicio = time.perf_counter()
+import app
+duracao = time.perf_counter() - inicio
+carregados = [m for m in %r if m in sys.modules]
+print(json.dumps({'duracao': duracao, 'carregados': carregados}))
+''' % (MODULOS_PESADOS,)
+
+
+def medir_importacao():
+    """Tempo de 'import app' em um processo limpo e módulos pesados carregados"""
+    resultado = subprocess.run(
+        [sys.executable, '-c', CODIGO_IMPORTACAO],
+        cwd=PASTA_APP, capture_output=True, text=True, timeout=120
+    )
+    if resultado.returncode != 0:
+        raise RuntimeError(f'Falha ao importar app.py:\n{resultado.stderr}')
+    return json.loads(resultado.stdout.strip().splitlines()[-1])
+
+
+def encerrar_processo(processo):
+    """Encerra o servidor e o processo filho do reloader do Flask"""
+    if os.name == 'nt':
+        subprocess.run(['taskkill', '/T', '/F', '/PID', str(processo.pid)], capture_output=True)
+    else:
+        try:
+            os.killpg(processo.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    try:
+        processo.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        processo.kill()
+
+
+def medir_partida_fria(porta, limite):
+    """Segundos entre iniciar 'python app.py' e o primeiro 200 em /registrar"""
+    ambiente = dict(os.environ, ENERGIA_SEM_NAVEGADOR='1', ENERGIA_PORTA=str(porta))
+    opcoes = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP} if os.name == 'nt' else {'start_new_session': True}
+    url = f'http://127.0.0.1:{porta}/registrar'
+
+    inicio = time.perf_counter()
+    processo = subprocess.Popen(
+        [sys.executable, 'app.py'], cwd=PASTA_APP, env=ambiente,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **opcoes
+    )
+
+    try:
+        while time.perf_counter() - inicio < limite:
+            if processo.poll() is not None:
+                raise RuntimeError(f'O servidor terminou com código {processo.returncode}')
+            try:
+                with urllib.request.urlopen(url, timeout=1) as resposta:
+                    if resposta.status == 200:
+                        return time.perf_counter() - inicio
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                pass
+            time.sleep(0.05)
+        raise RuntimeError(f'Sem resposta 200 em {url} após {limite:.0f}s')
+    finally:
+        encerrar_processo(processo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mede o tempo de inicialização do servidor')
+    parser.add_argument('--orcamento', type=float, default=5.0, help='Tempo máximo (s) até o primeiro 200')
+    parser.add_argument('--repeticoes', type=int, default=3, help='Quantas partidas a frio medir')
+    parser.add_argument('--porta', type=int, default=5055, help='Porta usada durante a medição')
+    args = parser.parse_args()
+
+    falhou = False
+
+    importacao = medir_importacao()
+    print(f"📦 import app: {importacao['duracao'] * 1000:.0f} ms")
+    if importacao['carregados']:
+        print(f"❌ Módulos pesados carregados na importação: {', '.join(importacao['carregados'])}")
+        falhou = True
+    else:
+        print(f"✅ Nenhum módulo pesado carregado na importação ({', '.join(MODULOS_PESADOS)})")
+
+    tempos = []
+    for i in range(args.repeticoes):
+        tempo = medir_partida_fria(args.porta, limite=max(args.orcamento * 4, 30))
+        tempos.append(tempo)
+        print(f"🚀 Partida a frio {i + 1}/{args.repeticoes}: {tempo:.2f} s")
+
+    mediana = statistics.median(tempos)
+    print(f"⏱️  Mediana até o primeiro 200 em /registrar: {mediana:.2f} s (orçamento {args.orcamento:.2f} s)")
+    if mediana > args.orcamento:
+        print("❌ Inicialização acima do orçamento")
+        falhou = True
+
+    return 1 if falhou else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
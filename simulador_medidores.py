@@ -0,0 +1,212 @@
+# ====================================================
+# SIMULADOR DE MEDIDORES (API DE INGESTÃO)
+# ====================================================
+#
+# Uso: python simulador_medidores.py --token TOKEN [--url http://localhost:5000]
+#          [--medidores 200] [--threads 8] [--lote 250] [--intervalo 0] [--duracao 30]
+#          [--formato json|csv]
+#
+# Simula medidores inteligentes/gateways enviando lotes de leituras para
+# POST /api/ingestao/leituras. Cada thread mantém uma conexão HTTP persistente e
+# envia lotes em sequência; os valores crescem como um medidor real e, de vez em
+# quando, um medidor "vira" (zera) para exercitar a detecção de reset.
+#
+# Ao final mostra leituras/s aceitas, latência por lote e confere em
+# /api/ingestao/estatisticas quantas leituras o servidor já gravou.
+#
+# O token é criado no servidor com: POST /admin/ingestao/tokens/criar (campo "nome").
+
+import argparse
+import http.client
+import io
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timedelta
+
+
+class Medidor:
+    """Estado de um medidor simulado: valor acumulado e horário da próxima leitura"""
+
+    def __init__(self, quadro_id, valor_inicial):
+        self.quadro_id = quadro_id
+        self.valor = valor_inicial
+        self.horario = datetime.now()
+        self.lock = threading.Lock()
+
+    def proxima_leitura(self, chance_reset):
+        with self.lock:
+            if random.random() < chance_reset:
+                self.valor = random.uniform(0, 10)
+            else:
+                self.valor += random.uniform(0.1, 5)
+            # Horário real, sempre crescente mesmo com várias leituras no mesmo microssegundo
+            self.horario = max(datetime.now(), self.horario + timedelta(microseconds=1))
+            return {'quadro_id': self.quadro_id, 'valor': round(self.valor, 3), 'data': self.horario.isoformat()}
+
+
+def montar_corpo(leituras, formato):
+    """Corpo e Content-Type do lote no formato escolhido"""
+    if formato == 'csv':
+        saida = io.StringIO()
+        saida.write('quadro_id,valor,data\n')
+        for leitura in leituras:
+            saida.write(f"{leitura['quadro_id']},{leitura['valor']},{leitura['data']}\n")
+        return saida.getvalue().encode(), 'text/csv'
+    return json.dumps({'leituras': leituras}).encode(), 'application/json'
+
+
+def obter_quadros(url):
+    """IDs dos quadros ativos cadastrados no servidor"""
+    destino = urllib.parse.urlsplit(url)
+    conexao = http.client.HTTPConnection(destino.hostname, destino.port or 80, timeout=30)
+    conexao.request('GET', '/quadros')
+    dados = json.loads(conexao.getresponse().read())
+    conexao.close()
+    return [q['id'] for q in dados]
+
+
+def obter_ultimo_valor(destino, quadro_id):
+    """Última leitura do quadro no servidor, para o medidor simulado continuar dela"""
+    conexao = http.client.HTTPConnection(destino.hostname, destino.port or 80, timeout=30)
+    conexao.request('GET', f'/quadro/{quadro_id}/ultima-leitura')
+    dados = json.loads(conexao.getresponse().read())
+    conexao.close()
+    return dados.get('valor') or 0.0
+
+
+def trabalhador(args, destino, medidores, fim, resultado):
+    """Envia lotes pela mesma conexão até o fim do tempo; reconecta se a conexão cair"""
+    conexao = None
+    caminho = '/api/ingestao/leituras' + ('?aguardar=1' if args.aguardar else '')
+    cabecalhos = {'Authorization': f'Bearer {args.token}', 'Connection': 'keep-alive'}
+
+    corpo = None
+    while time.perf_counter() < fim:
+        # Depois de um 503 o mesmo lote é reenviado
+        if corpo is None:
+            leituras = [random.choice(medidores).proxima_leitura(args.chance_reset) for _ in range(args.lote)]
+            corpo, tipo = montar_corpo(leituras, args.formato)
+
+        inicio = time.perf_counter()
+        try:
+            if conexao is None:
+                conexao = http.client.HTTPConnection(destino.hostname, destino.port or 80, timeout=60)
+            conexao.request('POST', caminho, body=corpo, headers=dict(cabecalhos, **{'Content-Type': tipo}))
+            resposta = conexao.getresponse()
+            dados = json.loads(resposta.read() or b'{}')
+        except (OSError, http.client.HTTPException, ValueError):
+            if conexao is not None:
+                conexao.close()
+            conexao = None
+            resultado['erros'] += 1
+            continue
+
+        duracao = time.perf_counter() - inicio
+        if resposta.status == 202:
+            resultado['aceitas'] += dados.get('aceitas', 0)
+            resultado['rejeitadas'] += len(dados.get('rejeitadas', []))
+            resultado['latencias'].append(duracao)
+            corpo = None
+        elif resposta.status == 503:
+            resultado['adiados'] += 1
+            time.sleep(float(resposta.getheader('Retry-After', 1)))
+            continue
+        else:
+            resultado['erros'] += 1
+            corpo = None
+            resultado['ultimo_erro'] = f"{resposta.status}: {dados.get('erro', '')}"
+
+        if args.intervalo:
+            time.sleep(args.intervalo)
+
+    if conexao is not None:
+        conexao.close()
+
+
+def consultar_estatisticas(destino):
+    conexao = http.client.HTTPConnection(destino.hostname, destino.port or 80, timeout=30)
+    conexao.request('GET', '/api/ingestao/estatisticas')
+    dados = json.loads(conexao.getresponse().read())
+    conexao.close()
+    return dados
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simula medidores enviando leituras para a API de ingestão')
+    parser.add_argument('--url', default='http://localhost:5000', help='Endereço do servidor')
+    parser.add_argument('--token', required=True, help='Token de ingestão')
+    parser.add_argument('--quadros', type=int, nargs='*', help='IDs dos quadros (padrão: todos os ativos do servidor)')
+    parser.add_argument('--medidores', type=int, default=200, help='Máximo de medidores simulados (um por quadro)')
+    parser.add_argument('--threads', type=int, default=8, help='Conexões simultâneas')
+    parser.add_argument('--lote', type=int, default=250, help='Leituras por requisição')
+    parser.add_argument('--intervalo', type=float, default=0, help='Pausa (s) entre lotes de cada conexão')
+    parser.add_argument('--duracao', type=float, default=30, help='Duração do teste em segundos')
+    parser.add_argument('--formato', choices=['json', 'csv'], default='json')
+    parser.add_argument('--chance-reset', type=float, default=0.0005, help='Probabilidade de um medidor zerar a cada leitura')
+    parser.add_argument('--aguardar', action='store_true', help='Pede resposta só após o commit (?aguardar=1)')
+    args = parser.parse_args()
+
+    destino = urllib.parse.urlsplit(args.url)
+    quadros = args.quadros or obter_quadros(args.url)
+    if not quadros:
+        print('❌ Nenhum quadro ativo encontrado no servidor')
+        return 1
+
+    medidores = [Medidor(quadro_id, obter_ultimo_valor(destino, quadro_id)) for quadro_id in quadros[:args.medidores]]
+    if args.medidores > len(quadros):
+        print(f'ℹ️  {len(quadros)} quadros disponíveis: usando um medidor por quadro')
+
+    gravadas_antes = consultar_estatisticas(destino).get('gravadas', 0)
+    resultados = [{'aceitas': 0, 'rejeitadas': 0, 'adiados': 0, 'erros': 0, 'latencias': [], 'ultimo_erro': None}
+                  for _ in range(args.threads)]
+
+    print(f'🚀 {args.threads} conexões, lotes de {args.lote} ({args.formato}), {len(medidores)} medidores, {args.duracao:.0f} s')
+    inicio = time.perf_counter()
+    fim = inicio + args.duracao
+    threads = [
+        threading.Thread(target=trabalhador, args=(args, destino, medidores, fim, resultado))
+        for resultado in resultados
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    decorrido = time.perf_counter() - inicio
+
+    aceitas = sum(r['aceitas'] for r in resultados)
+    rejeitadas = sum(r['rejeitadas'] for r in resultados)
+    adiados = sum(r['adiados'] for r in resultados)
+    erros = sum(r['erros'] for r in resultados)
+    latencias = sorted(l for r in resultados for l in r['latencias'])
+
+    # Espera o gravador terminar a fila para medir a vazão efetivamente gravada
+    while True:
+        estatisticas = consultar_estatisticas(destino)
+        if estatisticas.get('gravadas', 0) - gravadas_antes >= aceitas or time.perf_counter() - inicio > args.duracao * 3:
+            break
+        time.sleep(0.2)
+    decorrido_gravacao = time.perf_counter() - inicio
+    gravadas = estatisticas.get('gravadas', 0) - gravadas_antes
+
+    print(f'📨 Aceitas: {aceitas} ({aceitas / decorrido:,.0f} leituras/s) | rejeitadas: {rejeitadas} | '
+          f'503 (fila cheia): {adiados} | erros: {erros}')
+    if latencias:
+        p95 = latencias[int(len(latencias) * 0.95) - 1] if len(latencias) >= 20 else latencias[-1]
+        print(f'⏱️  Latência por lote: mediana {statistics.median(latencias) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms')
+    print(f'💾 Gravadas no banco: {gravadas} ({gravadas / decorrido_gravacao:,.0f} leituras/s), '
+          f'{estatisticas.get("media_por_lote", 0)} por commit em média, '
+          f'{estatisticas.get("tempo_medio_lote_ms", 0)} ms por commit')
+
+    ultimo_erro = next((r['ultimo_erro'] for r in resultados if r['ultimo_erro']), None)
+    if ultimo_erro:
+        print(f'⚠️  Último erro: {ultimo_erro}')
+    return 1 if erros else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,291 @@
+# ====================================================
+# SIMULADOR DE RONDA DE LEITURA (TESTE DE CARGA)
+# ====================================================
+#
+# Uso: python simulador_ronda.py [--url http://localhost:5000] [--leitores 30]
+#          [--quadros 60] [--duracao 120] [--acelerar 1] [--consolidar]
+#
+# Reproduz a ronda das 8h contra um servidor em execução:
+# - um supervisor inicia uma sessão, abre /revisao e faz o polling de 15 s da página
+#   (/api/sessao/status + /api/rascunhos/revisao);
+# - cada leitor abre /registrar, faz o polling de 5 s do mobile_form.html
+#   (/api/sessao/status + /api/rascunhos/mobile/sincronizar) e, entre uma consulta e outra,
+#   registra os quadros que lhe cabem em POST /registrar; de vez em quando o valor
+#   é menor que o anterior e a leitura é confirmada em POST /confirmar_reset.
+#
+# Ao final mostra, por rota, requisições/s, latência p50/p95/p99, erros e quantas
+# respostas indicaram banco travado ("database is locked"). A sessão criada é
+# encerrada (rascunhos apagados) ou, com --consolidar, consolidada.
+#
+# Se o servidor tiver menos quadros ativos que --quadros, os que faltam são criados
+# em POST /admin/quadros/criar com a localização "Teste de carga".
+#
+# Sai com código 1 se houver erros ou travamentos do banco.
+
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+
+LOCALIZACAO_TESTE = 'Teste de carga'
+
+# Respostas esperadas pelo mobile_form.html/revisao.html que não contam como erro
+STATUS_ESPERADOS = {200, 201, 409}
+
+
+class Estatisticas:
+    """Latências e contadores por rota, compartilhados entre as threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencias = defaultdict(list)
+        self.erros = defaultdict(int)
+        self.travamentos = defaultdict(int)
+        self.falhas_conexao = defaultdict(int)
+        self.ultimo_erro = {}
+
+    def registrar(self, rota, duracao, status, corpo):
+        with self.lock:
+            self.latencias[rota].append(duracao)
+            if b'locked' in corpo:
+                self.travamentos[rota] += 1
+            if status not in STATUS_ESPERADOS:
+                self.erros[rota] += 1
+                self.ultimo_erro[rota] = f'{status}: {corpo[:200].decode(errors="replace")}'
+
+    def registrar_falha(self, rota, erro):
+        with self.lock:
+            self.erros[rota] += 1
+            self.falhas_conexao[rota] += 1
+            self.ultimo_erro[rota] = str(erro)
+
+
+class Cliente:
+    """Conexão HTTP de um aparelho (celular ou PC do supervisor) que mede cada chamada"""
+
+    def __init__(self, destino, estatisticas):
+        self.destino = destino
+        self.estatisticas = estatisticas
+        self.conexao = None
+
+    def chamar(self, metodo, caminho, rota, corpo=None, tipo=None):
+        """Faz a requisição e devolve (status, JSON) ou (None, None) se a conexão falhar"""
+        cabecalhos = {'Content-Type': tipo} if tipo else {}
+        inicio = time.perf_counter()
+        try:
+            if self.conexao is None:
+                self.conexao = http.client.HTTPConnection(self.destino.hostname, self.destino.port or 80, timeout=60)
+            self.conexao.request(metodo, caminho, body=corpo, headers=cabecalhos)
+            resposta = self.conexao.getresponse()
+            dados = resposta.read()
+        except (OSError, http.client.HTTPException) as e:
+            if self.conexao is not None:
+                self.conexao.close()
+            self.conexao = None
+            self.estatisticas.registrar_falha(rota, e)
+            return None, None
+
+        self.estatisticas.registrar(rota, time.perf_counter() - inicio, resposta.status, dados)
+        try:
+            return resposta.status, json.loads(dados)
+        except ValueError:
+            return resposta.status, None
+
+    def formulario(self, caminho, rota, campos):
+        return self.chamar('POST', caminho, rota, urllib.parse.urlencode(campos), 'application/x-www-form-urlencoded')
+
+    def json(self, caminho, rota, dados):
+        return self.chamar('POST', caminho, rota, json.dumps(dados), 'application/json')
+
+    def fechar(self):
+        if self.conexao is not None:
+            self.conexao.close()
+
+
+def consultar(destino, metodo, caminho, campos=None):
+    """Chamada de preparação (fora das estatísticas)"""
+    conexao = http.client.HTTPConnection(destino.hostname, destino.port or 80, timeout=60)
+    corpo = urllib.parse.urlencode(campos) if campos is not None else None
+    cabecalhos = {'Content-Type': 'application/x-www-form-urlencoded'} if campos is not None else {}
+    conexao.request(metodo, caminho, body=corpo, headers=cabecalhos)
+    resposta = conexao.getresponse()
+    dados = json.loads(resposta.read() or b'{}')
+    conexao.close()
+    return resposta.status, dados
+
+
+def preparar_quadros(destino, total):
+    """IDs de `total` quadros ativos, criando os que faltarem"""
+    _, quadros = consultar(destino, 'GET', '/quadros')
+    ids = [q['id'] for q in quadros]
+    numero = 1
+    while len(ids) < total:
+        status, dados = consultar(destino, 'POST', '/admin/quadros/criar',
+                                  {'nome': f'Carga {numero:03d}', 'localizacao': LOCALIZACAO_TESTE})
+        numero += 1
+        if status == 201:
+            ids.append(dados['quadro']['id'])
+        elif 'Já existe' not in dados.get('erro', ''):
+            raise RuntimeError(f"Não foi possível criar quadros: {dados.get('erro')}")
+    return ids[:total]
+
+
+def leitor(args, destino, estatisticas, sessao_id, quadros, valores, fim):
+    """Um celular: polling de 5 s e registro dos seus quadros, um a um, em ritmo de ronda"""
+    cliente = Cliente(destino, estatisticas)
+    filtro = f'?sessao_id={sessao_id}'
+    intervalo_polling = 5 / args.acelerar
+    pendentes = list(quadros)
+    random.shuffle(pendentes)
+    cursor = None
+
+    cliente.chamar('GET', f'/registrar{filtro}', 'GET /registrar')
+
+    # Os aparelhos abrem a página em momentos diferentes
+    agora = time.perf_counter()
+    proxima_consulta = agora + random.uniform(0, intervalo_polling)
+    proximo_registro = agora + random.uniform(args.pausa_min, args.pausa_max) / args.acelerar
+
+    while agora < fim:
+        if agora >= proxima_consulta:
+            cliente.chamar('GET', f'/api/sessao/status{filtro}', 'GET /api/sessao/status')
+            # Como a página: só o que mudou desde o último cursor
+            desde = f'&desde={cursor}' if cursor is not None else ''
+            status, dados = cliente.chamar('GET', f'/api/rascunhos/mobile/sincronizar{filtro}{desde}',
+                                           'GET /api/rascunhos/mobile/sincronizar')
+            if status == 200 and dados:
+                cursor = dados.get('cursor')
+            proxima_consulta += intervalo_polling
+
+        if agora >= proximo_registro:
+            # Terminada a ronda, o leitor volta a conferir os quadros (regravações)
+            if not pendentes:
+                pendentes = list(quadros)
+                random.shuffle(pendentes)
+            quadro_id = pendentes.pop()
+
+            if random.random() < args.chance_reset:
+                novo_valor = round(random.uniform(0, 10), 2)
+            else:
+                novo_valor = round(valores[quadro_id] + random.uniform(10, 200), 2)
+
+            status, dados = cliente.formulario('/registrar', 'POST /registrar',
+                                               {'quadro_id': quadro_id, 'novo_valor': novo_valor})
+            if status == 409 and dados and dados.get('inconsistencia'):
+                cliente.formulario('/confirmar_reset', 'POST /confirmar_reset',
+                                   {'quadro_id': quadro_id, 'novo_valor': novo_valor})
+            proximo_registro = time.perf_counter() + random.uniform(args.pausa_min, args.pausa_max) / args.acelerar
+
+        agora = time.perf_counter()
+        time.sleep(max(0, min(proxima_consulta, proximo_registro, fim) - agora))
+        agora = time.perf_counter()
+
+    cliente.fechar()
+
+
+def supervisor(args, destino, estatisticas, sessao_id, fim):
+    """PC do supervisor: abre /revisao e faz o polling de 15 s da página"""
+    cliente = Cliente(destino, estatisticas)
+    filtro = f'?sessao_id={sessao_id}'
+    intervalo_polling = 15 / args.acelerar
+
+    cliente.chamar('GET', f'/revisao{filtro}', 'GET /revisao')
+    proxima_consulta = time.perf_counter() + intervalo_polling
+    while True:
+        espera = min(proxima_consulta, fim) - time.perf_counter()
+        if espera > 0:
+            time.sleep(espera)
+        if time.perf_counter() >= fim:
+            break
+        cliente.chamar('GET', f'/api/sessao/status{filtro}', 'GET /api/sessao/status')
+        cliente.chamar('GET', f'/api/rascunhos/revisao{filtro}', 'GET /api/rascunhos/revisao')
+        proxima_consulta += intervalo_polling
+
+    # Fim da ronda: consolida (se pedido) ou descarta os rascunhos da sessão de teste
+    if args.consolidar:
+        cliente.chamar('GET', f'/verificar_conflitos{filtro}', 'GET /verificar_conflitos')
+        cliente.json('/consolidar', 'POST /consolidar', {'decisoes': {}, 'sessao_id': sessao_id})
+    else:
+        cliente.json('/api/sessao/encerrar', 'POST /api/sessao/encerrar', {'sessao_id': sessao_id})
+    cliente.fechar()
+
+
+def percentil(valores, fracao):
+    """Percentil pelo posto mais próximo (valores já ordenados)"""
+    return valores[max(0, min(len(valores) - 1, int(len(valores) * fracao + 0.5) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simula uma ronda de leitura completa contra um servidor em execução')
+    parser.add_argument('--url', default='http://localhost:5000', help='Endereço do servidor')
+    parser.add_argument('--leitores', type=int, default=30, help='Celulares fazendo a ronda')
+    parser.add_argument('--quadros', type=int, default=60, help='Quadros na sessão (criados se faltarem)')
+    parser.add_argument('--duracao', type=float, default=120, help='Duração da ronda em segundos')
+    parser.add_argument('--acelerar', type=float, default=1, help='Divide os intervalos de polling e as pausas (ex.: 5)')
+    parser.add_argument('--pausa-min', type=float, default=5, help='Pausa mínima (s) entre dois registros de um leitor')
+    parser.add_argument('--pausa-max', type=float, default=20, help='Pausa máxima (s) entre dois registros de um leitor')
+    parser.add_argument('--chance-reset', type=float, default=0.02, help='Probabilidade de um registro ser uma virada do medidor')
+    parser.add_argument('--consolidar', action='store_true', help='Consolida a sessão no fim em vez de descartar os rascunhos')
+    args = parser.parse_args()
+
+    destino = urllib.parse.urlsplit(args.url)
+    quadros = preparar_quadros(destino, args.quadros)
+    valores = {q: consultar(destino, 'GET', f'/quadro/{q}/ultima-leitura')[1].get('valor') or 0.0 for q in quadros}
+
+    status, dados = consultar(destino, 'POST', '/api/sessao/iniciar',
+                              {'nome': 'Teste de carga', 'quadro_ids': ','.join(map(str, quadros))})
+    if status != 200:
+        print(f"❌ Não foi possível iniciar a sessão: {dados.get('mensagem')}")
+        return 1
+    sessao_id = dados['sessao']['id']
+
+    # Cada leitor fica com uma fatia dos quadros, como as equipes dividem a ronda
+    fatias = [quadros[i::args.leitores] for i in range(args.leitores)]
+    estatisticas = Estatisticas()
+
+    print(f'🚶 {args.leitores} leitores, {len(quadros)} quadros, sessão {sessao_id}, '
+          f'{args.duracao:.0f} s (polling a cada {5 / args.acelerar:g} s / {15 / args.acelerar:g} s)')
+    inicio = time.perf_counter()
+    fim = inicio + args.duracao
+    threads = [threading.Thread(target=supervisor, args=(args, destino, estatisticas, sessao_id, fim))]
+    threads += [
+        threading.Thread(target=leitor, args=(args, destino, estatisticas, sessao_id, fatia, valores, fim))
+        for fatia in fatias if fatia
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    decorrido = time.perf_counter() - inicio
+
+    print(f"\n{'Rota':<30} {'req':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'máx ms':>8} {'erros':>7} {'travas':>7}")
+    total = total_erros = total_travamentos = 0
+    for rota in sorted(set(estatisticas.latencias) | set(estatisticas.erros)):
+        latencias = sorted(estatisticas.latencias[rota])
+        erros = estatisticas.erros[rota]
+        travamentos = estatisticas.travamentos[rota]
+        quantidade = len(latencias) + estatisticas.falhas_conexao[rota]
+        total += quantidade
+        total_erros += erros
+        total_travamentos += travamentos
+        if latencias:
+            p50, p95, p99, maximo = (percentil(latencias, f) * 1000 for f in (0.50, 0.95, 0.99, 1.0))
+        else:
+            p50 = p95 = p99 = maximo = 0
+        print(f'{rota:<30} {quantidade:>6} {quantidade / decorrido:>7.1f} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} '
+              f'{maximo:>8.1f} {erros / max(quantidade, 1):>6.1%} {travamentos:>7}')
+
+    print(f'\n📨 {total} requisições em {decorrido:.1f} s ({total / decorrido:.1f} req/s) | '
+          f'erros: {total_erros} ({total_erros / max(total, 1):.2%}) | banco travado: {total_travamentos}')
+    for rota, erro in sorted(estatisticas.ultimo_erro.items()):
+        print(f'⚠️  {rota}: {erro}')
+    return 1 if total_erros or total_travamentos else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
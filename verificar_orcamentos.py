@@ -0,0 +1,200 @@
+# ====================================================
+# VERIFICAÇÃO DO ORÇAMENTO DE CONSULTAS POR ROTA
+# ====================================================
+#
+# Uso: python verificar_orcamentos.py [--quadros 3 30]
+#
+# Cria um banco temporário, popula com poucos quadros e depois com muitos, e chama
+# as rotas que têm @orcamento_consultas. Em modo estrito a rota que passar do
+# orçamento responde 500. Como o banco cresce entre as rodadas, uma consulta por
+# linha (N+1) estoura o orçamento na rodada maior.
+#
+# Sai com código 1 se alguma rota falhar ou passar do orçamento.
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+PASTA_APP = os.path.dirname(os.path.abspath(__file__))
+PASTA_TEMP = tempfile.mkdtemp(prefix='energia_orcamento_')
+
+# O banco precisa ser definido antes de importar o app
+os.environ['ENERGIA_BANCO_URI'] = 'sqlite:///' + os.path.join(PASTA_TEMP, 'energia.db').replace('\\', '/')
+sys.path.insert(0, PASTA_APP)
+
+import app as energia  # noqa: E402
+
+DIAS_HISTORICO = 60
+TOKEN_INGESTAO = 'token-verificacao-orcamentos'
+
+
+def rotas_verificadas():
+    """(método, url, argumentos do cliente de teste) de cada chamada feita por rodada"""
+    hoje = datetime.now().date()
+    periodo = f'data_inicio={(hoje - timedelta(days=30)).isoformat()}&data_fim={hoje.isoformat()}'
+    return [
+        ('GET', '/', {}),
+        ('GET', '/registrar', {}),
+        ('POST', '/registrar', {'data': {'quadro_id': 1, 'novo_valor': 999999}}),
+        ('GET', '/api/sessao/status', {}),
+        ('GET', '/quadro/1/ultima-leitura', {}),
+        ('GET', '/revisao', {}),
+        ('GET', '/revisao?sessao_id=1', {}),
+        ('GET', '/api/rascunhos/revisao', {}),
+        ('GET', '/api/rascunhos/mobile', {}),
+        ('GET', '/api/rascunhos/mobile?sessao_id=1', {}),
+        ('GET', '/api/rascunhos/mobile/sincronizar?sessao_id=1', {}),
+        ('GET', '/api/rascunhos/mobile/sincronizar?sessao_id=1&desde=1', {}),
+        ('GET', '/verificar_conflitos', {}),
+        ('GET', '/verificar_conflitos?sessao_id=1', {}),
+        ('GET', '/leituras', {}),
+        ('GET', '/leituras?compact=1', {}),
+        ('GET', '/api/leituras?limite=20&campos=id,quadro_nome,data_registro,consumo_dia', {}),
+        ('GET', f'/api/analise/dados?{periodo}', {}),
+        ('GET', f'/api/analise/dados?{periodo}&compact=1', {}),
+        ('GET', f'/api/analise/dados?{periodo}&distribuir=1', {}),
+        ('GET', f'/api/analise/dados?{periodo}&compact=1&distribuir=1', {}),
+        ('GET', '/api/custos', {}),
+        ('GET', '/quadros', {}),
+        ('GET', '/api/quadros/buscar?q=quadro&por_pagina=10', {}),
+        ('GET', '/api/quadros/buscar?q=qu&mobile=1&sessao_id=1', {}),
+        ('GET', '/admin/quadros', {}),
+        ('GET', '/admin/quadros/etiquetas', {}),
+        ('POST', '/consolidar', {'json': {'decisoes': {}, 'sessao_id': 1}}),
+        ('POST', '/consolidar', {'json': {'decisoes': {}}}),
+        ('POST', '/api/ingestao/leituras?aguardar=1', {
+            'json': {'leituras': [{'quadro_id': 1, 'valor': 999999}]},
+            'headers': {'Authorization': f'Bearer {TOKEN_INGESTAO}'}
+        }),
+    ]
+
+
+def popular(ate_quadros):
+    """Completa o banco até ter ate_quadros quadros com histórico e um rascunho cada"""
+    db = energia.db
+    inicio = datetime.now() - timedelta(days=DIAS_HISTORICO)
+
+    atuais = energia.Quadro.query.count()
+    for i in range(atuais, ate_quadros):
+        quadro = energia.Quadro(nome=f'Quadro {i + 1:03d}', localizacao=f'Prédio {i % 4 + 1}')
+        db.session.add(quadro)
+        db.session.flush()
+
+        valor = 1000.0
+        for dia in range(DIAS_HISTORICO):
+            consumo = random.uniform(50, 150)
+            valor += consumo
+            db.session.add(energia.Leitura(
+                quadro_id=quadro.id,
+                data_registro=(inicio + timedelta(days=dia)).replace(hour=8, minute=0, second=0),
+                valor_leitura=valor,
+                consumo_dia=consumo
+            ))
+    db.session.commit()
+
+    if not energia.TokenIngestao.query.first():
+        db.session.add(energia.TokenIngestao(nome='verificação', token_hash=energia.hash_token(TOKEN_INGESTAO)))
+
+    # Tarifa geral com faixas e outra só de um quadro, para o cálculo de custos usar as duas
+    if not energia.Tarifa.query.first():
+        for quadro_id in (None, 1):
+            tarifa = energia.Tarifa(nome='Verificação', quadro_id=quadro_id, vigencia_inicio=inicio.date())
+            tarifa.periodos.append(energia.TarifaPeriodo(nome='Único', fracao=1, preco_kwh=0.8))
+            tarifa.faixas.append(energia.TarifaFaixa(acima_de_kwh=1000, adicional_kwh=0.1))
+            db.session.add(tarifa)
+
+    # Duas sessões simultâneas (quadros pares e ímpares), como duas equipes em prédios diferentes
+    energia.LeituraRascunho.query.delete()
+    energia.SessaoQuadro.query.delete()
+    energia.SessaoLeitura.query.delete()
+    sessoes = [energia.SessaoLeitura(ativa=True, nome='Equipe A'), energia.SessaoLeitura(ativa=True, nome='Equipe B')]
+    db.session.add_all(sessoes)
+    db.session.flush()
+
+    # Um rascunho por quadro (metade conflitando com leitura oficial de hoje)
+    for quadro in energia.Quadro.query.all():
+        sessao = sessoes[quadro.id % 2]
+        db.session.add(energia.SessaoQuadro(sessao_id=sessao.id, quadro_id=quadro.id))
+        ultima = energia.Leitura.query.filter_by(quadro_id=quadro.id)\
+            .order_by(energia.Leitura.data_registro.desc()).first()
+        if quadro.id % 2 == 0 and ultima.data_registro.date() < datetime.now().date():
+            db.session.add(energia.Leitura(
+                quadro_id=quadro.id, data_registro=datetime.now().replace(hour=7),
+                valor_leitura=ultima.valor_leitura + 10, consumo_dia=10
+            ))
+            ultima_valor = ultima.valor_leitura + 10
+        else:
+            ultima_valor = ultima.valor_leitura if ultima else 0
+        db.session.add(energia.LeituraRascunho(
+            quadro_id=quadro.id, sessao_id=sessao.id, valor_leitura=ultima_valor + 80, consumo_provisorio=80
+        ))
+    db.session.commit()
+
+    energia.reconstruir_consumo_diario()
+    db.session.commit()
+
+
+def executar_rodada(cliente, total_quadros):
+    """Chama todas as rotas e devolve [(url, consultas, orçamento, status)]"""
+    with energia.app.app_context():
+        popular(total_quadros)
+
+    resultados = []
+    for metodo, url, argumentos in rotas_verificadas():
+        # Sem cache de fragmentos, para medir o pior caso de cada rota
+        energia.cache_fragmentos.limpar()
+        energia.cache_estados_mobile.limpar()
+        energia._cache_perfil_planta['data'] = None
+        resposta = cliente.open(url, method=metodo, **argumentos)
+        consultas = int(resposta.headers.get('X-Consultas-SQL', 0))
+        endpoint = energia.app.url_map.bind('localhost').match(url.split('?')[0], method=metodo)[0]
+        sufixo = (' (compact)' if 'compact=1' in url else '') + \
+            (' (distribuído)' if 'distribuir=1' in url else '') + \
+            (' (sessão)' if 'sessao_id' in url or 'sessao_id' in argumentos.get('json', {}) else '')
+        resultados.append((f'{metodo} {url.split("?")[0]}' + sufixo,
+                           consultas, energia.ORCAMENTOS_CONSULTAS.get(endpoint), resposta.status_code))
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verifica o orçamento de consultas SQL das rotas')
+    parser.add_argument('--quadros', type=int, nargs='+', default=[3, 30], help='Tamanhos do banco em cada rodada')
+    args = parser.parse_args()
+
+    random.seed(42)
+    energia.app.config['ORCAMENTO_CONSULTAS_ESTRITO'] = True
+    energia.app.config['ETIQUETAS_PASTA'] = os.path.join(PASTA_TEMP, 'etiquetas_qr')
+    cliente = energia.app.test_client()
+
+    with energia.app.app_context():
+        energia.db.create_all()
+
+    falhou = False
+    try:
+        for total_quadros in sorted(args.quadros):
+            print(f'\n📊 Rodada com {total_quadros} quadros')
+            for rota, consultas, orcamento, status in executar_rodada(cliente, total_quadros):
+                if orcamento is None:
+                    marca = '⚠️ '
+                    falhou = True
+                elif status >= 500 or consultas > orcamento:
+                    marca = '❌'
+                    falhou = True
+                else:
+                    marca = '✅'
+                print(f'{marca} {rota:<50} {consultas:>4} consultas (orçamento: {orcamento if orcamento is not None else "não declarado"}) [{status}]')
+    finally:
+        with energia.app.app_context():
+            energia.db.engine.dispose()
+        shutil.rmtree(PASTA_TEMP, ignore_errors=True)
+
+    print('\n' + ('❌ Há rotas acima do orçamento ou sem orçamento declarado' if falhou else '✅ Todas as rotas dentro do orçamento'))
+    return 1 if falhou else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())